@@ -126,7 +126,7 @@ class Holmes(nn.Module):
 
     def forward(self, x):
         x = self.encoder2d(x)
-        x = x.view(x.shape[0], self.in_channels_1d, -1)
+        x = x.reshape(x.shape[0], self.in_channels_1d, -1)  # The 2-D output may be channels-last
         x = self.encoder1d(x)
         x = self.classifier(x)
         x = x.view(x.shape[0], -1)
@@ -42,7 +42,7 @@ class RF(nn.Module):
         Tensor: Output tensor after passing through the network.
         """
         x = self.first_layer(x)
-        x = x.view(x.size(0), self.first_layer_out_channel, -1)
+        x = x.reshape(x.size(0), self.first_layer_out_channel, -1)  # The 2-D output may be channels-last
         x = self.features(x)
         x = self.classifier(x)
         x = x.view(x.size(0), -1)
@@ -5,9 +5,83 @@ import numpy as np
 import pyshark 
 from pathlib import Path
 import re
-from typing import List, Callable
+import os
+import multiprocessing
+import zipfile
+import collections
+import hashlib
+from typing import List, Callable, Union, Iterable, Iterator
+from WFlib.tools.capture import stream_extract_filter
+from WFlib.tools.keylog import KeylogIndex
+from WFlib.tools.sni import SNI_stream_numbers
+from WFlib.tools.formatter import Extractor, dump_ragged
+from WFlib.tools.dissection import export_table
+from WFlib.tools.model_utils import model_digest
+
+def attribution_model(model, attr_method):
+    """
+    Initialize the attribution model based on the chosen method.
+    """
+    if attr_method in ["DeepLiftShap"]:
+        return eval(f"attr.{attr_method}")(model)
+    return eval(f"attr.{attr_method}")(model.forward)
+
+def attribution_inputs(X, y, num_classes):
+    """
+    Prepare background and test data for each class, i.e., the first 2 samples of each class as background,
+    and the next 10 samples for testing.
+
+    Returns
+    -------
+    bg_traffic : torch.Tensor
+        The background samples of all classes concatenated.
+
+    test_traffic : List[torch.Tensor]
+        The test samples of each class.
+    """
+    bg_traffic = []
+    test_traffic = []
+    for web in range(num_classes):
+        bg_test_X = X[y == web]
+        assert bg_test_X.shape[0] >= 12
+        bg_traffic.append(bg_test_X[0:2])  # Use the first 2 samples as background
+        test_traffic.append(bg_test_X[2:12])  # Use the next 10 samples for testing
+
+    # Concatenate all background traffic into a single tensor
+    return torch.concat(bg_traffic, axis=0), test_traffic
+
+def batch_class_attr(attr_model, bg_traffic, test_traffic, classes) -> list:
+    """
+    Calculate the attribution values of several classes with a single attribute call, where the test samples
+    of the classes are concatenated and each of them is attributed to its own class.
+    """
+    inputs = torch.concat([test_traffic[web] for web in classes], axis=0)
+    target = torch.tensor([web for web in classes for _ in range(len(test_traffic[web]))], device=inputs.device)
+    attr_result = attr_model.attribute(inputs, bg_traffic, target=target).detach().cpu().numpy()
+
+    attr_values = []
+    start = 0
+    for web in classes:
+        # Aggregate the attribution results of each class
+        end = start + len(test_traffic[web])
+        attr_values.append(attr_result[start:end].squeeze().sum(axis=0).sum(axis=0))
+        start = end
+    return attr_values
+
+def shard_feature_attr(model, attr_method, bg_traffic, test_traffic, class_batches, num_threads=None) -> list:
+    """
+    The single-process task of feature_attr, which handles a shard of the class batches. It must be in the
+    top-level (importable) scope.
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)  # Avoid oversubscribing the CPUs among the workers
+    model.eval()
+    attr_model = attribution_model(model, attr_method)
+    return [attr_values for classes in class_batches
+            for attr_values in batch_class_attr(attr_model, bg_traffic, test_traffic, classes)]
 
-def feature_attr(model, attr_method, X, y, num_classes):
+def feature_attr(model, attr_method, X, y, num_classes, classes_per_batch=1, num_workers=1, device="cpu",
+                 cache=None):
     """
     Calculate feature attributions for a given model using a specified attribution method.
     
@@ -17,44 +91,94 @@ def feature_attr(model, attr_method, X, y, num_classes):
     - X: The input data (features) as a numpy array or torch tensor.
     - y: The labels for the input data.
     - num_classes: The number of distinct classes in the data.
+    - classes_per_batch: The number of classes attributed by one attribute call.
+    - num_workers: The number of processes, each of which handles a shard of the classes. Only CPU supports
+      multiple workers.
+    - device: The device to run the attribution.
+    - cache: The AttributionCache to reuse the results of the same model, method and inputs.
     
     Returns:
     - attr_values: An array of attribution values for each class.
     """
-    
-    # Set the model to evaluation mode
-    model.eval()
-    
-    # Initialize the attribution model based on the chosen method
-    if attr_method in ["DeepLiftShap"]:
-        attr_model = eval(f"attr.{attr_method}")(model)
+    bg_traffic, test_traffic = attribution_inputs(X, y, num_classes)
+    if cache is not None:
+        path = cache.path(model, attr_method, bg_traffic, test_traffic)
+        if path.exists():
+            return cache.load(path)
+
+    device = torch.device(device)
+    model = model.to(device)
+    bg_traffic = bg_traffic.to(device)
+    test_traffic = [test_X.to(device) for test_X in test_traffic]
+    class_batches = [list(range(web, min(web + classes_per_batch, num_classes)))
+                     for web in range(0, num_classes, classes_per_batch)]
+
+    if num_workers <= 1 or device.type != "cpu":
+        model.eval()
+        attr_model = attribution_model(model, attr_method)
+        attr_values = []
+        # Iterate over each batch of classes to calculate attribution values
+        for classes in tqdm(class_batches):
+            attr_values += batch_class_attr(attr_model, bg_traffic, test_traffic, classes)
     else:
-        attr_model = eval(f"attr.{attr_method}")(model.forward)
-    
-    # Prepare background and test data for each class
-    bg_traffic = []
-    test_traffic = {}
-    for web in range(num_classes):
-        bg_test_X = X[y == web]
-        assert bg_test_X.shape[0] >= 12
-        bg_traffic.append(bg_test_X[0:2])  # Use the first 2 samples as background
-        test_traffic[web] = bg_test_X[2:12]  # Use the next 10 samples for testing
-
-    # Concatenate all background traffic into a single tensor
-    bg_traffic = torch.concat(bg_traffic, axis=0)
+        # Interleave the class batches among the shards to balance them
+        shards = [class_batches[i::num_workers] for i in range(num_workers)]
+        num_threads = max(1, torch.get_num_threads() // num_workers)
+        # The workers are spawned instead of forked, since forking a process that has used the OpenMP threads
+        # of torch may deadlock.
+        with multiprocessing.get_context("spawn").Pool(num_workers) as pool:
+            results = pool.starmap(shard_feature_attr, [(model, attr_method, bg_traffic, test_traffic, shard, num_threads)
+                                                        for shard in shards])
+        # Restore the order of the classes
+        attr_values = [None] * num_classes
+        for shard, result in zip(shards, results):
+            for web, values in zip([web for classes in shard for web in classes], result):
+                attr_values[web] = values
 
-    attr_values = []
-    # Iterate over each class to calculate attribution values
-    for web in tqdm(range(num_classes)):
-        # Calculate attributions for the test samples using the background samples
-        attr_result = attr_model.attribute(test_traffic[web], bg_traffic, target=web)
-        # Aggregate the attribution results
-        attr_result = attr_result.detach().numpy().squeeze().sum(axis=0).sum(axis=0)
-        attr_values.append(attr_result)
-    
     attr_values = np.array(attr_values)
+    if cache is not None:
+        cache.save(path, attr_values)
     return attr_values  # Return the attribution values
 
+"""
+The version of the attribution results, bump it whenever feature_attr changes the results to invalidate the cache.
+"""
+attribution_version = 1
+
+class AttributionCache(object):
+    """
+    The on-disk cache of the attribution values, one .npz file per (model checkpoint, method, inputs).
+
+    Params
+    ------
+    cache_dir : str
+        The directory of the cache, created if not exists.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, model, attr_method, bg_traffic, test_traffic) -> str:
+        digest = hashlib.sha256(f"{attribution_version}\n{type(model).__name__}\n{attr_method}\n".encode())
+        model_digest(model, digest)
+        for inputs in [bg_traffic, *test_traffic]:
+            digest.update(str(tuple(inputs.shape)).encode())
+            digest.update(inputs.detach().cpu().numpy().tobytes())
+        return digest.hexdigest()
+
+    def path(self, model, attr_method, bg_traffic, test_traffic) -> Path:
+        return self.cache_dir / f"{self.key(model, attr_method, bg_traffic, test_traffic)}.npz"
+
+    def load(self, path) -> np.ndarray:
+        with np.load(path) as data:
+            return data['attr_values']
+
+    def save(self, path, attr_values):
+        # Write to a temporary file first, such that concurrent readers never see partial results.
+        tmp_path = Path(path).with_suffix(f".{os.getpid()}.tmp.npz")
+        np.savez(tmp_path, attr_values=attr_values)
+        os.replace(tmp_path, path)
+
 def packet_count(capture):
     """
     Count the number of packets within the given capture, possible display filter may be applied.
@@ -106,6 +230,13 @@ class ByteCounter():
         Count the byte number of proto layer within the given packet.
         """
         raise NotImplementedError()
+
+    def column_count(self, table) -> np.ndarray:
+        """
+        Count the byte number of proto layer within each frame of a DissectionTable (see WFlib.tools.dissection),
+        the vectorized counterpart of packet_count without tshark.
+        """
+        raise NotImplementedError()
     
 
 class HTTP3ByteCounter(ByteCounter):
@@ -140,6 +271,11 @@ class HTTP3ByteCounter(ByteCounter):
 
         return cnt
 
+    def column_count(self, table) -> np.ndarray:
+        if 'http3_bytes.values' not in table:
+            raise ValueError("The table has no http3_bytes column, which the fields-export backend could not provide.")
+        return table.frame_sum(*table.ragged('http3_bytes'))
+
 class HTTP2ByteCounter(ByteCounter):
     def __init__(self, name='http2'):
         super().__init__(name)
@@ -157,6 +293,11 @@ class HTTP2ByteCounter(ByteCounter):
             cnt += sum(h2_layer_lengths)
 
         return cnt
+
+    def column_count(self, table) -> np.ndarray:
+        types, offsets = table.ragged('http2_type')
+        lengths, _ = table.ragged('http2_length')
+        return table.frame_sum(np.where(types >= 0, lengths + self.header_len, self.preface_len), offsets)
     
 
 class TLSByteCounter(ByteCounter):
@@ -183,6 +324,10 @@ class TLSByteCounter(ByteCounter):
             cnt += sum(tls_layer_lengths)
 
         return cnt
+
+    def column_count(self, table) -> np.ndarray:
+        lengths, offsets = table.ragged('tls_record_length')
+        return table.frame_sum(lengths + self.type_len + self.ver_len + self.length_len, offsets)
     
 
 class QUICByteCounter(ByteCounter):
@@ -214,6 +359,10 @@ class QUICByteCounter(ByteCounter):
 
         return cnt
 
+    def column_count(self, table) -> np.ndarray:
+        packet_lengths = table.frame_sum(*table.ragged('quic_packet_length'))
+        return np.where(table['quic_padded'], table['udp_bytes'] - self.udp_hdr_len, packet_lengths)
+
 class TCPByteCounter(ByteCounter):
     def __init__(self, name='tcp'):
         super().__init__(name)
@@ -227,6 +376,9 @@ class TCPByteCounter(ByteCounter):
             cnt += self.layer_count(tcp_layer)
 
         return cnt
+
+    def column_count(self, table) -> np.ndarray:
+        return table['tcp_bytes']
     
 
 class UDPByteCounter(ByteCounter):
@@ -243,6 +395,9 @@ class UDPByteCounter(ByteCounter):
             cnt += self.layer_count(udp_layer)
 
         return cnt
+
+    def column_count(self, table) -> np.ndarray:
+        return table['udp_bytes']
     
 
 class CaptureCounter():
@@ -260,16 +415,262 @@ class CaptureCounter():
                 result[counter.name][1] += cnt  
 
         return result
-    
+
+    def count_table(self, table, mask=None):
+        """
+        The same as count, but against a DissectionTable, where mask selects the frames (e.g., of some streams) as
+        a display filter would do.
+        """
+        result = dict()
+        for counter in self.counters:
+            cnt = counter.column_count(table)
+            if mask is not None:
+                cnt = cnt[mask]
+            result[counter.name] = [int(np.count_nonzero(cnt > 0)), int(cnt.sum())]
+
+        return result
+
+    def count_columns(self, file, keylog_file=None, display_filter=None, custom_parameters=None):
+        """
+        The same as count over the capture opened with the display filter, but against the table built by the tshark
+        fields export (see WFlib.tools.dissection.export_table), which skips the per-packet PyShark objects. Note that
+        HTTP3ByteCounter is not supported by the fields export.
+        """
+        table = export_table(file, keylog_file=keylog_file, display_filter=display_filter,
+                             custom_parameters=custom_parameters)
+        return self.count_table(table)
+
+"""
+The columns of the statistics table, one row per (file, stream, protocol), see batch_statistics.
+"""
+stat_columns = ['host', 'file', 'stream', 'protocol', 'packets', 'bytes']
+
+def default_stat_counters(cache=None) -> list:
+    """
+    The default counters of stream_statistics. The HTTP/3 counter is left out for the fields-export backend of
+    DissectionCache, whose tables have no http3_bytes column (see HTTP3ByteCounter.column_count).
+    """
+    counters = [TCPByteCounter(), TLSByteCounter(), HTTP2ByteCounter(), UDPByteCounter(), QUICByteCounter()]
+    if cache is None or cache.backend != 'fields':
+        counters.append(HTTP3ByteCounter())
+    return counters
+
+def contains_data_frame(pkt) -> bool:
+    """
+    Check whether the packet carries HTTP/2 or HTTP/3 DATA frames, i.e., http2.type == 0 or http3.frame_type == 0.
+    """
+    for layer in pkt.layers:
+        if layer.layer_name == "http2" and hasattr(layer, "type"):
+            if any(int(field.show, 0) == 0 for field in layer.type.all_fields):
+                return True
+        elif layer.layer_name == "http3" and hasattr(layer, "frame_type"):
+            if any(int(field.show, 0) == 0 for field in layer.frame_type.all_fields):
+                return True
+    return False
+
+def stream_statistics(file, SNIs, keylog_file=None, counters=None, require_data=True, custom_parameters=None,
+                      cache=None) -> list:
+    """
+    Count the packets and bytes of each protocol within each stream of the given SNIs in a single decrypting pass,
+    which replaces h2data_SNI_intersect/h3data_SNI_intersect and CaptureCounter. The streams of the SNIs are found by
+    the native parser (see WFlib.tools.sni), and the streams carrying HTTP/2 or HTTP/3 DATA frames are recognized
+    during the same pass.
+
+    Params
+    ------
+    file : str
+        The path to the .pcap(ng) file.
+
+    SNIs : Iterable[str]
+        The SNIs whose streams are counted.
+
+    keylog_file : str
+        The key log file to decrypt the capture.
+
+    counters : List[ByteCounter]
+        The byte counters applied to each packet, default_stat_counters(cache) by default. HTTP3ByteCounter is
+        rejected with the fields-export backend of DissectionCache.
+
+    require_data : bool
+        Whether to count only the streams carrying DATA frames, the same as the *_SNI_intersect functions.
+
+    custom_parameters : list
+        The parameters passed to tshark, ["-C", "Customized", "-2"] (two-pass dissection) by default.
+
+    cache : DissectionCache
+        If given, the counters run against the cached per-frame table (see WFlib.tools.dissection), which is
+        dissected once (without display filter) for the first time.
+
+    Returns
+    -------
+    rows : List[Tuple[int, str, int, int]]
+        (stream, protocol, packets, bytes) sorted by the stream, where the protocol is the name of the counter, the
+        stream is the tcp.stream for tcp/tls/http2 and the udp.stream for udp/quic/http3. As CaptureCounter, a
+        packet is counted by a counter only if the byte count is non-zero, and the rows with no packets are omitted.
+    """
+    counters = default_stat_counters(cache) if counters is None else counters
+    if cache is not None and cache.backend == 'fields' and any(isinstance(counter, HTTP3ByteCounter) for counter in counters):
+        raise ValueError("HTTP3ByteCounter is not supported by the fields-export backend of DissectionCache.")
+    custom_parameters = ["-C", "Customized", "-2"] if custom_parameters is None else custom_parameters
+    tcp_stream_numbers, udp_stream_numbers = SNI_stream_numbers(file, SNIs)
+    display_filter = stream_extract_filter(tcp_stream_numbers, udp_stream_numbers)
+    if display_filter == "":
+        return []
+    if cache is not None:
+        table = cache.load(file, keylog_file=keylog_file, custom_parameters=custom_parameters)
+        return table_stream_statistics(table, tcp_stream_numbers, udp_stream_numbers, counters, require_data)
+
+    override_prefs = {'tls.keylog_file': os.path.abspath(keylog_file)} if keylog_file is not None else None
+    cap = pyshark.FileCapture(input_file=str(file), display_filter=display_filter,
+                              custom_parameters=custom_parameters, override_prefs=override_prefs)
+    result = dict()  # (stream, protocol) -> [packets, bytes]
+    data_streams = set()
+    try:
+        for pkt in cap:
+            if 'TCP' in pkt:
+                stream = ('tcp', int(pkt['TCP'].stream))
+            elif 'UDP' in pkt:
+                stream = ('udp', int(pkt['UDP'].stream))
+            else:
+                continue
+            if require_data and stream not in data_streams and contains_data_frame(pkt):
+                data_streams.add(stream)
+            for counter in counters:
+                cnt = counter.packet_count(pkt)
+                if cnt > 0:
+                    count = result.setdefault((stream, counter.name), [0, 0])
+                    count[0] += 1
+                    count[1] += cnt
+    finally:
+        cap.close()
+
+    return [(stream[1], protocol, count[0], count[1]) for (stream, protocol), count in sorted(result.items())
+            if not require_data or stream in data_streams]
+
+def table_stream_statistics(table, tcp_stream_numbers, udp_stream_numbers, counters, require_data=True) -> list:
+    """
+    The same as stream_statistics, but against a DissectionTable with the given stream numbers.
+    """
+    tcp_streams = np.array(sorted(int(stream) for stream in tcp_stream_numbers), dtype=np.int64)
+    udp_streams = np.array(sorted(int(stream) for stream in udp_stream_numbers), dtype=np.int64)
+    data_frames = table.data_frames() if require_data else None
+    counts = {counter.name: counter.column_count(table) for counter in counters}
+
+    rows = []
+    for transport, streams in [('tcp', tcp_streams), ('udp', udp_streams)]:
+        column = table[f'{transport}_stream']
+        for stream in streams:
+            mask = column == stream
+            if require_data and not data_frames[mask].any():
+                continue
+            for name in sorted(counts):
+                cnt = counts[name][mask]
+                packets = int(np.count_nonzero(cnt > 0))
+                if packets > 0:
+                    rows.append((int(stream), name, packets, int(cnt.sum())))
+    return rows
+
+def single_file_statistics(host, file, SNIs, keylog_index_file, require_data, cache=None) -> list:
+    """
+    The single-process task of batch_statistics, which must be in the top-level (importable) scope.
+    """
+    keylog_file = None
+    if keylog_index_file is not None and os.path.exists(keylog_index_file):
+        # Only load the secrets of this capture instead of the whole keylog.txt of the host.
+        keylog_file = KeylogIndex(keylog_index_file).minimal_keylog(file)
+    try:
+        rows = stream_statistics(file, SNIs, keylog_file=keylog_file, require_data=require_data, cache=cache)
+    except Exception as e:
+        print(f"{Path(file).name} raises Exception: {e}")
+        return []
+    return [(host, Path(file).name, *row) for row in rows]
+
+def batch_statistics(base_dir, SNI_map=None, keylog_name="keylog.txt", num_workers=None, require_data=True,
+                     cache=None) -> dict:
+    """
+    Run stream_statistics over all the .pcap(ng) files of a capture directory (base_dir/host/*.pcap(ng)) in
+    parallel, and gather the results into one columnar table.
+
+    Params
+    ------
+    base_dir : str
+        The base directory of the capture.
+
+    SNI_map : dict
+        The SNIs to count of each host, the host itself if absent.
+
+    keylog_name : str
+        The name of the key log file in each host directory, None to skip decryption.
+
+    num_workers : int
+        The number of processes, the number of CPUs by default.
+
+    cache : DissectionCache
+        The cache of the decrypted per-frame tables, see stream_statistics. NOTE: There is no http3 row with the
+        fields-export backend, see default_stat_counters.
+
+    Returns
+    -------
+    table : dict
+        The columns in stat_columns, each of which is an np.array of the same length.
+    """
+    SNI_map = dict() if SNI_map is None else SNI_map
+    tasks = []
+    for subdir in sorted(filter(lambda x: x.is_dir(), Path(base_dir).iterdir())):
+        host = subdir.name
+        keylog_file = str(subdir / keylog_name) if keylog_name is not None else None
+        for file in sorted(subdir.iterdir()):
+            if file.is_file() and file.suffix in ['.pcapng', '.pcap']:
+                tasks.append((host, str(file), SNI_map.get(host, [host]), keylog_file, require_data, cache))
+
+    with multiprocessing.Pool(num_workers) as pool:
+        results = pool.starmap(single_file_statistics, tasks)
+
+    rows = [row for result in results for row in result]
+    return {
+        'host': np.array([row[0] for row in rows], dtype=str),
+        'file': np.array([row[1] for row in rows], dtype=str),
+        'stream': np.array([row[2] for row in rows], dtype=np.int64),
+        'protocol': np.array([row[3] for row in rows], dtype=str),
+        'packets': np.array([row[4] for row in rows], dtype=np.int64),
+        'bytes': np.array([row[5] for row in rows], dtype=np.int64),
+    }
+
+def save_statistics(table : dict, file):
+    """
+    Save the statistics table as an .npz file. np.savez is not used since its first parameter is named file, which
+    clashes with the file column.
+    """
+    with zipfile.ZipFile(file, 'w') as zf:
+        for column, array in table.items():
+            with zf.open(f"{column}.npy", 'w') as f:
+                np.lib.format.write_array(f, np.asanyarray(array), allow_pickle=False)
+
+def load_statistics(file) -> dict:
+    """
+    Load the statistics table saved by save_statistics, e.g., pandas.DataFrame(load_statistics(file)).
+    """
+    with np.load(file) as data:
+        return {column: data[column] for column in stat_columns}
+
 
 class Cell():
-    def __init__(self, proto, abs_frame_number):
+    """
+    A cell is an HTTP/2 frame as sent on the wire, together with the segments it is reassembled from.
+    The size of a cell is the sum of the segment sizes.
+    """
+    def __init__(self, proto, abs_frame_number, direction=0):
         self.proto = proto
         self.abs_frame_number = abs_frame_number 
+        self.direction = direction  # 1 for egress, -1 for ingress, 0 if unknown
         self.abs_reassemble_info = {"segment_frame_number": [], "segment_size": []}
         self.rel_frame_number = None
         self.rel_reassemble_info = {"segment_frame_number": [], "segment_size": []}
 
+    @property
+    def size(self):
+        return sum(self.abs_reassemble_info["segment_size"])
+
 class CellExtractor(object):
     def __init__(self):
         pass 
@@ -293,35 +694,93 @@ class HTTP2CellExtractor(CellExtractor):
         return self._name
 
     def layer_extract(self, layer, frame_number) -> Cell:
+        """
+        Extract the cell of a layer filtered by seq_filter, i.e., a DATA layer for an HTTP/2 frame reassembled from
+        multiple TLS records, or an http2 layer for an HTTP/2 frame within the TLS record of the current packet.
+        """
         cell = Cell("http2", frame_number)
         
         if layer.layer_name == "DATA":
-            for segment_frame_number, segment_size in match_segment_number(layer.tls_segment):
-                cell.abs_reassemble_info["segment_frame_number"].append(segment_frame_number)
-                cell.abs_reassemble_info["segment_size"].append(segment_size)
+            segments = reassembled_segments(layer, "tls_segments")
 
         elif layer.layer_name == "http2":
-            cell.abs_reassemble_info["segment_frame_number"].append(layer.stream_frame_number)
-            cell.abs_reassemble_info["segment_size"].append(layer.length)
+            # The frame header takes 9 bytes, and the layer without length is the 24-byte connection preface.
+            size = int(layer.length) + 9 if hasattr(layer, 'length') else 24
+            segments = [(frame_number, size)]
 
         else:
             raise ValueError(f"Protocol mismatch: only support {self.name} and DATA layer, but got {layer.layer_name}")
 
-    def extract(self, pkt, lower_protocol="TLS") -> List[Cell]:
+        for segment_frame_number, segment_size in segments:
+            cell.abs_reassemble_info["segment_frame_number"].append(segment_frame_number)
+            cell.abs_reassemble_info["segment_size"].append(segment_size)
+        return cell
+
+    def extract(self, pkt, lower_protocol="TLS", src=None) -> List[Cell]:
         """
         Extract reassembly information from the given packet with the given protocol.
+
+        Params
+        ------
+        pkt : packet
+            The (decrypted) packet to extract the cells.
+
+        lower_protocol : str
+            The protocol beneath HTTP/2.
+
+        src : List[str]
+            The source IP addresses to decide the direction of the cells, left 0 if None.
         """
+        frame_number = int(pkt.frame_info.number)
+        direction = packet_direction(pkt, src) if src is not None else 0
         layers = layer_extractor(pkt, self.name, lower_protocol)
         filtered_layers = seq_filter(layers, layer_label_func)
         cells = []
 
         for layer in filtered_layers:
-            cell = self.layer_extract(layer, layer.frame_number)
+            cell = self.layer_extract(layer, frame_number)
+            cell.direction = direction
             cells.append(cell)
         
         return cells
+
+    def extract_capture(self, cap, lower_protocol="TLS", src=None) -> Iterator[Cell]:
+        """
+        The streaming version of extract over a whole capture, which matches the layers of all packets in a single
+        pass (see seq_match), and generates the cells as soon as they are complete.
+        """
+        last_frame_number, direction = None, 0
+        for (pkt, layer), _ in seq_match(capture_layers(cap, self.name, lower_protocol),
+                                         label_func=lambda item: layer_label_func(item[1])):
+            frame_number = int(pkt.frame_info.number)
+            if frame_number != last_frame_number:  # The cells are generated in the order of the frames.
+                last_frame_number = frame_number
+                direction = packet_direction(pkt, src) if src is not None else 0
+            cell = self.layer_extract(layer, frame_number)
+            cell.direction = direction
+            yield cell
     
 
+def packet_direction(pkt, src) -> int:
+    """
+    Return 1 if the packet is sent from one of the src addresses (egress), -1 otherwise (ingress).
+    """
+    ip_layer = pkt['ip'] if 'ip' in pkt else pkt['ipv6']
+    return 1 if ip_layer.src in src else -1
+
+def reassembled_segments(layer, marker="tls_segments") -> list:
+    """
+    Return the (frame number, size) pairs of the segments reassembled into a DATA layer, which are parsed from the
+    marker field, e.g., "3 Reassembled TLS segments (2867 bytes): #101(1334), #102(1400), #104(133)".
+    """
+    field = layer.get_field(marker)
+    field = field.main_field if hasattr(field, 'main_field') else field
+    for content in [field.showname, field.get_default_value()]:
+        segments = match_segment_number(str(content))
+        if len(segments) > 0:
+            return segments
+    return []
+
 def layer_extractor(pkt, upper_protocol, lower_protocol):
     """
     Extract all layers of the given protocol, if the layer is built upon a DATA layer, 
@@ -360,6 +819,15 @@ def layer_extractor(pkt, upper_protocol, lower_protocol):
 
     return layers
 
+def capture_layers(cap, upper_protocol, lower_protocol) -> Iterator[tuple]:
+    """
+    Generate the (packet, layer) pairs of all the layers extracted by layer_extractor from a capture, i.e.,
+    the layer stream of the whole capture.
+    """
+    for pkt in cap:
+        for layer in layer_extractor(pkt, upper_protocol, lower_protocol):
+            yield pkt, layer
+
 def layer_label_func(layer):
     """
     This function maps a layer to the label. Note that DATA layer is the x (or 0) in seq_filter.
@@ -384,6 +852,8 @@ def seq_filter(seq: List[object], label_func: Callable[[object], str]):
     In practice, using int 0, 1 to represent 'x', 'y' respectively may be more intuitive. Therefore, we adopt 0, 1 
     as the abstract labels.
 
+    The filter runs in linear time, see seq_match.
+
     Parameters
     ----------
     seq: List[object]
@@ -393,41 +863,51 @@ def seq_filter(seq: List[object], label_func: Callable[[object], str]):
         The function to map each object to a label, note that the caller is responsible to assign the correct label
         to each object.
     """
-    def generic_seq_filter(generic_seq: list):
-        assert generic_seq[-1] != 0, "The last element of the sequence should not be 0."
-        
-        num_of_x = sum([int(elem == 0) for elem in generic_seq])
-        num_of_y = sum([int(elem == 1) for elem in generic_seq])
-        assert num_of_x <= num_of_y, "The number of x MUST NOT be more than that of y."
-
-        new_seq_idx = []
-        first_y = 0
-        for i in range(len(generic_seq)):
-            if generic_seq[i] == 0:
-                if first_y <= i:  # Fast-forward
-                    # Prepend all un-eliminated y before the current x.
-                    for j in range(first_y, i):
-                        new_seq_idx.append(j)
-                    first_y = i + 1
-                new_seq_idx.append(i)
-                # Search for the first y that right follows x.
-                for j in range(first_y, len(generic_seq)):
-                    if generic_seq[j] == 1:
-                        first_y = j + 1
-                        break
-                
-                
-        for i in range(first_y, len(generic_seq)):
-            new_seq_idx.append(i)
-
-        return new_seq_idx
     if len(seq) == 0:
         return []
 
-    generic_seq = [label_func(elem) for elem in seq]
-    new_seq_idx = generic_seq_filter(generic_seq)
-    new_seq = [seq[i] for i in new_seq_idx]
-    return new_seq
+    labels = [label_func(elem) for elem in seq]
+    assert labels[-1] != 0, "The last element of the sequence should not be 0."
+    assert labels.count(0) <= labels.count(1), "The number of x MUST NOT be more than that of y."
+
+    # Match over the indices, such that label_func is called once per element.
+    return [elem for elem, _ in seq_match(range(len(seq)), label_func=labels.__getitem__, key=seq.__getitem__)]
+
+def seq_match(seq: Iterable[object], label_func: Callable[[object], int], key=None) -> Iterator[tuple]:
+    """
+    The streaming version of seq_filter, which also tells which y each x eliminates. Since each x eliminates the
+    first y that has not been eliminated after it, the x's are matched with the y's in the first-in-first-out
+    order, hence only the number of the pending x's, i.e., those not matched yet, needs to be tracked.
+
+    The sequence is consumed lazily in a single pass, e.g., the layers of a whole capture (see capture_layers),
+    and the matches are generated as soon as the y's arrive, namely,
+    (x, y) for an x and the y it eliminates;
+    (y, None) for a y that does not follow any x;
+    (x, None) for a pending x at the end of the sequence,
+    in the order of the kept elements, i.e., the same order as seq_filter.
+
+    Parameters
+    ----------
+    seq: Iterable[object]
+        The sequence to be matched, it could contain any object.
+
+    label_func: Callable[[object], int]:
+        The function to map each object to the label 0 (x) or 1 (y).
+
+    key: Callable[[object], object]:
+        The function to map each object to the one generated, the object itself if None.
+    """
+    key = (lambda elem: elem) if key is None else key
+    pending = collections.deque()
+    for elem in seq:
+        if label_func(elem) == 0:
+            pending.append(key(elem))
+        elif len(pending) > 0:
+            yield pending.popleft(), key(elem)
+        else:
+            yield key(elem), None
+    while len(pending) > 0:
+        yield pending.popleft(), None
 
 def match_segment_number(s: str): 
     """
@@ -473,51 +953,188 @@ def get_reassemble_info(cap: pyshark.FileCapture, protocol_stack: List[str] = ['
 
     Returns 
     ------- 
-    res_dict: dict, {K: [v1, ...], ...} 
+    res_dict: dict, {P: {K: [v1, ...], ...}, ...} 
+        P is each protocol in protocol_stack except the first one, i.e., the protocol being reassembled.
         K is the packet index in the same form of Wireshark, namely, starts from 1. 
         [v1, ...] denotes the reassembled indices, whose values will be K in turn and have the same reassembled list. 
-        For example, {1: [1, 2], 2: [1, 2]}. 
-    """
-    # res_dict = {} # {index: [reassemble packets]}
-    # for i in tqdm(range(packet_count(cap)), "get reassemble info"): 
-    #     if cap[i].transport_layer == 'TCP': # ignore the UDP based protocols 
-    #         frame_num = int(cap[i].frame_info.get_field('number')) # get the number of frame
-    #         res_dict[frame_num] = [] # init i-th position as empty 
-    #         segment_index = [] 
-    #         # print(f'${i}$: ${pcap[i].layers}')
-    #         for layer in cap[i].layers: 
-    #             if layer.layer_name == 'DATA': # fake-field-wrapper is renamed to data in pyshark
-    #                 for field in layer.field_names: 
-    #                     if field == 'tcp_segments': # reassemble will appearance in the last packet
-    #                         field_obj = layer.get_field(field) 
-    #                         content = field_obj.main_field.get_default_value() 
-    #                         segment_index.extend(match_segment_number(content)) 
-    #         for index in segment_index: # cover related values with its reassemble info
-    #             res_dict[index] = segment_index 
-    
-    # return res_dict
-    res_dict = {protocol: [] for protocol in protocol_stack} # {index: [reassemble packets]}
-    cell_extractor = CellExtractor()
+        For example, {'TLS': {1: [1, 2], 2: [1, 2]}}. 
+    """
+    res_dict = {protocol: dict() for protocol in protocol_stack[1:]}
     for pkt in cap: 
-        # for protocol in protocol_stack: 
-        #     if protocol in pkt:
-        #         res_dict[protocol].extend(cell_extractor.extract(pkt, protocol))
-        # if protocol in pkt:
-        #     frame_num = int(pkt.frame_info.get_field('number')) # get the number of frame
-        #     res_dict[frame_num] = [] # init i-th position as empty 
-        #     segment_index = [] 
-        #     # print(f'${i}$: ${pcap[i].layers}')
-        #     for layer in pkt.layers: 
-        #         if layer.layer_name == 'DATA': # fake-field-wrapper is renamed to data in pyshark
-        #             for field in layer.field_names: 
-        #                 if field == 'tcp_segments': # reassemble will appearance in the last packet
-        #                     field_obj = layer.get_field(field) 
-        #                     content = field_obj.main_field.get_default_value() 
-        #                     segment_index.extend(match_segment_number(content)) 
-        #     for index in segment_index: # cover related values with its reassemble info
-        #         res_dict[index] = segment_index 
-        frame_num = int(pkt.frame_info.get_field('number'))
-        if frame_num == 58:
-            pass
+        for lower_protocol, upper_protocol in zip(protocol_stack[:-1], protocol_stack[1:]):
+            marker = f"{lower_protocol.lower()}_segments"
+            for layer in pkt.layers:
+                if layer.layer_name == 'DATA' and marker in layer.field_names:  # fake-field-wrapper is renamed to DATA
+                    segment_index = [index for index, _ in reassembled_segments(layer, marker)]
+                    for index in segment_index:  # cover related values with its reassemble info
+                        res_dict[upper_protocol][index] = segment_index
     
-    return res_dict
\ No newline at end of file
+    return res_dict
+
+"""
+The per-trace cell arrays, namely,
+frame           : the frame number completing each cell;
+direction       : the direction of each cell, 1 for egress and -1 for ingress;
+size            : the size of each cell, i.e., the HTTP/2 frame header and payload;
+segment_count   : the number of segments each cell is reassembled from;
+segment_frame   : the frame number of each segment, the segments of all cells concatenated;
+segment_size    : the size of each segment,
+such that the segments of the i-th cell are segment_*[offsets[i]:offsets[i + 1]], where offsets is the cumsum
+of segment_count prepended with 0. All of them are 1-D, hence could be dumped into a ragged container.
+"""
+cell_columns = ['frame', 'direction', 'size', 'segment_count', 'segment_frame', 'segment_size']
+
+def cell_arrays(cells : List[Cell]) -> dict:
+    """
+    Convert the cells of a trace into the arrays in cell_columns.
+    """
+    segment_frames = [cell.abs_reassemble_info["segment_frame_number"] for cell in cells]
+    segment_sizes = [cell.abs_reassemble_info["segment_size"] for cell in cells]
+    return {
+        'frame': np.array([cell.abs_frame_number for cell in cells], dtype=np.int64),
+        'direction': np.array([cell.direction for cell in cells], dtype=np.int8),
+        'size': np.array([cell.size for cell in cells], dtype=np.int64),
+        'segment_count': np.array([len(frames) for frames in segment_frames], dtype=np.int64),
+        'segment_frame': np.array([frame for frames in segment_frames for frame in frames], dtype=np.int64),
+        'segment_size': np.array([size for sizes in segment_sizes for size in sizes], dtype=np.int64),
+    }
+
+def cell_sequence(file, src, keylog_file=None, display_filter=None, custom_parameters=None) -> dict:
+    """
+    Extract the HTTP/2 cells of a capture in a single decrypting pass.
+
+    Params
+    ------
+    file : str
+        The path to the .pcap(ng) file.
+
+    src : List[str]
+        The source IP addresses to decide the direction of the cells.
+
+    keylog_file : str
+        The key log file to decrypt the capture.
+
+    display_filter : str
+        The additional display filter, e.g., SNI_exclude_filter, combined with "http2".
+
+    custom_parameters : list
+        The parameters passed to tshark, ["-C", "Customized", "-2"] (two-pass dissection) by default. Note that
+        the two-pass dissection is required for the reassembly across the packets filtered out.
+
+    Returns
+    -------
+    arrays : dict
+        The arrays in cell_columns, see cell_arrays.
+    """
+    src = src if isinstance(src, list) else [src]
+    custom_parameters = ["-C", "Customized", "-2"] if custom_parameters is None else custom_parameters
+    display_filter = "http2" if not display_filter else f"http2 and ({display_filter})"
+    override_prefs = {'tls.keylog_file': os.path.abspath(keylog_file)} if keylog_file is not None else None
+    cap = pyshark.FileCapture(input_file=str(file), display_filter=display_filter,
+                              custom_parameters=custom_parameters, override_prefs=override_prefs)
+    try:
+        cells = list(HTTP2CellExtractor().extract_capture(cap, src=src))
+    finally:
+        cap.close()
+
+    return cell_arrays(cells)
+
+def single_file_cell_sequence(host, file, src, keylog_index_file) -> tuple:
+    """
+    The single-process task of batch_cell_sequences, which must be in the top-level (importable) scope.
+    """
+    keylog_file = None
+    if keylog_index_file is not None and os.path.exists(keylog_index_file):
+        keylog_file = KeylogIndex(keylog_index_file).minimal_keylog(file)
+    try:
+        arrays = cell_sequence(file, src, keylog_file=keylog_file)
+    except Exception as e:
+        print(f"{Path(file).name} raises Exception: {e}")
+        arrays = cell_arrays([])
+    return host, arrays
+
+def batch_cell_sequences(base_dir, src, output_path=None, keylog_name="keylog.txt", num_workers=None) -> dict:
+    """
+    Run cell_sequence over all the .pcap(ng) files of a capture directory (base_dir/host/*.pcap(ng)) in parallel,
+    one task per file, and gather the results into the raw buffer of PcapFormatter.
+
+    Params
+    ------
+    base_dir : str
+        The base directory of the capture.
+
+    src : List[str]
+        The source IP addresses to decide the direction of the cells.
+
+    output_path : str
+        If given, the buffer is dumped into a ragged container (see dump_ragged), which RaggedFormatter loads.
+
+    keylog_name : str
+        The name of the key log file in each host directory, None to skip decryption.
+
+    num_workers : int
+        The number of processes, the number of CPUs by default.
+
+    Returns
+    -------
+    buf : dict
+        {'hosts': [...], 'labels': [...], name: [array, ...]} for each name in cell_columns, ordered as
+        PcapFormatter.batch_extract, i.e., the hosts in alphabetical order.
+    """
+    tasks = []
+    for subdir in sorted(filter(lambda x: x.is_dir(), Path(base_dir).iterdir())):
+        keylog_file = str(subdir / keylog_name) if keylog_name is not None else None
+        for file in sorted(subdir.iterdir()):
+            if file.is_file() and file.suffix in ['.pcapng', '.pcap']:
+                tasks.append((subdir.name, str(file), src, keylog_file))
+
+    with multiprocessing.Pool(num_workers) as pool:
+        results = pool.starmap(single_file_cell_sequence, tasks)
+
+    buf = {'hosts': [], 'labels': []}
+    buf.update({name: [] for name in cell_columns})
+    for host, arrays in results:  # starmap keeps the order of the tasks
+        if host not in buf['hosts']:
+            buf['hosts'].append(host)
+        buf['labels'].append(len(buf['hosts']) - 1)
+        for name in cell_columns:
+            buf[name].append(arrays[name])
+
+    if output_path is not None:
+        dump_ragged(buf, output_path)
+    return buf
+
+class CellFeatureExtractor(Extractor):
+    """
+    The capture-level extractor of the HTTP/2 cell features for the formatters, which decrypts each capture with the
+    key log file in its host directory.
+
+    Attributes
+    ----------
+    src : List[str]
+        The source IP addresses to decide the direction of the cells.
+
+    feature : str
+        One of 'direction', 'size' and 'signed_size' (the size multiplied by the direction).
+
+    keylog_name : str
+        The name of the key log file in each host directory, None to skip decryption.
+    """
+    def __init__(self, src: Union[str, List[str]], feature="signed_size", keylog_name="keylog.txt", name="http2_cell"):
+        super().__init__(name=name)
+        if feature not in ['direction', 'size', 'signed_size']:
+            raise ValueError(f"Unsupported cell feature: {feature}")
+        self._src = src if isinstance(src, list) else [src]
+        self._feature = feature
+        self._keylog_name = keylog_name
+
+    def capture_extract(self, file, display_filter=None) -> np.ndarray:
+        keylog_file = None
+        keylog_index_file = Path(file).parent / self._keylog_name if self._keylog_name is not None else None
+        if keylog_index_file is not None and keylog_index_file.exists():
+            keylog_file = KeylogIndex(keylog_index_file).minimal_keylog(file)
+
+        arrays = cell_sequence(file, self._src, keylog_file=keylog_file, display_filter=display_filter)
+        if self._feature == 'signed_size':
+            return arrays['size'] * arrays['direction']
+        return arrays[self._feature]
@@ -31,6 +31,15 @@ import time
 import logging
 import shutil
 import asyncio
+import contextlib
+import queue
+import tempfile
+import heapq
+import collections
+import re
+import socket
+
+from WFlib.tools.sni import SNI_stream_numbers
 
 logger = logging.getLogger('selenium')
 logger.setLevel(logging.WARN)
@@ -53,19 +62,665 @@ NOTE: Plain HTTP (port 80) is excluded after some consideration, since most of t
 """
 common_filter = 'not (port 53 or port 22 or port 3389 or port 5355 or port 5353 or port 3702 or port 123 or port 1900 or port 853 or port 80 or port 8088 or port 5574 or port 8186) and (tcp or udp)'
 
-def capture(url, iface, output_file, timeout=200, capture_filter=common_filter, ill_files=None, log_output=None, proxy_log=None):
+def firefox_options(proxy=False, quiet=False, proxy_port=7890) -> Options:
+    """
+    Build the Firefox options for capture.
+
+    Params
+    ------
+    proxy : bool
+        Whether to route the traffic through the local proxy client (127.0.0.1:proxy_port).
+
+    quiet : bool
+        Whether to turn off the background services of Firefox (telemetry, update, safe browsing, captive portal
+        detection, etc.), which otherwise generate traffic unrelated to the visited website.
+    """
+    options = Options()
+    options.add_argument("--headless") 
+    options.set_preference("browser.cache.disk.enable", False)
+    options.set_preference("browser.cache.memory.enable", False)
+    options.set_preference("browser.cache.offline.enable", False)
+    options.set_preference("network.http.use-cache", False)
+
+    # Configure proxy options for Firefox
+    if proxy:
+        options.set_preference("network.proxy.type", 1)
+        options.set_preference("network.proxy.http", "127.0.0.1")
+        options.set_preference("network.proxy.http_port", proxy_port)
+        options.set_preference('network.proxy.socks', '127.0.0.1')
+        options.set_preference('network.proxy.socks_port', proxy_port)
+        options.set_preference('network.proxy.socks_remote_dns', False)
+        options.set_preference("network.proxy.ssl", "127.0.0.1")
+        options.set_preference("network.proxy.ssl_port", proxy_port)
+        options.set_preference("webdriver_accept_untrusted_certs", True)
+        options.set_preference("webdriver_assume_untrusted_issuer", False)
+
+    if quiet:
+        for pref, value in quiet_prefs.items():
+            options.set_preference(pref, value)
+
+    return options
+
+"""
+The preferences to silence the background traffic of Firefox. NOTE: This list is not exhausted.
+"""
+quiet_prefs = {
+    "app.update.auto": False,
+    "app.update.enabled": False,
+    "app.normandy.enabled": False,
+    "browser.safebrowsing.malware.enabled": False,
+    "browser.safebrowsing.phishing.enabled": False,
+    "browser.safebrowsing.downloads.enabled": False,
+    "browser.safebrowsing.provider.mozilla.updateURL": "",
+    "browser.newtabpage.activity-stream.feeds.topsites": False,
+    "browser.newtabpage.activity-stream.feeds.section.topstories": False,
+    "datareporting.healthreport.uploadEnabled": False,
+    "datareporting.policy.dataSubmissionEnabled": False,
+    "toolkit.telemetry.enabled": False,
+    "toolkit.telemetry.unified": False,
+    "network.captive-portal-service.enabled": False,
+    "network.connectivity-service.enabled": False,
+    "dom.push.enabled": False,
+    "extensions.update.enabled": False,
+    "extensions.getAddons.cache.enabled": False,
+    "services.settings.poll_interval": 86400 * 365,
+}
+
+class KeylogCursor(object):
+    """
+    Follow a keylog file written by a long-lived process (a pooled browser or the proxy client), and move the keys
+    logged since the last drain to another file, e.g., the keylog file of the visited host. This splits the keys
+    per visit without restarting the process.
+    """
+    def __init__(self, keylog_file):
+        self.keylog_file = keylog_file
+        self.offset = 0
+
+    def drain(self, keylog_file=None) -> int:
+        """
+        Append the keys logged since the last drain to keylog_file (or drop them if None), return the number of
+        bytes moved. Only complete lines are moved, the rest is left to the next drain.
+        """
+        if not os.path.exists(self.keylog_file):
+            return 0
+        if os.path.getsize(self.keylog_file) < self.offset:
+            self.offset = 0  # Truncated, e.g., by a restart of the process
+        with open(self.keylog_file, 'rb') as f:
+            f.seek(self.offset)
+            keys = f.read()
+        keys = keys[:keys.rfind(b'\n') + 1]
+        self.offset += len(keys)
+        if keylog_file is not None and len(keys) > 0:
+            with open(keylog_file, 'ab') as f:
+                f.write(keys)
+        return len(keys)
+
+class PooledBrowser(object):
+    """
+    A pre-launched browser held by BrowserPool.
+
+    Since Firefox reads SSLKEYLOGFILE only once at startup, each pooled browser writes its keys into its own keylog
+    file, and the keys of each visit are copied to the keylog file of the visited host afterwards (see
+    BrowserPool.lease).
+    """
+    def __init__(self, driver, keylog_file):
+        self.driver = driver
+        self.keylog_file = keylog_file
+        self.keylog = KeylogCursor(keylog_file)
+        self.uses = 0
+
+"""
+The script run in the chrome context to reset a pooled browser. Besides clearing the data, it closes the idle
+keep-alive connections (HTTP/2, QUIC) of the last visit, which a pooled browser would otherwise keep open, such
+that wait_for_quiescence does not wait for them until quiesce_timeout.
+"""
+reset_script = """
+const callback = arguments[arguments.length - 1];
+Services.clearData.deleteData(Ci.nsIClearDataService.CLEAR_ALL, () => {
+    Services.obs.notifyObservers(null, "net:prune-all-connections");
+    callback(true);
+});
+"""
+
+class BrowserPool(object):
+    """
+    A pool of pre-launched headless Firefox instances, each with a clean throwaway profile. Compared to launching
+    a new browser for every visit, the pool saves the startup time, and keeps the startup traffic of the browser
+    out of the captures since the browsers are launched before sniffing.
+
+    Between two visits, a browser is reset, i.e., its cache, cookies, storages and service workers are cleared
+    and its idle connections are closed (see reset_script). After max_uses visits or once the reset fails, it is
+    marked stale instead, and recycled (quit and relaunched) by replenish, which should be called once the
+    sniffer has stopped, such that the shutdown and startup traffic stays out of the captures as well.
+
+    Usage
+    -----
+    ```
+    pool = BrowserPool(size=1)
+    with pool.lease(keylog_file="base_dir/www.baidu.com/keylog.txt") as driver:
+        driver.get("https://www.baidu.com")
+    pool.replenish()
+    pool.close()
+    ```
+    """
+    def __init__(self, size=1, max_uses=20, proxy=False, quiet=True, proxy_port=7890):
+        self._max_uses = max_uses
+        self._options = firefox_options(proxy=proxy, quiet=quiet, proxy_port=proxy_port)
+        # NOTE: Since Firefox 138, the privileged (chrome) context used by reset must be allowed explicitly.
+        self._options.add_argument("-remote-allow-system-access")
+        self._keylog_dir = tempfile.mkdtemp(prefix="wflib_keylog_")
+        self._launched = 0
+        self._lock = threading.Lock()
+        self._idle = queue.Queue()
+        self._browsers = []
+        self._stale = []
+        self._missing = size  # The number of slots to launch a browser for
+        self.replenish()
+
+    def _launch(self) -> PooledBrowser:
+        with self._lock:
+            keylog_file = os.path.join(self._keylog_dir, f"keylog_{self._launched}.txt")
+            self._launched += 1
+
+        # The environment is passed to Firefox through geckodriver.
+        env = dict(os.environ)
+        env["SSLKEYLOGFILE"] = keylog_file
+        service = Service(executable_path=gecko_path, log_output=None, env=env)
+        driver = webdriver.Firefox(options=self._options, service=service)
+
+        browser = PooledBrowser(driver, keylog_file)
+        with self._lock:
+            self._browsers.append(browser)
+        return browser
+
+    def _quit(self, browser : PooledBrowser):
+        try:
+            browser.driver.quit()
+        except Exception:
+            pass
+        with self._lock:
+            self._browsers.remove(browser)
+        if os.path.exists(browser.keylog_file):
+            os.remove(browser.keylog_file)
+
+    def _reset(self, browser : PooledBrowser):
+        """
+        Bring the browser back to a clean state, raise an exception if failed.
+        """
+        driver = browser.driver
+        # Close the windows opened by the website, and leave the page to stop its scripts.
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+        driver.get("about:blank")
+
+        # Clear cache, cookies, storages, service workers, etc.
+        with driver.context(driver.CONTEXT_CHROME):
+            driver.execute_async_script(reset_script)
+
+    def _release(self, browser : PooledBrowser):
+        browser.uses += 1
+        if browser.uses < self._max_uses:
+            try:
+                self._reset(browser)
+                self._idle.put(browser)
+                return
+            except Exception:
+                pass
+        # Quitting and relaunching is left to replenish, since the sniffer of the visit is still running.
+        with self._lock:
+            self._stale.append(browser)
+
+    def replenish(self):
+        """
+        Quit the stale browsers, and launch a browser for each empty slot. Raise WebDriverException if a launch
+        fails, whose slot is left empty for the next call.
+        """
+        with self._lock:
+            stale, self._stale = self._stale, []
+            self._missing += len(stale)
+        for browser in stale:
+            self._quit(browser)
+
+        while True:
+            with self._lock:
+                if self._missing == 0:
+                    return
+                self._missing -= 1
+            try:
+                self._idle.put(self._launch())
+            except WebDriverException:
+                with self._lock:
+                    self._missing += 1
+                raise
+
+    @contextlib.contextmanager
+    def lease(self, keylog_file=None):
+        """
+        Lease a browser from the pool, which blocks until a browser is available. The driver is given back to the
+        pool (reset, or marked stale for replenish) on exit.
+
+        NOTE: If no browser is idle and replenish has not been called since the last recycling (or failed), the
+        browsers are relaunched here.
+
+        Params
+        ------
+        keylog_file : str
+            The file to append the TLS keys of this visit, SSLKEYLOGFILE of the current environment by default.
+        """
+        if keylog_file is None:
+            keylog_file = os.environ.get("SSLKEYLOGFILE")
+        try:
+            browser = self._idle.get_nowait()
+        except queue.Empty:
+            self.replenish()
+            browser = self._idle.get()
+        # Drop the keys logged while idle, e.g., at startup.
+        browser.keylog.drain(None)
+        try:
+            yield browser.driver
+        finally:
+            browser.keylog.drain(keylog_file)
+            self._release(browser)
+
+    def close(self):
+        for browser in list(self._browsers):
+            self._quit(browser)
+        shutil.rmtree(self._keylog_dir, ignore_errors=True)
+
+"""
+The script to check the loading state of the page in the browser. It returns -1 if the document is still loading,
+otherwise the milliseconds elapsed since the last resource (or the document itself) finished loading, according
+to the Performance API. NOTE: Resources in flight are not visible here, which is covered by the packet idleness.
+"""
+resource_idle_script = """
+if (document.readyState !== 'complete') {
+    return -1;
+}
+performance.setResourceTimingBufferSize(100000);
+let last = 0;
+for (const entry of performance.getEntriesByType('navigation')) {
+    last = Math.max(last, entry.loadEventEnd);
+}
+for (const entry of performance.getEntriesByType('resource')) {
+    last = Math.max(last, entry.responseEnd);
+}
+return performance.now() - last;
+"""
+
+def wait_for_page_load(driver, timeout, idle_window=5., last_packet=None, poll_interval=.5) -> float:
+    """
+    Wait until the page has been loaded completely, i.e., the document is complete, and both the resource loading
+    of the browser and the network have been idle for idle_window seconds. The waiting stops at timeout anyway.
+
+    Params
+    ------
+    driver : WebDriver
+        The driver which has navigated to the page.
+
+    timeout : float
+        The upper bound of waiting in seconds.
+
+    idle_window : float
+        The seconds of idleness required to consider the page loaded.
+
+    last_packet : multiprocessing.Value
+        The timestamp (time.time()) of the last captured packet, which is updated by the sniffer. Only the
+        browser signals are considered if not given.
+
+    poll_interval : float
+        The seconds between two checks.
+
+    Returns
+    -------
+    elapsed : float
+        The seconds spent on waiting.
+    """
+    start = time.time()
+    while True:
+        now = time.time()
+        if now - start >= timeout:
+            break
+
+        resource_idle = driver.execute_script(resource_idle_script)
+        if resource_idle is not None and resource_idle >= 0 and resource_idle / 1000 >= idle_window:
+            if last_packet is None or now - last_packet.value >= idle_window:
+                break
+
+        time.sleep(min(poll_interval, max(timeout - (now - start), 0)))
+
+    return time.time() - start
+
+def wait_for_port(host, port, timeout=10., poll_interval=.05) -> float:
+    """
+    Wait until the (host, port) accepts TCP connections, e.g., the proxy client is ready.
+
+    Returns
+    -------
+    elapsed : float
+        The seconds spent on waiting.
+
+    Raises
+    ------
+    TimeoutError
+        If the port is not ready within timeout seconds.
+    """
+    start = time.time()
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=poll_interval):
+                return time.time() - start
+        except OSError:
+            if time.time() - start >= timeout:
+                raise TimeoutError(f"{host}:{port} is not ready within {timeout}s")
+            time.sleep(poll_interval)
+
+"""
+The default proxy client, a Clash build which dumps the TLS keys of the Trojan/VMess tunnels (-key-trojan).
+"""
+default_proxy_binary = '/home/lxyu/clash/bin/clash-linux-amd64'
+
+class ProxySupervisor(object):
+    """
+    A long-lived proxy client shared by the visits of a proxied capture, instead of a proxy process per visit.
+    The proxy is restarted only if the health check fails, and its keylog is split per visit by offset tracking
+    (see KeylogCursor) instead of a restart.
+
+    Params
+    ------
+    binary : str
+        The path to the proxy client.
+
+    args : list
+        The arguments of the proxy client, where {keylog} is replaced with keylog_file.
+
+    port : int
+        The local (mixed) port of the proxy client, which is also used for the health check.
+
+    keylog_file : str
+        The keylog file written by the proxy client, a temporary file by default.
+
+    log_file : str
+        The file to hold the output of the proxy client, discarded if None.
+
+    ready_timeout : float
+        The upper bound of waiting for the port to accept connections after a (re)start.
+
+    max_restarts : int
+        The maximum number of restarts, after which ensure raises RuntimeError.
+    """
+    def __init__(self, binary=default_proxy_binary, args=('-key-trojan', '{keylog}'), port=7890, keylog_file=None,
+                 log_file=None, ready_timeout=10., max_restarts=5):
+        self._tmp_dir = None
+        if keylog_file is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix="wflib_proxy_")
+            keylog_file = os.path.join(self._tmp_dir, "proxy_keylog.txt")
+
+        self.port = port
+        self.log_file = log_file
+        self.restarts = 0
+        self._cmd = [binary] + [arg.format(keylog=keylog_file) for arg in args]
+        self._keylog = KeylogCursor(keylog_file)
+        self._ready_timeout = ready_timeout
+        self._max_restarts = max_restarts
+        self._process = None
+        self._stdout = None
+
+    def start(self) -> float:
+        """
+        Launch the proxy client and wait for its port, return the seconds spent on waiting.
+
+        The keys already in the keylog file, i.e., of the earlier runs (the keylog file persists across runs), the
+        startup of the proxy client and the visits since the last rotation, are dropped, such that the next
+        rotation only moves the keys of the next visit.
+        """
+        self._stdout = open(self.log_file, 'a+') if self.log_file is not None else subprocess.DEVNULL
+        self._process = subprocess.Popen(self._cmd, stdout=self._stdout, stderr=subprocess.STDOUT)
+        try:
+            return wait_for_port('127.0.0.1', self.port, timeout=self._ready_timeout)
+        finally:
+            self._keylog.drain(None)
+
+    def stop(self):
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._process.terminate()
+            self._process.wait()
+            self._process = None
+        if self._stdout is not None and self._stdout is not subprocess.DEVNULL:
+            self._stdout.close()
+        self._stdout = None
+
+    def healthy(self) -> bool:
+        if self._process is None or self._process.poll() is not None:
+            return False
+        try:
+            wait_for_port('127.0.0.1', self.port, timeout=0.)
+        except TimeoutError:
+            return False
+        return True
+
+    def ensure(self) -> float:
+        """
+        Make sure the proxy is running, (re)start it if not. Return the seconds spent on waiting, 0 if healthy.
+        """
+        if self.healthy():
+            return 0.
+        if self._process is not None:
+            self.restarts += 1
+            if self.restarts > self._max_restarts:
+                raise RuntimeError(f"The proxy has been restarted for {self._max_restarts} times")
+            self.stop()
+        return self.start()
+
+    def rotate(self, keylog_file=None) -> int:
+        """
+        Move the keys logged since the last rotation to keylog_file (or drop them if None), see KeylogCursor.
+        """
+        return self._keylog.drain(keylog_file)
+
+    def close(self):
+        self.stop()
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        self.ensure()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+"""
+The TCP states (see include/net/tcp_states.h) of the connections which are neither listening nor closed.
+TIME_WAIT is excluded since it lasts for minutes without any traffic.
+"""
+active_tcp_states = {'01', '02', '03', '04', '05', '08', '09', '0B'}
+
+def _is_loopback(address) -> bool:
+    """
+    Check the hex address in /proc/net/{tcp,udp}{,6}, which is stored in the host byte order (little endian).
+    """
+    ip = address.split(':')[0]
+    if len(ip) == 8:
+        return ip[6:8] == '7F'
+    if ip == '0' * 24 + '01000000':  # ::1
+        return True
+    return ip[:24] == '0' * 16 + 'FFFF0000' and ip[30:32] == '7F'  # ::ffff:127.x.x.x
+
+def active_connections(proc_net="/proc/net") -> set:
+    """
+    List the active TCP connections and the connected UDP sockets (e.g., QUIC) of the current network namespace,
+    excluding the loopback ones (e.g., geckodriver).
+
+    Returns
+    -------
+    connections : set
+        The set of (protocol, local_address, remote_address).
+    """
+    connections = set()
+    for proto in ['tcp', 'tcp6', 'udp', 'udp6']:
+        path = os.path.join(proc_net, proto)
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            next(f)  # Skip the header
+            for line in f:
+                fields = line.split()
+                local, remote, state = fields[1], fields[2], fields[3]
+                if _is_loopback(remote):
+                    continue
+                if proto.startswith('tcp') and state not in active_tcp_states:
+                    continue
+                if proto.startswith('udp') and set(remote) <= {'0', ':'}:
+                    continue  # Not connected
+                connections.add((proto, local, remote))
+
+    return connections
+
+def wait_for_quiescence(baseline=None, timeout=10., poll_interval=.1, proc_net="/proc/net") -> float:
+    """
+    Wait until the connections opened since baseline (see active_connections) are all closed, such that the
+    traffic of a visit does not leak into the next one.
+
+    Returns
+    -------
+    elapsed : float
+        The seconds spent on waiting, which is timeout if the connections are still open.
+    """
+    baseline = set() if baseline is None else baseline
+    start = time.time()
+    while time.time() - start < timeout:
+        if active_connections(proc_net) <= baseline:
+            break
+        time.sleep(poll_interval)
+
+    return time.time() - start
+
+class CaptureProfile(object):
+    """
+    How the packets are captured and written to disk.
+
+    Params
+    ------
+    snaplen : int
+        The number of bytes kept per packet, 0 for the full packet. The original length of a truncated packet is
+        still recorded (frame.len), so the direction/time/size features are not affected.
+
+    use_dumpcap : bool
+        Whether to capture with dumpcap instead of tshark, which does not dissect the packets and thus has a much
+        lower overhead. Without the per-packet output of tshark, the network idleness of wait_for_page_load is
+        derived from the growth of the capture file, and the number of captured packets is unknown (None).
+
+    buffer_size : int
+        The kernel capture buffer size in MiB (-B), the default of tshark/dumpcap if None.
+    """
+    def __init__(self, snaplen=0, use_dumpcap=False, buffer_size=None):
+        self.snaplen = snaplen
+        self.use_dumpcap = use_dumpcap
+        self.buffer_size = buffer_size
+
+    def command(self, iface, capture_filter, output_file) -> list:
+        cmd = ['dumpcap' if self.use_dumpcap else 'tshark', '-i', iface, '-f', capture_filter, '-w', output_file]
+        if self.snaplen > 0:
+            cmd += ['-s', str(self.snaplen)]
+        if self.buffer_size is not None:
+            cmd += ['-B', str(self.buffer_size)]
+        if self.use_dumpcap:
+            cmd += ['-q']
+        else:
+            # -P prints a line per packet while writing the capture file, which lets us track the packet rate.
+            cmd += ['-P', '-l', '-T', 'fields', '-e', 'frame.number']
+        return cmd
+
+"""
+The full capture, which is needed for decryption and SNI-based filtering (SNI_exclude_filter, h2data_SNI_intersect, etc.).
+"""
+FULL_PROFILE = CaptureProfile()
+
+"""
+The header-only capture, which keeps the L2-L4 headers and the first TLS record header of each packet, enough for
+the direction/time/size features at a fraction of the disk I/O and parsing time.
+
+NOTE: 128 bytes usually cut the ClientHello before the server_name extension, i.e., SNIs are NOT available in
+header-only captures.
+"""
+HEADER_PROFILE = CaptureProfile(snaplen=128, buffer_size=32)
+
+def capture(url, iface, output_file, timeout=200, capture_filter=common_filter, ill_files=None, log_output=None, proxy_log=None,
+            browser_pool : BrowserPool = None, idle_window=5., profile : CaptureProfile = FULL_PROFILE,
+            ready_timeout=10., quiesce_timeout=10., proxy_port=None):
+    """
+    Capture the traffic of visiting the url. The visit ends once the page has been loaded completely and the
+    network has been idle for idle_window seconds (see wait_for_page_load), or at timeout. Set idle_window to
+    None to always browse for timeout seconds.
+
+    The browser is proxied through 127.0.0.1:proxy_port if proxy_port is given, or through 127.0.0.1:7890 if
+    proxy_log is given (the proxy client itself is managed by the caller, see ProxySupervisor).
+
+    NOTE: If browser_pool is given, the browser is leased from the pool instead of launched for this visit only,
+    and the proxy settings are ignored (the proxy is configured by the pool). The caller should call
+    browser_pool.replenish() afterwards, which relaunches the recycled browsers outside of the capture.
+
+    The capture is performed according to profile, the full capture by default (see CaptureProfile).
+
+    Instead of fixed sleeps, the browsing starts once tshark reports that the capture has started (at most
+    ready_timeout seconds), and the capture stops once the connections opened by the visit are closed (at most
+    quiesce_timeout seconds, see wait_for_quiescence).
+
+    Returns
+    -------
+    result : dict
+        duration : float, the seconds spent on the visit, i.e., from requesting the url to the end of browsing,
+                   None if the browser fails to launch. It is also recorded in log_output;
+        packets  : int, the number of captured packets, None if captured by dumpcap;
+        error    : str, the exception raised during the visit, None if succeeded;
+        waits    : dict, the seconds spent on waiting for tshark (ready) and for the connections to close
+                   (quiescence).
+    """
     stop_event = multiprocessing.Event()
+    ready_event = multiprocessing.Event()
+    last_packet = multiprocessing.Value('d', time.time())
+    packets = multiprocessing.Value('q', 0)
+    result = {'duration': None, 'packets': 0, 'error': None, 'waits': {}}
+
+    def _monitor_packets(stdout):
+        # Each line is a captured packet.
+        for _ in stdout:
+            last_packet.value = time.time()
+            packets.value += 1
+
+    def _monitor_file():
+        # dumpcap prints nothing per packet, watch the growth of the capture file instead.
+        size = 0
+        while not stop_event.is_set():
+            if os.path.exists(output_file) and os.path.getsize(output_file) > size:
+                size = os.path.getsize(output_file)
+                last_packet.value = time.time()
+            time.sleep(.1)
+
+    def _monitor_stderr(stderr):
+        # Both tshark and dumpcap report "Capturing on 'iface'" once the capture has started.
+        for line in stderr:
+            if b"Capturing on" in line:
+                ready_event.set()
+        ready_event.set()  # Exited, do not keep the browsing waiting.
 
     def _sniff():
         tshark_process = subprocess.Popen(
-            ['tshark', '-i', iface, '-f', capture_filter, '-w', output_file,],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL 
+            profile.command(iface, capture_filter, output_file),
+            stdout=subprocess.DEVNULL if profile.use_dumpcap else subprocess.PIPE,
+            stderr=subprocess.PIPE
         )
+        threading.Thread(target=_monitor_stderr, args=(tshark_process.stderr,), daemon=True).start()
+        if profile.use_dumpcap:
+            threading.Thread(target=_monitor_file, daemon=True).start()
+        else:
+            threading.Thread(target=_monitor_packets, args=(tshark_process.stdout,), daemon=True).start()
         try:
-            # Monitor the event
-            while not stop_event.is_set():
-                time.sleep(.1)  # Poll every second
+            stop_event.wait()
             tshark_process.terminate()
             tshark_process.wait()
         except Exception as e:
@@ -74,60 +729,69 @@ def capture(url, iface, output_file, timeout=200, capture_filter=common_filter,
             if tshark_process.poll() is None:
                 tshark_process.terminate()
 
-    def browse():
-        time.sleep(2) # maybe waiting for interface to be ready?
-        
-        service = Service(executable_path=gecko_path, log_output=None)
-
-        options = Options()
-        options.add_argument("--headless") 
-        options.set_preference("browser.cache.disk.enable", False)
-        options.set_preference("browser.cache.memory.enable", False)
-        options.set_preference("browser.cache.offline.enable", False)
-        options.set_preference("network.http.use-cache", False)
-
-        # Configure proxy options for Firefox
-        if proxy_log is not None:
-            options.set_preference("network.proxy.type", 1)
-            options.set_preference("network.proxy.http", "127.0.0.1")
-            options.set_preference("network.proxy.http_port", 7890)
-            options.set_preference('network.proxy.socks', '127.0.0.1')
-            options.set_preference('network.proxy.socks_port', 7890)
-            options.set_preference('network.proxy.socks_remote_dns', False)
-            options.set_preference("network.proxy.ssl", "127.0.0.1")
-            options.set_preference("network.proxy.ssl_port", 7890)
-            options.set_preference("webdriver_accept_untrusted_certs", True)
-            options.set_preference("webdriver_assume_untrusted_issuer", False)
-
-        try:
-            driver = webdriver.Firefox(options=options, service=service)
-        except WebDriverException as e:
-            if log_output is not None:
-                with open(log_output, 'a+') as f:
-                    f.write(f"The file {output_file} raises the exception: {e}\n")
-            if ill_files is not None:
-                with open(ill_files, 'a+') as f:
-                    f.write(f"{output_file}\n")
-            time.sleep(2)
-            stop_event.set()
-            return
-            
+    def log_exception(e):
+        result['error'] = str(e)
+        if log_output is not None:
+            with open(log_output, 'a+') as f:
+                f.write(f"The file {output_file} raises the exception: {e}\n")
+        if ill_files is not None:
+            with open(ill_files, 'a+') as f:
+                f.write(f"{output_file}\n")
+
+    def visit(driver):
+        start = time.time()
         try:
             driver.get(url)
-            time.sleep(timeout)
+            if idle_window is None:
+                time.sleep(timeout)
+            else:
+                wait_for_page_load(driver, max(timeout - (time.time() - start), 0), idle_window, last_packet)
         except Exception as e:
+            log_exception(e)
+        result['duration'] = time.time() - start
+
+    def browse():
+        try:
+            start = time.time()
+            if not ready_event.wait(ready_timeout) and log_output is not None:
+                with open(log_output, 'a+') as f:
+                    f.write(f"The capture of {output_file} is not ready within {ready_timeout}s\n")
+            result['waits']['ready'] = time.time() - start
+
+            if browser_pool is not None:
+                try:
+                    with browser_pool.lease() as driver:
+                        visit(driver)
+                except WebDriverException as e:
+                    # Raised when the pool fails to relaunch a browser.
+                    log_exception(e)
+            else:
+                service = Service(executable_path=gecko_path, log_output=None)
+                options = firefox_options(proxy=proxy_log is not None or proxy_port is not None,
+                                          proxy_port=proxy_port if proxy_port is not None else 7890)
+
+                try:
+                    driver = webdriver.Firefox(options=options, service=service)
+                except WebDriverException as e:
+                    log_exception(e)
+                    return
+
+                visit(driver)
+                driver.quit()
+
+            # Keep capturing until the connections of the visit are closed (FIN, close_notify, etc.)
+            result['waits']['quiescence'] = wait_for_quiescence(baseline, quiesce_timeout)
             if log_output is not None:
+                waits = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result['waits'].items())
+                # The duration is None if the visit never started, e.g., the pool fails to relaunch a browser.
+                visit_info = "no visit" if result['duration'] is None else f"a visit of {result['duration']:.2f}s"
                 with open(log_output, 'a+') as f:
-                    f.write(f"The file {output_file} raises the exception: {e}\n")
-            if ill_files is not None:
-                with open(ill_files, 'a+') as f:
-                    f.write(f"{output_file}\n")
-        driver.quit()
-        
-        time.sleep(2)
-        # Notify the capture thread that the capturing process is over.
-        stop_event.set()
+                    f.write(f"The file {output_file} is captured with {visit_info} (waits: {waits})\n")
+        finally:
+            # Notify the capture thread that the capturing process is over, even if the browsing fails.
+            stop_event.set()
 
+    baseline = active_connections()
     browse_thread = threading.Thread(target=browse)
     monitor_process = multiprocessing.Process(target=_sniff)
     
@@ -137,6 +801,9 @@ def capture(url, iface, output_file, timeout=200, capture_filter=common_filter,
     browse_thread.join()
     monitor_process.join()
 
+    result['packets'] = None if profile.use_dumpcap else packets.value
+    return result
+
 def read_host_list(file) -> list:
     """
     Read the hostname list file, remove the possible duplicates, and store the results into a list.
@@ -153,6 +820,7 @@ def read_host_list(file) -> list:
             return url
         
     host_list = []
+    seen = set()
     with open(file, 'r') as f:
         for line in f:
             stripped_line = line.strip()  # Remove leading and trailing whitespace
@@ -161,7 +829,8 @@ def read_host_list(file) -> list:
 
             url = stripped_line.split("#")[0].strip() # Ignore inline comments
             hostname = strip_url(url.strip())
-            if hostname and hostname not in host_list:
+            if hostname and hostname not in seen:
+                seen.add(hostname)
                 host_list.append(hostname)
 
     return host_list
@@ -211,13 +880,157 @@ def decide_output_file_idx(directory : Path) -> int:
 
     return 1 + max_idx
 
+def parse_io_stat(text) -> dict:
+    """
+    Parse the output of `tshark -q -z io,stat,0`, i.e., a single interval covering the whole capture.
+
+    Returns
+    -------
+    stats : dict
+        packets  : int, the number of packets;
+        bytes    : int, the number of bytes;
+        duration : float, the seconds between the first and the last packet.
+    """
+    stats = {'packets': 0, 'bytes': 0, 'duration': 0.}
+    duration = re.search(r"Duration:\s*([\d.]+)", text)
+    if duration is not None:
+        stats['duration'] = float(duration.group(1))
+    for line in text.splitlines():
+        if '<>' in line:
+            cells = [cell.strip() for cell in line.strip().strip('|').split('|')]
+            stats['packets'] = int(cells[1])
+            stats['bytes'] = int(cells[2])
+
+    return stats
+
+def capture_stats(file) -> dict:
+    """
+    Count the packets and bytes of a capture file with tshark statistics, see parse_io_stat for the returned dict.
+    """
+    if not os.path.exists(file):
+        return {'packets': 0, 'bytes': 0, 'duration': 0.}
+    output = subprocess.run(['tshark', '-r', str(file), '-q', '-z', 'io,stat,0'],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+    return parse_io_stat(output)
+
+class QualityGate(object):
+    """
+    Check a capture right after it finishes, such that broken visits are recaptured immediately instead of being
+    noticed during extraction.
+
+    Params
+    ------
+    min_packets : int
+        The minimum number of packets of a good capture.
+
+    min_bytes : int
+        The minimum number of bytes of a good capture.
+
+    min_duration : float
+        The minimum seconds between the first and the last packet, which rejects loads cut off early.
+
+    allow_error : bool
+        Whether to accept the visits raising exceptions in the browser (e.g., WebDriver timeout).
+    """
+    def __init__(self, min_packets=50, min_bytes=0, min_duration=0., allow_error=False):
+        self._min_packets = min_packets
+        self._min_bytes = min_bytes
+        self._min_duration = min_duration
+        self._allow_error = allow_error
+
+    def check(self, result, stats) -> Union[str, None]:
+        """
+        Return the reason if the capture is rejected, otherwise None.
+
+        Params
+        ------
+        result : dict
+            The result of capture.
+
+        stats : dict
+            The statistics of the capture file, see capture_stats.
+        """
+        if result['error'] is not None and not self._allow_error:
+            return f"browser error: {result['error']}"
+        if stats['packets'] < self._min_packets:
+            return f"too few packets: {stats['packets']} < {self._min_packets}"
+        if stats['bytes'] < self._min_bytes:
+            return f"too few bytes: {stats['bytes']} < {self._min_bytes}"
+        if stats['duration'] < self._min_duration:
+            return f"too short: {stats['duration']:.2f}s < {self._min_duration:.2f}s"
+        return None
+
+class RetryScheduler(object):
+    """
+    Schedule the (host, repeat) jobs, where a failed job is requeued with an exponential backoff. Since the other
+    jobs are ready in the meantime, the retries are interleaved with the other hosts instead of hammering the
+    failing host: a retry runs as soon as its backoff has elapsed, before the remaining jobs but never right after
+    its own failed attempt, and the scheduler only sleeps if nothing else is left.
+
+    Usage
+    -----
+    ```
+    scheduler = RetryScheduler(jobs)
+    for host, i, attempt in scheduler:
+        if failed:
+            scheduler.retry(host, i, attempt)
+    ```
+    """
+    def __init__(self, jobs, max_attempts=3, backoff=30., clock=time.monotonic):
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self._clock = clock
+        self._seq = 0
+        self._pending = collections.deque((host, i, 0) for host, i in jobs)
+        self._retries = []
+
+    def retry(self, host, i, attempt) -> bool:
+        """
+        Requeue the failed job, return False if it has run out of attempts.
+        """
+        if attempt + 1 >= self._max_attempts:
+            return False
+        # The sequence number keeps the order among the retries ready at the same time.
+        heapq.heappush(self._retries, (self._clock() + self._backoff * 2 ** attempt, self._seq, host, i, attempt + 1))
+        self._seq += 1
+        return True
+
+    def __len__(self):
+        return len(self._pending) + len(self._retries)
+
+    def __iter__(self):
+        last = None
+        while self._pending or self._retries:
+            if self._retries and (not self._pending or
+                                  (self._retries[0][0] <= self._clock() and self._retries[0][2:4] != last)):
+                ready_time, _, host, i, attempt = heapq.heappop(self._retries)
+                wait = ready_time - self._clock()
+                if wait > 0:
+                    time.sleep(wait)
+            else:
+                host, i, attempt = self._pending.popleft()
+            last = (host, i)
+            yield host, i, attempt
+
 def batch_capture(base_dir, host_list, iface, 
                   capture_fileter=common_filter, 
                   repeat=20, 
                   timeout=200, 
                   ill_files=None,
                   log_output=None,
-                  proxy_log=None):
+                  proxy_log=None,
+                  browser_pool=None,
+                  idle_window=5.,
+                  manifest=None,
+                  quality_gate=None,
+                  max_attempts=3,
+                  backoff=30.,
+                  decrypt=True,
+                  profile=None,
+                  ready_timeout=10.,
+                  quiesce_timeout=10.,
+                  proxy=None,
+                  noise_filter=None):
     """
     Capture the traffic of a list of hosts. The capturing and storing process is illustrated as follows.
     Suppose the host_list = [www.baidu.com, www.zhihu.com, www.google.com], and the base_dir is set to
@@ -263,81 +1076,151 @@ def batch_capture(base_dir, host_list, iface,
         The amount of seconds after which the headless browser would stop. Timeout should be large
         enough for the website to load entirely.
 
+    idle_window : float
+        The browser stops earlier once the page has been loaded and the network has been idle for idle_window
+        seconds, set it to None to always browse for timeout seconds.
+
     log_output : str
         The path for Selenium to record the debug log files.
 
     use_proxy : boolean
         Whether to capture proxied traffic.
-    """
-    def launch_proxy(keylog, proxy_log):
-        # TODO: Currently, only Clash is supported. More proxy clients would be supported in the future.
-        stdout = open(proxy_log, 'a+') if proxy_log is not None else subprocess.DEVNULL
 
-        clash_process = subprocess.Popen(
-            ['/home/lxyu/clash/bin/clash-linux-amd64', '-key-trojan', keylog],
-            stdout=stdout,
-            stderr=subprocess.STDOUT 
-        )
-        try:
-            # Monitor the event
-            while not stop_event.is_set():
-                time.sleep(.1)  # Poll every second
-            clash_process.terminate()
-            clash_process.wait()
-        except Exception as e:
-            print(f"Error in subprocess: {e}")
-        finally:
-            if clash_process.poll() is None:
-                clash_process.terminate()
+    browser_pool : BrowserPool
+        The pool of pre-launched browsers to use, a new browser is launched for each visit if not given.
+
+    manifest : CaptureManifest
+        The manifest to record the visits. If given, the output file indices are allocated by the manifest, and
+        only the remaining work is captured, i.e., repeat is the total number of successful visits of each host,
+        which makes it possible to resume an interrupted capture.
+
+    quality_gate : QualityGate
+        If given, each capture is checked right after it finishes. A rejected capture is removed and its job is
+        requeued (see RetryScheduler), at most max_attempts times with a backoff of backoff * 2 ** attempt seconds.
 
+    decrypt : bool
+        Whether the captures are meant to be decrypted later. If not, no keylog file is written, and the
+        header-only profile is used unless profile is given.
+
+    profile : CaptureProfile
+        How the packets are captured, FULL_PROFILE if decrypt else HEADER_PROFILE by default.
+
+    ready_timeout, quiesce_timeout : float
+        The upper bounds of waiting for tshark (and the proxy) to be ready, and for the connections of a visit to
+        be closed, see capture.
+
+    proxy : ProxySupervisor
+        The proxy client shared by the visits, whose keylog is split into proxy_keylog.txt of each host. If not
+        given but proxy_log is, the default proxy client is launched with its output appended to proxy_log.
+
+    noise_filter : NoiseFilter
+        If given, the addresses of the noise SNIs are excluded from capture_filter (see WFlib.tools.noise), and
+        the filter keeps learning from each kept capture, such that a leaked noise flow is excluded afterwards.
+    """
     proto_header = "https://"
     # Handle directory, create if necessary. 
     # Ref: https://stackoverflow.com/questions/273192/how-do-i-create-a-directory-and-any-missing-parent-directories
 
-    # Turn on system proxy
-    if proxy_log is not None:
-        stop_event = multiprocessing.Event()
+    # Launch the proxy once for all the visits, the supervisor is closed here only if created here.
+    own_proxy = proxy is None and proxy_log is not None
+    if own_proxy:
+        Path(base_dir).mkdir(parents=True, exist_ok=True)
+        proxy = ProxySupervisor(keylog_file=os.path.join(base_dir, "proxy_keylog.txt"), log_file=proxy_log,
+                                ready_timeout=ready_timeout)
+
+    try:
+        if manifest is not None:
+            manifest.recover()
+            jobs = manifest.remaining(host_list, repeat)
+        else:
+            jobs = [(host.strip(), i) for i in range(repeat) for host in host_list]
+        scheduler = RetryScheduler(jobs, max_attempts=max_attempts, backoff=backoff)
+        if profile is None:
+            profile = FULL_PROFILE if decrypt else HEADER_PROFILE
 
-    for i in range(repeat):
-        for host in host_list:
+        for host, i, attempt in scheduler:
             # Create a proper subdirectory for each host. Set parents=True to create base_dir if needed.
             # set exist_ok=True to avoid FileExistsError.
-            host = host.strip()
             output_dir = Path("{}/{}".format(base_dir, host))
 
-            output_file_idx = decide_output_file_idx(directory=output_dir)
+            if manifest is not None:
+                output_file_idx = manifest.allocate(host)
+            else:
+                output_file_idx = decide_output_file_idx(directory=output_dir)
             output_file = os.path.join(base_dir, host, "{}_{}.pcapng".format(host, output_file_idx))
-            
+        
             output_dir.mkdir(parents=True, exist_ok=True)
             url = proto_header + host
             # start_time = time.time()
 
-            ssl_keylog_file = f"{base_dir}/{host}/keylog.txt"
-            os.environ["SSLKEYLOGFILE"] = ssl_keylog_file
-
-            # Launch Clash asynchronously
-            if proxy_log is not None:
-                keylog = f"{base_dir}/{host}/proxy_keylog.txt"
-                monitor_process = multiprocessing.Process(target=launch_proxy, kwargs={"keylog": keylog, "proxy_log": proxy_log})
-                monitor_process.start()
-
-                time.sleep(2)  # maybe waiting for proxy client to launch?
-            
-            capture(url=url, 
-                    timeout=timeout, 
-                    iface=iface, 
-                    output_file=output_file,
-                    capture_filter=capture_fileter,
-                    ill_files=ill_files,
-                    log_output=log_output,
-                    proxy_log=proxy_log)
-            
-            if proxy_log is not None:
-                stop_event.set()
-                monitor_process.join()
-                stop_event.clear()
-
-            time.sleep(5)  # Avoid previous session traffic to affect succeeding capture.
+            if decrypt:
+                ssl_keylog_file = f"{base_dir}/{host}/keylog.txt"
+                os.environ["SSLKEYLOGFILE"] = ssl_keylog_file
+            else:
+                os.environ.pop("SSLKEYLOGFILE", None)
+
+            # Restart the proxy only if it is not healthy.
+            if proxy is not None:
+                start = time.time()
+                try:
+                    proxy.ensure()
+                except TimeoutError as e:
+                    if log_output is not None:
+                        with open(log_output, 'a+') as f:
+                            f.write(f"The proxy for {output_file} raises the exception: {e}\n")
+                proxy_wait = time.time() - start
+
+            if manifest is not None:
+                visit_id = manifest.begin_visit(host, output_file_idx, output_file)
+        
+            result = capture(url=url, 
+                             timeout=timeout, 
+                             iface=iface, 
+                             output_file=output_file,
+                             capture_filter=capture_fileter if noise_filter is None else noise_filter.bpf(capture_fileter),
+                             ill_files=ill_files,
+                             log_output=log_output,
+                             proxy_port=proxy.port if proxy is not None else None,
+                             browser_pool=browser_pool,
+                             idle_window=idle_window,
+                             profile=profile,
+                             ready_timeout=ready_timeout,
+                             quiesce_timeout=quiesce_timeout)
+            if proxy is not None:
+                result['waits']['proxy'] = proxy_wait
+                proxy.rotate(f"{base_dir}/{host}/proxy_keylog.txt" if decrypt else None)
+
+            # Recycle the stale browsers only now that the sniffer has stopped.
+            if browser_pool is not None:
+                try:
+                    browser_pool.replenish()
+                except WebDriverException as e:
+                    if log_output is not None:
+                        with open(log_output, 'a+') as f:
+                            f.write(f"The browser pool fails to relaunch a browser after {output_file}: {e}\n")
+
+            reason = None
+            if quality_gate is not None:
+                reason = quality_gate.check(result, capture_stats(output_file))
+
+            if manifest is not None:
+                manifest.end_visit(visit_id, packets=result['packets'], error=reason or result['error'])
+
+            if reason is not None:
+                # Do not keep the rejected capture on disk.
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+                if manifest is not None:
+                    manifest.set_status(visit_id, 'cleared')
+                requeued = scheduler.retry(host, i, attempt)
+                if log_output is not None:
+                    with open(log_output, 'a+') as f:
+                        f.write(f"The file {output_file} is rejected ({reason}), {'requeued' if requeued else 'given up'}\n")
+            elif noise_filter is not None and os.path.exists(output_file):
+                noise_filter.learn_from_capture(output_file)
+    finally:
+        if own_proxy:
+            proxy.close()
 
 def SNI_extract(capture : Capture) -> set:
     """
@@ -450,7 +1333,7 @@ def contains_SNI(SNIs, pkt):
             
     return result
 
-def SNI_exclude_filter(file, SNIs):
+def SNI_exclude_filter(file, SNIs, native=False):
     """
     Create a display filter for the given .pcap file which exclude all the TCP streams that contains the SNI in SNIs.
 
@@ -462,6 +1345,9 @@ def SNI_exclude_filter(file, SNIs):
     SNIs : list
         The SNIs for each of which to exclude the corresponding TCP stream.
 
+    native : bool
+        Whether to find the ClientHellos with the native parser (see WFlib.tools.sni) instead of a tshark pass.
+
     Returns
     -------
     filter : str
@@ -469,23 +1355,31 @@ def SNI_exclude_filter(file, SNIs):
     """
     if SNIs is None or len(SNIs) == 0:
         return None
-    client_hello_capture = pyshark.FileCapture(input_file=file, display_filter="tls.handshake.type == 1")
-    tcp_stream_numbers, udp_stream_numbers = stream_number_extract(capture=client_hello_capture, check=lambda pkt: contains_SNI(SNIs, pkt))
-    client_hello_capture.close()
+    if native:
+        tcp_stream_numbers, udp_stream_numbers = SNI_stream_numbers(file, SNIs)
+    else:
+        client_hello_capture = pyshark.FileCapture(input_file=file, display_filter="tls.handshake.type == 1")
+        tcp_stream_numbers, udp_stream_numbers = stream_number_extract(capture=client_hello_capture, check=lambda pkt: contains_SNI(SNIs, pkt))
+        client_hello_capture.close()
     display_filter = stream_exclude_filter(tcp_stream_numbers, udp_stream_numbers)
     return display_filter
 
-def h2data_SNI_intersect(file, SNIs, keylog_file, custom_parameters = None) -> Tuple[set, set]:
+def h2data_SNI_intersect(file, SNIs, keylog_file, custom_parameters = None, native=False) -> Tuple[set, set]:
     """
     Util function: for a given file, extract the TCP/UDP streams satisfying:
     1. It is the TLS stream with given SNIs;
     2. It contains HTTP/2 DATA frames.
+
+    If native, the TLS streams are found by the native parser (see WFlib.tools.sni) instead of a tshark pass.
     """
-    capture_tls = pyshark.FileCapture(input_file=file, 
-                                      display_filter="tls.handshake.type == 1", 
-                                      custom_parameters=custom_parameters)
-    tcp_stream_numbers_tls, udp_stream_numbers_tls = stream_number_extract(capture=capture_tls, check=lambda pkt: contains_SNI(SNIs, pkt))
-    capture_tls.close()
+    if native:
+        tcp_stream_numbers_tls, udp_stream_numbers_tls = SNI_stream_numbers(file, SNIs)
+    else:
+        capture_tls = pyshark.FileCapture(input_file=file, 
+                                          display_filter="tls.handshake.type == 1", 
+                                          custom_parameters=custom_parameters)
+        tcp_stream_numbers_tls, udp_stream_numbers_tls = stream_number_extract(capture=capture_tls, check=lambda pkt: contains_SNI(SNIs, pkt))
+        capture_tls.close()
 
     SNI_filter = stream_extract_filter(tcp_stream_numbers_tls, udp_stream_numbers_tls)
     
@@ -498,18 +1392,23 @@ def h2data_SNI_intersect(file, SNIs, keylog_file, custom_parameters = None) -> T
 
     return tcp_stream_numbers_h2data & tcp_stream_numbers_tls, udp_stream_numbers_h2data & udp_stream_numbers_tls
 
-def h3data_SNI_intersect(file, SNIs, keylog_file, custom_parameters = None) -> Tuple[set, set]:
+def h3data_SNI_intersect(file, SNIs, keylog_file, custom_parameters = None, native=False) -> Tuple[set, set]:
     """
     Util function: for a given file, extract the TCP/UDP streams satisfying:
     1. It is the QUIC stream with given SNIs;
     2. It contains HTTP/3 DATA frames.
+
+    If native, the QUIC streams are found by the native parser (see WFlib.tools.sni) instead of a tshark pass.
     """
-    # Note that Client Hello is embedded in QUIC, so we need to use tls.handshake.type == 1 to filter.
-    capture_quic = pyshark.FileCapture(input_file=file, 
-                                      display_filter="tls.handshake.type == 1", 
-                                      custom_parameters=custom_parameters)
-    tcp_stream_numbers_quic, udp_stream_numbers_quic = stream_number_extract(capture=capture_quic, check=lambda pkt: contains_SNI(SNIs, pkt))
-    capture_quic.close()
+    if native:
+        tcp_stream_numbers_quic, udp_stream_numbers_quic = SNI_stream_numbers(file, SNIs)
+    else:
+        # Note that Client Hello is embedded in QUIC, so we need to use tls.handshake.type == 1 to filter.
+        capture_quic = pyshark.FileCapture(input_file=file, 
+                                          display_filter="tls.handshake.type == 1", 
+                                          custom_parameters=custom_parameters)
+        tcp_stream_numbers_quic, udp_stream_numbers_quic = stream_number_extract(capture=capture_quic, check=lambda pkt: contains_SNI(SNIs, pkt))
+        capture_quic.close()
 
     SNI_filter = stream_extract_filter(tcp_stream_numbers_quic, udp_stream_numbers_quic)
     
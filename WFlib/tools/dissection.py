@@ -0,0 +1,398 @@
+"""
+A module for caching the decrypting dissection. Decrypting with tls.keylog_file in the two-pass mode (-2) is by far
+the most expensive tshark mode, while most analyses only need a few fields of each frame. Therefore, the first
+decrypting pass exports a compact per-frame table, which is cached on disk and keyed by the hash of the capture,
+the key log and the tshark version, such that later analyses (e.g., ByteCounter.column_count) run against the cached
+table without tshark.
+
+```
+cache = DissectionCache("exp/.dissection")
+table = cache.load("www.apple.com_0.pcapng", keylog_file="www.apple.com_0.keylog")
+tcp_bytes = TCPByteCounter().column_count(table)
+```
+
+The table holds one row per frame, the ragged columns hold a variable number of values per frame (e.g., one per TLS
+record), stored as (values, offsets) such that the values of the i-th frame are values[offsets[i]:offsets[i + 1]].
+
+The table could be built by two backends, the PyShark dissection (dissect), or the tshark fields export (export_table)
+which parses the exported rows into NumPy arrays chunk by chunk without building any per-packet object, and is much
+faster. However, the fields export has no size of the fields, hence its table has no http3_bytes column.
+"""
+
+import numpy as np
+import pyshark
+import hashlib
+import functools
+import os
+import subprocess
+import itertools
+import tempfile
+from pathlib import Path
+from WFlib.tools.formatter import check_tshark
+
+"""
+The version of the table layout, bump it whenever the columns change to invalidate the cached tables.
+"""
+dissection_version = 1
+
+"""
+The per-frame columns, -1 (or 0 for the byte counts) if the frame has no such layer.
+"""
+frame_columns = ['frame', 'tcp_stream', 'udp_stream', 'tcp_bytes', 'udp_bytes', 'quic_padded']
+
+"""
+The ragged columns, namely,
+tls_record_length   : the length of each TLS record;
+http2_type          : the type of each HTTP/2 layer, -1 for the connection preface;
+http2_length        : the length of each HTTP/2 layer (0 for the preface);
+http2_streamid      : the stream ID of each HTTP/2 layer (0 for the preface);
+quic_packet_length  : the length of each QUIC packet;
+http3_frame_type    : the type of each HTTP/3 frame;
+http3_frame_length  : the length of each HTTP/3 frame;
+http3_bytes         : the byte contributions of the HTTP/3 layers, i.e., the size of each unidirectional stream
+                      header, or the sizes of the type/length fields and the length of each frame.
+"""
+ragged_columns = ['tls_record_length', 'http2_type', 'http2_length', 'http2_streamid', 'quic_packet_length',
+                  'http3_frame_type', 'http3_frame_length', 'http3_bytes']
+
+class DissectionTable(object):
+    """
+    The per-frame table of a decrypted capture.
+    """
+    def __init__(self, columns : dict):
+        self._columns = columns
+
+    def __len__(self):
+        return len(self._columns['frame'])
+
+    def __getitem__(self, name) -> np.ndarray:
+        return self._columns[name]
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def ragged(self, name):
+        """
+        Return the (values, offsets) pair of a ragged column.
+        """
+        return self._columns[f"{name}.values"], self._columns[f"{name}.offsets"]
+
+    def frame_sum(self, values, offsets) -> np.ndarray:
+        """
+        Sum the ragged values within each frame, 0 for the frames without values.
+        """
+        lengths = np.diff(offsets)
+        return np.bincount(np.repeat(np.arange(len(lengths)), lengths), weights=values,
+                           minlength=len(lengths)).astype(np.int64)
+
+    def frame_any(self, values, offsets) -> np.ndarray:
+        """
+        Whether any of the ragged values (a boolean array) within each frame is True.
+        """
+        return self.frame_sum(np.asarray(values, dtype=np.int64), offsets) > 0
+
+    def data_frames(self) -> np.ndarray:
+        """
+        Whether each frame carries HTTP/2 or HTTP/3 DATA frames, i.e., http2.type == 0 or http3.frame_type == 0.
+        """
+        http2_type, http2_offsets = self.ragged('http2_type')
+        http3_type, http3_offsets = self.ragged('http3_frame_type')
+        return self.frame_any(http2_type == 0, http2_offsets) | self.frame_any(http3_type == 0, http3_offsets)
+
+    def save(self, file):
+        np.savez(file, **self._columns)
+
+    @staticmethod
+    def load(file) -> 'DissectionTable':
+        with np.load(file) as data:
+            return DissectionTable({name: data[name] for name in data.files})
+
+def _fields(layer, name) -> list:
+    return layer.get_field(name).all_fields if hasattr(layer, name) else []
+
+def dissect(file, keylog_file=None, custom_parameters=None) -> DissectionTable:
+    """
+    Dissect (and decrypt if keylog_file is given) a capture in one pass, and export the per-frame table.
+
+    Params
+    ------
+    file : str
+        The path to the .pcap(ng) file.
+
+    keylog_file : str
+        The key log file to decrypt the capture.
+
+    custom_parameters : list
+        The parameters passed to tshark, ["-2"] (two-pass dissection) by default.
+    """
+    custom_parameters = ["-2"] if custom_parameters is None else custom_parameters
+    override_prefs = {'tls.keylog_file': os.path.abspath(keylog_file)} if keylog_file is not None else None
+    columns = {name: [] for name in frame_columns}
+    ragged = {name: [] for name in ragged_columns}
+    counts = {name: [] for name in ragged_columns}
+
+    cap = pyshark.FileCapture(input_file=str(file), custom_parameters=custom_parameters, override_prefs=override_prefs)
+    try:
+        for pkt in cap:
+            values = {name: [] for name in ragged_columns}
+            tcp_stream, udp_stream, tcp_bytes, udp_bytes, quic_padded = -1, -1, 0, 0, False
+            if 'TCP' in pkt:
+                tcp_stream = int(pkt['TCP'].stream)
+                tcp_bytes = int(pkt['TCP'].len) + int(pkt['TCP'].hdr_len)
+            elif 'UDP' in pkt:
+                udp_stream = int(pkt['UDP'].stream)
+                udp_bytes = int(pkt['UDP'].length)
+
+            for layer in pkt.layers:
+                if layer.layer_name == 'tls':
+                    values['tls_record_length'] += [int(field.showname_value) for field in _fields(layer, 'record_length')]
+                elif layer.layer_name == 'http2':
+                    if hasattr(layer, 'length'):
+                        values['http2_type'].append(int(layer.type))
+                        values['http2_length'].append(int(layer.length))
+                        values['http2_streamid'].append(int(layer.streamid))
+                    else:  # Connection preface
+                        values['http2_type'].append(-1)
+                        values['http2_length'].append(0)
+                        values['http2_streamid'].append(0)
+                elif layer.layer_name == 'quic':
+                    quic_padded |= hasattr(layer, 'coalesced_padding_data')
+                    if hasattr(layer, 'packet_length'):
+                        values['quic_packet_length'].append(int(layer.packet_length))
+                elif layer.layer_name == 'http3':
+                    frame_types = _fields(layer, 'frame_type')
+                    frame_lengths = _fields(layer, 'frame_length')
+                    values['http3_frame_type'] += [int(field.show, 0) for field in frame_types]
+                    values['http3_frame_length'] += [int(field.showname_value) for field in frame_lengths]
+                    if hasattr(layer, 'stream_uni'):
+                        values['http3_bytes'].append(int(layer.stream_uni.size))
+                    else:
+                        values['http3_bytes'] += [int(field.showname_value) + int(field.size) for field in frame_lengths]
+                        values['http3_bytes'] += [int(field.size) for field in frame_types] if frame_lengths else []
+
+            columns['frame'].append(int(pkt.frame_info.number))
+            columns['tcp_stream'].append(tcp_stream)
+            columns['udp_stream'].append(udp_stream)
+            columns['tcp_bytes'].append(tcp_bytes)
+            columns['udp_bytes'].append(udp_bytes)
+            columns['quic_padded'].append(quic_padded)
+            for name in ragged_columns:
+                ragged[name] += values[name]
+                counts[name].append(len(values[name]))
+    finally:
+        cap.close()
+
+    table = {name: np.array(columns[name], dtype=bool if name == 'quic_padded' else np.int64) for name in frame_columns}
+    for name in ragged_columns:
+        table[f"{name}.values"] = np.array(ragged[name], dtype=np.int64)
+        table[f"{name}.offsets"] = np.concatenate([[0], np.cumsum(counts[name], dtype=np.int64)]).astype(np.int64)
+    return DissectionTable(table)
+
+"""
+The fields of the fields-export backend, in the order of the exported columns. Each row holds all the occurrences
+of a field joined by ',', and the connection prefaces of HTTP/2 are recognized by http2.magic.
+"""
+export_fields = ['frame.number', 'tcp.stream', 'udp.stream', 'tcp.len', 'tcp.hdr_len', 'udp.length',
+                 'quic.coalesced_padding_data', 'tls.record.length', 'http2.magic', 'http2.type', 'http2.length',
+                 'http2.streamid', 'quic.packet_length', 'http3.frame_type', 'http3.frame_length']
+
+def _parse_ints(text) -> np.ndarray:
+    """
+    Parse the ','-separated decimal integers, which is much faster than converting the strings one by one.
+    """
+    return np.fromstring(text, dtype=np.int64, sep=',') if text else np.array([], dtype=np.int64)
+
+def _first_column(cells, default) -> np.ndarray:
+    """
+    Parse the first occurrence of an integer field in each row, default if absent.
+    """
+    default = str(default)
+    return _parse_ints(','.join([cell.split(',', 1)[0] if cell else default for cell in cells]))
+
+def _ragged_column(cells, base=10):
+    """
+    Parse all the occurrences of an integer field in each row into (values, counts).
+    """
+    counts = np.fromiter((cell.count(',') + 1 if cell else 0 for cell in cells), dtype=np.int64, count=len(cells))
+    joined = ','.join(cell for cell in cells if cell)
+    if not joined:
+        return np.array([], dtype=np.int64), counts
+    if base == 10:
+        return _parse_ints(joined), counts
+    return np.fromiter((int(value, 0) for value in joined.split(',')), dtype=np.int64), counts
+
+def _prepend_ragged(values, counts, prefix_counts, fill):
+    """
+    Prepend prefix_counts[i] fill values to the values of the i-th row, return the new (values, counts).
+    """
+    total_counts = counts + prefix_counts
+    starts = np.concatenate([[0], np.cumsum(total_counts)]).astype(np.int64)
+    rows = np.repeat(np.arange(len(counts)), counts)
+    index_in_row = np.arange(len(values)) - np.concatenate([[0], np.cumsum(counts)])[:-1][rows]
+    result = np.full(starts[-1], fill, dtype=np.int64)
+    result[starts[rows] + prefix_counts[rows] + index_in_row] = values
+    return result, total_counts
+
+def parse_export_rows(rows) -> dict:
+    """
+    Parse the tab-separated rows exported by tshark (with the fields in export_fields) into the columns of a
+    DissectionTable, the same as dissect except that http3_bytes is absent, and the prefaces are the first
+    HTTP/2 values of a frame.
+    """
+    cells = [row.rstrip('\n').split('\t') for row in rows if row.strip()]
+    fields = dict(zip(export_fields, zip(*cells) if cells else [() for _ in export_fields]))
+    tcp_stream = _first_column(fields['tcp.stream'], -1)
+    is_tcp = tcp_stream >= 0
+    columns = {
+        'frame': _first_column(fields['frame.number'], 0),
+        'tcp_stream': tcp_stream,
+        'udp_stream': np.where(is_tcp, -1, _first_column(fields['udp.stream'], -1)),
+        'tcp_bytes': _first_column(fields['tcp.len'], 0) + _first_column(fields['tcp.hdr_len'], 0),
+        'udp_bytes': np.where(is_tcp, 0, _first_column(fields['udp.length'], 0)),
+        'quic_padded': np.array([bool(cell) for cell in fields['quic.coalesced_padding_data']], dtype=bool),
+    }
+    counts = dict()
+    for name, field, base in [('tls_record_length', 'tls.record.length', 10), ('http2_type', 'http2.type', 10),
+                              ('http2_length', 'http2.length', 10), ('http2_streamid', 'http2.streamid', 10),
+                              ('quic_packet_length', 'quic.packet_length', 10),
+                              ('http3_frame_type', 'http3.frame_type', 0),
+                              ('http3_frame_length', 'http3.frame_length', 10)]:
+        columns[f"{name}.values"], counts[name] = _ragged_column(fields[field], base)
+
+    prefaces = np.fromiter((cell.count(',') + 1 if cell else 0 for cell in fields['http2.magic']), dtype=np.int64,
+                           count=len(cells))
+    for name, fill in [('http2_type', -1), ('http2_length', 0), ('http2_streamid', 0)]:
+        columns[f"{name}.values"], counts[name] = _prepend_ragged(columns[f"{name}.values"], counts[name], prefaces, fill)
+    for name, count in counts.items():
+        columns[f"{name}.offsets"] = np.concatenate([[0], np.cumsum(count)]).astype(np.int64)
+    return columns
+
+def concat_columns(chunks : list) -> dict:
+    """
+    Concatenate the columns of consecutive chunks of frames, shifting the offsets of the ragged columns.
+    """
+    if len(chunks) == 1:
+        return chunks[0]
+    columns = dict()
+    for name in chunks[0]:
+        if name.endswith('.offsets'):
+            values_name = name[:-len('.offsets')] + '.values'
+            shifts = np.cumsum([0] + [len(chunk[values_name]) for chunk in chunks[:-1]])
+            columns[name] = np.concatenate([chunks[0][name][:1]] + [chunk[name][1:] + shift
+                                                                    for chunk, shift in zip(chunks, shifts)])
+        else:
+            columns[name] = np.concatenate([chunk[name] for chunk in chunks])
+    return columns
+
+def export_table(file, keylog_file=None, display_filter=None, custom_parameters=None, chunk_size=1 << 16) -> DissectionTable:
+    """
+    Build the table of a capture by the tshark fields export, see parse_export_rows. The rows are parsed chunk by
+    chunk while tshark is running, such that only the compact arrays are held in memory.
+
+    Params
+    ------
+    file : str
+        The path to the .pcap(ng) file.
+
+    keylog_file : str
+        The key log file to decrypt the capture.
+
+    display_filter : str
+        The display filter to apply, the table only holds the displayed frames.
+
+    custom_parameters : list
+        The parameters passed to tshark, ["-2"] (two-pass dissection) by default.
+
+    chunk_size : int
+        The number of rows parsed at once.
+    """
+    custom_parameters = ["-2"] if custom_parameters is None else custom_parameters
+    cmd = ['tshark', '-r', str(file), '-T', 'fields', '-E', 'separator=/t', '-E', 'occurrence=a', '-E', 'aggregator=,']
+    cmd += custom_parameters
+    if keylog_file is not None:
+        if not os.path.exists(keylog_file):  # tshark ignores a missing key log file silently
+            raise FileNotFoundError(f"The key log file does not exist: {keylog_file}")
+        cmd += ['-o', f"tls.keylog_file:{os.path.abspath(keylog_file)}"]
+    if display_filter:
+        cmd += ['-Y', display_filter]
+    for field in export_fields:
+        cmd += ['-e', field]
+
+    chunks = []
+    with tempfile.TemporaryFile() as stderr:
+        tshark_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        try:
+            while True:
+                rows = list(itertools.islice(tshark_process.stdout, chunk_size))
+                if len(rows) == 0:
+                    break
+                chunks.append(parse_export_rows(rows))
+        finally:
+            tshark_process.stdout.close()
+            tshark_process.wait()
+        # Never build (and cache) the table of a failed export, e.g., due to a bad keylog file or display filter.
+        check_tshark(tshark_process, stderr)
+
+    return DissectionTable(concat_columns(chunks) if chunks else parse_export_rows([]))
+
+@functools.lru_cache(maxsize=None)
+def tshark_version() -> str:
+    output = subprocess.run(['tshark', '-v'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+    return output.splitlines()[0] if output else ""
+
+def file_digest(file, digest=None):
+    """
+    Feed the content of a file into the hash object digest (a new sha256 if None), return the hash object.
+    """
+    digest = hashlib.sha256() if digest is None else digest
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest
+
+class DissectionCache(object):
+    """
+    The on-disk cache of the per-frame tables, one .npz file per (capture, key log, tshark version, parameters).
+
+    Params
+    ------
+    cache_dir : str
+        The directory of the cache, created if not exists.
+
+    backend : str
+        'pyshark' (dissect) or 'fields' (export_table, without http3_bytes).
+    """
+    def __init__(self, cache_dir, backend="pyshark"):
+        if backend not in ['pyshark', 'fields']:
+            raise ValueError(f"Unsupported backend: {backend}")
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.backend = backend
+
+    def key(self, file, keylog_file=None, custom_parameters=None) -> str:
+        digest = hashlib.sha256(f"{dissection_version}\n{self.backend}\n{tshark_version()}\n{custom_parameters}\n".encode())
+        file_digest(file, digest)
+        if keylog_file is not None:
+            digest.update(b"\nkeylog\n")
+            file_digest(keylog_file, digest)
+        return digest.hexdigest()
+
+    def path(self, file, keylog_file=None, custom_parameters=None) -> Path:
+        return self.cache_dir / f"{self.key(file, keylog_file, custom_parameters)}.npz"
+
+    def load(self, file, keylog_file=None, custom_parameters=None) -> DissectionTable:
+        """
+        Load the table of a capture, dissect it and store the table if not cached yet.
+        """
+        path = self.path(file, keylog_file, custom_parameters)
+        if path.exists():
+            return DissectionTable.load(path)
+        if self.backend == 'fields':
+            table = export_table(file, keylog_file=keylog_file, custom_parameters=custom_parameters)
+        else:
+            table = dissect(file, keylog_file=keylog_file, custom_parameters=custom_parameters)
+        # Write to a temporary file first, such that concurrent readers never see a partial table.
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp.npz")
+        table.save(tmp_path)
+        os.replace(tmp_path, path)
+        return table
@@ -4,15 +4,195 @@ import json
 from pathlib import Path
 import warnings
 import multiprocessing
+import subprocess
+import itertools
 from WFlib.tools.capture import SNI_exclude_filter
 from typing import Union, List
 import asyncio
 import os
+import tempfile
+
+"""
+The fields exported by tshark for the columnar backend, see read_packet_columns. IPv4 and IPv6 addresses are
+exported separately and merged afterwards, since each packet carries only one of them.
+"""
+column_fields = ['frame.time_relative', 'ip.src', 'ipv6.src', 'ip.dst', 'ipv6.dst', 'frame.len', 'tcp.stream', 'udp.stream']
+
+def parse_packet_columns(lines) -> dict:
+    """
+    Parse the tab-separated rows exported by tshark (with the fields in column_fields) into aligned columns.
+
+    Params
+    ------
+    lines : Iterable[str]
+        The rows exported by tshark, one row per packet.
+
+    Returns
+    -------
+    columns : dict
+        The aligned NumPy columns, namely,
+        time        : float64, the relative time of each packet (frame.time_relative);
+        src, dst    : str, the source/destination IP addresses (IPv4 or IPv6);
+        length      : int64, the frame length;
+        tcp_stream  : int64, the TCP stream index, -1 for non-TCP packets;
+        udp_stream  : int64, the UDP stream index, -1 for non-UDP packets.
+    """
+    rows = [line.rstrip('\n').split('\t') for line in lines if line.strip()]
+    num = len(rows)
+
+    def stream_column(idx):
+        return np.fromiter((int(row[idx]) if row[idx] else -1 for row in rows), dtype=np.int64, count=num)
+
+    return {
+        'time': np.fromiter((float(row[0]) for row in rows), dtype=np.float64, count=num),
+        'src': np.array([row[1] or row[2] for row in rows], dtype=str),
+        'dst': np.array([row[3] or row[4] for row in rows], dtype=str),
+        'length': np.fromiter((int(row[5]) for row in rows), dtype=np.int64, count=num),
+        'tcp_stream': stream_column(6),
+        'udp_stream': stream_column(7),
+    }
+
+def read_packet_columns(file, display_filter=None, max_packets=None) -> dict:
+    """
+    Read a .pcap(ng) file into aligned NumPy columns with one tshark fields export, which is much cheaper than
+    building a PyShark packet object per packet. See parse_packet_columns for the returned columns.
+
+    Params
+    ------
+    file : str
+        The path to the .pcap(ng) file.
+
+    display_filter : str
+        The display filter to apply, the columns only hold the displayed packets.
+
+    max_packets : int
+        If given, only the first max_packets displayed packets are read, and tshark is terminated as soon as
+        they are read instead of dissecting the rest of the file.
+    """
+    cmd = ['tshark', '-r', str(file), '-T', 'fields', '-E', 'separator=/t', '-E', 'occurrence=f']
+    if display_filter:
+        cmd += ['-Y', display_filter]
+    for field in column_fields:
+        cmd += ['-e', field]
+
+    with tempfile.TemporaryFile() as stderr:
+        tshark_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        rows = tshark_process.stdout if max_packets is None else itertools.islice(tshark_process.stdout, max_packets)
+        columns = None
+        terminated = False
+        try:
+            columns = parse_packet_columns(rows)
+        finally:
+            # Stop early only once max_packets rows are read, the remaining packets are not needed. With fewer rows,
+            # tshark reached the end of its output, and may have failed without being reaped yet.
+            complete = columns is None or len(columns['time']) == max_packets
+            if max_packets is not None and complete and tshark_process.poll() is None:
+                tshark_process.terminate()
+                terminated = True
+            tshark_process.stdout.close()
+            tshark_process.wait()
+        check_tshark(tshark_process, stderr, terminated)
+
+    return columns
+
+def check_tshark(tshark_process, stderr, terminated=False):
+    """
+    Raise a RuntimeError with the error message of an exited tshark process if it failed, e.g., due to a missing
+    file or an invalid display filter, instead of returning empty results silently.
+
+    Params
+    ------
+    tshark_process : subprocess.Popen
+        The exited tshark process.
+
+    stderr : file
+        The binary file the stderr of tshark was redirected to.
+
+    terminated : bool
+        Whether the process was terminated on purpose, which is the only allowed non-zero exit.
+    """
+    if tshark_process.returncode == 0 or terminated:
+        return
+    stderr.seek(0)
+    message = stderr.read().decode(errors='replace').strip()
+    raise RuntimeError(f"tshark exited with {tshark_process.returncode}: {message}")
+
+def align_feature(feature, length) -> np.ndarray:
+    """
+    Truncate or pad (with 0) the feature vector to the given length.
+    """
+    feature = np.asarray(feature)
+    if length <= len(feature): # Truncate
+        return feature[:length]
+    padding_len = length - len(feature)
+    return np.pad(feature, (0, padding_len), mode="constant", constant_values=0)
+
+def dump_ragged(buf : dict, path):
+    """
+    Dump the raw buffer {'hosts': [...], 'labels': [...], name_1: [feature, ...], ...}, whose features are of
+    different lengths, into a ragged container. The container is a directory holding one .npy file per array,
+    such that each of them could be memory-mapped when loading (see RaggedFormatter). By convention, the name of
+    the container ends with .ragged, which PcapFormatter.dump relies on in raw mode.
+
+    ```
+    path
+      |---hosts.npy
+      |---labels.npy
+      |---name_1.values.npy   (all the feature vectors concatenated)
+      |---name_1.offsets.npy  (the i-th feature vector is values[offsets[i]:offsets[i + 1]])
+      |---...
+    ```
+
+    Params
+    ------
+    buf : dict
+        The raw buffer to dump.
+
+    path : str
+        The directory of the container, created if not exists.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    np.save(path / "hosts.npy", np.array(buf['hosts'], dtype=str))
+    np.save(path / "labels.npy", np.array(buf['labels'], dtype=np.int64))
+    for name, features in buf.items():
+        if name in ['hosts', 'labels']:
+            continue
+        features = [np.asarray(feature) for feature in features]
+        lengths = np.array([len(feature) for feature in features], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        # Empty feature vectors are float by default, which should not affect the dtype of the others.
+        non_empty = [feature for feature in features if len(feature) > 0]
+        values = np.concatenate(non_empty) if len(non_empty) > 0 else np.array([], dtype=np.float64)
+
+        np.save(path / f"{name}.values.npy", values)
+        np.save(path / f"{name}.offsets.npy", offsets)
+
+def json_to_ragged(json_file, path):
+    """
+    Convert the .json file dumped by PcapFormatter in raw mode (length <= 0) into a ragged container,
+    see dump_ragged.
+    """
+    with open(json_file, "r") as f:
+        buf = json.load(f)
+    dump_ragged(buf, path)
 
 class Extractor(object):
     """
     The class provides methods for the actual feature extraction work. This is some abstract class, and the 
     extractors used MUST inherit it.
+
+    An extractor works in one of the three ways:
+
+    + Per-packet: extract is called once per packet, and appends the feature of the packet to the target list.
+      This is the fallback which every extractor SHOULD implement.
+    + Columnar: batch_extract is called once per capture with the aligned columns (see read_packet_columns),
+      and returns the feature vector of the whole capture at once. Extractors that could be vectorized SHOULD
+      implement it, since it avoids the per-packet call overhead.
+    + Capture-level: capture_extract is called once per capture with the file itself, and returns the feature
+      vector of the whole capture. This is for the extractors that need their own pass over the capture, e.g.,
+      decryption (see analyzer.CellFeatureExtractor), and they need not implement extract.
     """
     def __init__(self, name):
         self._name = name
@@ -26,9 +206,48 @@ class Extractor(object):
     def name(self):
         return self._name
 
+    @property
+    def columnar(self):
+        """
+        Whether the extractor implements batch_extract.
+        """
+        return type(self).batch_extract is not Extractor.batch_extract
+
+    @property
+    def capture_level(self):
+        """
+        Whether the extractor implements capture_extract.
+        """
+        return type(self).capture_extract is not Extractor.capture_extract
+
     def extract(self):
         raise NotImplementedError
 
+    def batch_extract(self, columns : dict) -> np.ndarray:
+        """
+        Extract the feature vector of a whole capture from its aligned columns.
+
+        Params
+        ------
+        columns : dict
+            The aligned NumPy columns of the capture, see read_packet_columns.
+        """
+        raise NotImplementedError
+
+    def capture_extract(self, file, display_filter=None) -> np.ndarray:
+        """
+        Extract the feature vector of a whole capture from the file itself.
+
+        Params
+        ------
+        file : str
+            The path to the .pcap(ng) file.
+
+        display_filter : str
+            The display filter of the formatter, which the extractor SHOULD respect.
+        """
+        raise NotImplementedError
+
 
 class DirectionExtractor(Extractor):
     """
@@ -65,6 +284,12 @@ class DirectionExtractor(Extractor):
 
         target.append(1 if src in self._src else -1) # 1 for egress, -1 for ingress
 
+    def batch_extract(self, columns : dict) -> np.ndarray:
+        """
+        Extract the direction vector of a whole capture, 1 for egress and -1 for ingress.
+        """
+        return np.where(np.isin(columns['src'], self._src), 1, -1)
+
 class TimeExtractor(Extractor):
     """
     The timestamp extractor. Note that the time is relative time, i.e., the time after
@@ -113,14 +338,51 @@ class TimeExtractor(Extractor):
         else:
             target.append(ts)
 
+    def batch_extract(self, columns : dict) -> np.ndarray:
+        """
+        Extract the (directional) timestamp vector of a whole capture.
+        """
+        ts = columns['time']
+        if self._src:
+            return np.where(np.isin(columns['src'], self._src), ts, -1 * ts)
+        return ts.copy()
+
 class DeltaExtractor(Extractor):
     """
-    The delta time extractor. Delta time denotes for the duration between 2 consecutive packets.
-    TODO: Note that since we are using display filter in analysis, one should use frame.time_delta_displayed
-    instead of frame.time_delta (which is the delta when only_summaries=True in PyShark).
+    The delta time extractor. Delta time denotes for the duration between 2 consecutive packets, and the
+    delta of the first packet is set to 0.
+
+    Note that since we are using display filter in analysis, the delta is computed between consecutive
+    displayed packets (i.e., frame.time_delta_displayed) instead of frame.time_delta, which is the delta when
+    only_summaries=True in PyShark.
     """
     def __init__(self, name="delta"):
         super().__init__(name=name)
+        self._last_ts = 0.
+
+    def extract(self, pkt, target : list, only_summaries=True):
+        """
+        Extract the delta time info and store them into target. An empty target denotes the first
+        packet of the capture.
+
+        Params
+        ------
+        pkt : packet
+            The packet to extract the feature.
+
+        target : list
+            The variable to store features.
+        """
+        ts = float(pkt.time) if only_summaries else float(pkt['frame'].time_relative)
+        target.append(ts - self._last_ts if len(target) > 0 else 0.)
+        self._last_ts = ts
+
+    def batch_extract(self, columns : dict) -> np.ndarray:
+        """
+        Extract the delta time vector of a whole capture.
+        """
+        ts = columns['time']
+        return np.diff(ts, prepend=ts[:1])
 
 class Formatter(object):
     """
@@ -202,7 +464,7 @@ class PcapFormatter(Formatter):
     The class to convert .pcap files to .npz files. Moreover, it supports to convert .pcap files to .json files for
     raw feature extraction (See Attributes in __init__), where no truncation/padding would be applied.
     """
-    def __init__(self, length=0, only_summaries=True, keep_packets=True, display_filter=None):
+    def __init__(self, length=0, only_summaries=True, keep_packets=True, display_filter=None, columnar=False, lazy=False):
         """
         Attributes
         ----------
@@ -250,8 +512,20 @@ class PcapFormatter(Formatter):
 
             Therefore, the raw attribute is introduced to indicate whether to truncate/pad the feature vectors. The
             reason to introduce this redundant attribute is for semantic clarity. Note that when raw is True, the data
-            are stored in nested lists instead of concatenated ndarray. Further, the it would be dumped to .json files
-            instead of .npz for better flexibility.
+            are stored in nested lists instead of concatenated ndarray. Further, the it would be dumped to a .json
+            file instead of .npz for better flexibility, or to a memory-mappable ragged container (see dump_ragged)
+            if the file name ends with .ragged.
+
+        columnar : bool
+            Whether to read the capture into aligned columns (see read_packet_columns) with a single tshark fields
+            export, and hand the whole columns to the extractors implementing batch_extract. The extractors that
+            only implement the per-packet extract still fall back to iterating over a PyShark capture.
+
+        lazy : bool
+            Whether to stop reading the capture once every extractor has extracted length features, which makes the
+            extraction time scale with length instead of the capture size. The underlying tshark process is
+            terminated at that point. Lazy mode only takes effect when length > 0, and it assumes that no extractor
+            depends on the packets after the first length ones.
 
         For example, for each of the hosts in [www.baidu.com, www.google.com, www.zhihu.com], we capture 3 request 
         traces (.pcap). Then the labels after performing transform should be [0, 0, 0, 1, 1, 1, 2, 2, 2].
@@ -261,6 +535,9 @@ class PcapFormatter(Formatter):
         self._only_summaries = only_summaries
         self._keep_packets = keep_packets
         self._raw = length <= 0
+        self._columnar = columnar
+        self._lazy = lazy and not self._raw
+        self._file = None
 
     @property
     def display_filter(self):
@@ -270,11 +547,71 @@ class PcapFormatter(Formatter):
     def display_filter(self, display_filter):
         self._display_filter = display_filter
 
+    def _open_capture(self, file):
+        return pyshark.FileCapture(input_file=file, 
+                                   display_filter=self.display_filter,
+                                   only_summaries=self._only_summaries,
+                                   keep_packets=self._keep_packets)
+
+    def _load(self, file):
+        """
+        Load the file as the packet source, i.e., the aligned columns in columnar mode, and a PyShark
+        capture otherwise.
+        """
+        if self._columnar:
+            max_packets = self._length if self._lazy else None
+            return read_packet_columns(file, display_filter=self.display_filter, max_packets=max_packets)
+        return self._open_capture(file)
+
     def load(self, file):
-        self._raw_buf = pyshark.FileCapture(input_file=file, 
-                                            display_filter=self.display_filter,
-                                            only_summaries=self._only_summaries,
-                                            keep_packets=self._keep_packets)
+        self._file = file
+        self._raw_buf = self._load(file)
+
+    def _extract(self, source, file, *extractors : Extractor) -> dict:
+        """
+        Run the extractors over the packet source loaded from file, and return the temporary buffer
+        {name: feature} holding the features extracted.
+        """
+        tmp_buf = dict()
+        packet_extractors = []
+        for extractor in extractors:
+            if extractor.capture_level:
+                tmp_buf[extractor.name] = extractor.capture_extract(file, display_filter=self.display_filter)
+            elif self._columnar and extractor.columnar:
+                tmp_buf[extractor.name] = extractor.batch_extract(source)
+            else:
+                tmp_buf[extractor.name] = []
+                packet_extractors.append(extractor)
+
+        if not self._columnar and len(packet_extractors) == 0:
+            source.close()
+            return tmp_buf
+
+        if self._columnar:
+            if len(packet_extractors) == 0:
+                return tmp_buf
+            # Fall back to the per-packet extraction for the extractors without batch_extract.
+            source = self._open_capture(file)
+
+        for pkt in source:
+            for extractor in packet_extractors:
+                extractor.extract(pkt, tmp_buf[extractor.name], only_summaries=self._only_summaries)
+            if self._lazy and all(len(tmp_buf[extractor.name]) >= self._length for extractor in packet_extractors):
+                break  # Every extractor has enough features, closing the capture terminates tshark.
+
+        source.close()
+        return tmp_buf
+
+    def _append(self, buf, tmp_buf, *extractors : Extractor):
+        """
+        Truncate/pad the features in tmp_buf if needed, and append them to buf[name].
+        """
+        for extractor in extractors:
+            feature = tmp_buf[extractor.name]
+            if not self._raw:
+                buf[extractor.name].append(align_feature(feature, self._length))
+            else:
+                buf[extractor.name].append(np.asarray(feature))
 
     def transform(self, host : str, label : int, *extractors : Extractor):
         """
@@ -285,10 +622,8 @@ class PcapFormatter(Formatter):
         the caller.
 
         NOTE: We defer the truncation/padding to the point when the whole .pcap is iterated
-        through to keep the integrity lest some extractor depends on that. Later the lazy mode
-        might be introduced to make the integrity optional.
-
-        TODO: Introduce lazy mode.
+        through to keep the integrity lest some extractor depends on that. In lazy mode, the 
+        iteration stops as soon as every extractor has extracted length features.
 
         Params
         ------
@@ -307,38 +642,26 @@ class PcapFormatter(Formatter):
             self._buf['hosts'].append(host)
 
         self._buf['labels'].append(label)
-        tmp_buf = dict()
 
         for extractor in extractors:
-            tmp_buf[extractor.name] = []
             # Initialize a new list for the given feature name
             if extractor.name not in self._buf:
                 self._buf[extractor.name] = []
         
         # The temporaty buffer to hold the features extracted from current self._raw_buf
-
-        for pkt in self._raw_buf:
-            for extractor in extractors:
-                extractor.extract(pkt, tmp_buf[extractor.name], only_summaries=self._only_summaries)
-
-        self._raw_buf.close()
+        tmp_buf = self._extract(self._raw_buf, self._file, *extractors)
 
         # Dump features into ndarray, and append to self._buf[name]
-        for extractor in extractors:
-            if not self._raw:
-                if self._length <= len(tmp_buf[extractor.name]): # Truncate
-                    self._buf[extractor.name].append(np.array(tmp_buf[extractor.name][:self._length]))
-                else:
-                    padding = 0
-                    padding_len = self._length - len(tmp_buf[extractor.name])
-                    self._buf[extractor.name].append(np.array(tmp_buf[extractor.name] + [padding] * padding_len))
-            else:
-                self._buf[extractor.name].append(tmp_buf[extractor.name])
+        self._append(self._buf, tmp_buf, *extractors)
 
     def dump(self, file):
-        if self._raw:  # Dump the file to .json format
-            with open(file, "w") as f:
-                json.dump(self._buf, f)
+        if self._raw:
+            if str(file).endswith(".ragged"):  # Opt-in, dump the file to a ragged container
+                dump_ragged(self._buf, file)
+                return
+
+            with open(file, "w") as f:  # Dump the file to .json format
+                json.dump(self._buf, f, default=lambda feature: feature.tolist())
                 return
 
         super().dump(file)
@@ -399,8 +722,8 @@ class DistriPcapFormatter(PcapFormatter):
 
     c.sort(key=lambda x: x[0])
     """
-    def __init__(self, length=0, only_summaries=True, keep_packets=True, display_filter=None, num_worker=4):
-        super().__init__(length, only_summaries, keep_packets, display_filter)
+    def __init__(self, length=0, only_summaries=True, keep_packets=True, display_filter=None, num_worker=4, columnar=False, lazy=False):
+        super().__init__(length, only_summaries, keep_packets, display_filter, columnar, lazy)
         self._num_worker = num_worker
 
     def load(self, file):
@@ -422,30 +745,10 @@ class DistriPcapFormatter(PcapFormatter):
         # Therefore, we only create explicit event loop when the platform is *nix.
         # UPDATE: The issue remains, no idea about this:(
 
-        tmp_buf = {extractor.name : [] for extractor in extractors}
-
-        cap = pyshark.FileCapture(input_file=file, 
-                                  display_filter=self.display_filter,
-                                  only_summaries=self._only_summaries,
-                                  keep_packets=self._keep_packets)
-        
-        for pkt in cap:
-            for extractor in extractors:
-                extractor.extract(pkt, tmp_buf[extractor.name], only_summaries=self._only_summaries)
-
-        cap.close()
+        tmp_buf = self._extract(self._load(file), file, *extractors)
 
         # Dump features into ndarray, and append to self._buf[name]
-        for extractor in extractors:
-            if not self._raw:
-                if self._length <= len(tmp_buf[extractor.name]): # Truncate
-                    buf[extractor.name].append(np.array(tmp_buf[extractor.name][:self._length]))
-                else:
-                    padding = 0
-                    padding_len = self._length - len(tmp_buf[extractor.name])
-                    buf[extractor.name].append(np.array(tmp_buf[extractor.name] + [padding] * padding_len))
-            else:
-                buf[extractor.name].append(tmp_buf[extractor.name])
+        self._append(buf, tmp_buf, *extractors)
 
     def batch_extract(self, base_dir, output_file, SNIs=None, *extractors: Extractor):
         '''
@@ -578,4 +881,70 @@ class JsonFormatter(Formatter):
         """
         Get the un-transformed feature buffer by its name.
         """
-        return self._raw_buf[name]
\ No newline at end of file
+        return self._raw_buf[name]
+
+class RaggedFormatter(Formatter):
+    """
+    The formatter for the ragged containers dumped by dump_ragged. Compared with JsonFormatter, the containers
+    are memory-mapped instead of parsed, and the truncation/padding is vectorized.
+    """
+    def __init__(self):
+        super().__init__()
+
+    def load(self, path, mmap_mode='r'):
+        """
+        Load the ragged container, each feature is loaded as a (values, offsets) pair.
+
+        Params
+        ------
+        path : str
+            The directory of the container.
+
+        mmap_mode : str
+            The mmap_mode passed to np.load, None to read the arrays into memory.
+        """
+        path = Path(path)
+        self._raw_buf = dict()
+        self._raw_buf['hosts'] = np.load(path / "hosts.npy")
+        self._raw_buf['labels'] = np.load(path / "labels.npy")
+        for values_file in sorted(path.glob("*.values.npy")):
+            name = values_file.name[:-len(".values.npy")]
+            self._raw_buf[name] = (np.load(values_file, mmap_mode=mmap_mode), 
+                                   np.load(path / f"{name}.offsets.npy", mmap_mode=mmap_mode))
+
+    def transform(self, debug=True, **kwargs):
+        """
+        The function to align each feature to the corresponding length, the same as JsonFormatter.transform.
+        The kwargs is like {name_1: length_1, ..., name_n: length_n}.
+        """
+        if not debug:
+            warnings.filterwarnings('ignore')
+
+        self._buf['labels'] = np.array(self._raw_buf['labels'])
+        self._buf['hosts'] = np.array(self._raw_buf['hosts'])
+
+        for name, length in kwargs.items():
+            if name in ['labels', 'hosts']:
+                warnings.warn("Names 'labels' and 'hosts' are reserved and could not used for truncation/padding.")
+                continue 
+            elif name not in self._raw_buf:
+                warnings.warn(f"Key {name} is not present in the data.")
+                continue
+
+            values, offsets = self._raw_buf[name]
+            starts = np.asarray(offsets[:-1])
+            counts = np.minimum(np.diff(offsets), length)  # Truncate
+            cols = np.arange(length)
+            mask = cols < counts[:, np.newaxis]  # The remaining positions are padded with 0
+            aligned = np.zeros((len(starts), length), dtype=values.dtype)
+            aligned[mask] = values[(starts[:, np.newaxis] + cols)[mask]]
+            self._buf[name] = aligned
+
+    def get_feature_buf(self, name):
+        """
+        Get the un-transformed feature buffer by its name, each feature vector is a view into the container.
+        """
+        if name in ['labels', 'hosts']:
+            return self._raw_buf[name]
+        values, offsets = self._raw_buf[name]
+        return [values[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
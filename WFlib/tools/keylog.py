@@ -0,0 +1,127 @@
+"""
+A module for TLS key log files (the NSS key log format of SSLKEYLOGFILE). Since batch_capture appends the keys of
+every visit to the same keylog.txt of the host, the file grows with each repeat, and every decrypting pass makes
+tshark load and hash the whole file. Instead, KeylogIndex maps each ClientHello random to its secrets, such that a
+minimal keylog holding only the secrets for the randoms seen in a capture could be generated for each capture.
+
+```
+index = KeylogIndex("base_dir/www.apple.com/keylog.txt")
+keylog_file = index.minimal_keylog("base_dir/www.apple.com/www.apple.com_0.pcapng")
+# -> base_dir/www.apple.com/www.apple.com_0.keylog, which could be passed to tls.keylog_file
+```
+"""
+
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Iterable, Union
+from WFlib.tools.formatter import check_tshark
+
+def parse_keylog_line(line) -> Union[tuple, None]:
+    """
+    Parse a line of the key log file into (label, client_random, secret), where client_random is in lowercase hex.
+    Return None for comments and malformed lines.
+
+    NOTE: For the RSA label, the second field is the encrypted pre-master secret rather than the client random.
+    """
+    fields = line.split()
+    if len(fields) != 3 or fields[0].startswith('#'):
+        return None
+    return fields[0], fields[1].lower(), fields[2]
+
+def client_randoms(file) -> set:
+    """
+    Extract the randoms of all ClientHellos (TLS over TCP, as well as TLS in QUIC) in a capture, in lowercase hex.
+    Raise a RuntimeError if tshark fails, rather than returning no randoms (and an empty minimal keylog).
+    """
+    with tempfile.TemporaryFile() as stderr:
+        tshark_process = subprocess.run(['tshark', '-r', str(file), '-Y', 'tls.handshake.type == 1',
+                                         '-T', 'fields', '-E', 'occurrence=a', '-e', 'tls.handshake.random'],
+                                        stdout=subprocess.PIPE, stderr=stderr, text=True)
+        check_tshark(tshark_process, stderr)
+    output = tshark_process.stdout
+    randoms = set()
+    for line in output.split():
+        for random in line.split(','):
+            if random:
+                randoms.add(random.replace(':', '').lower())
+    return randoms
+
+class KeylogIndex(object):
+    """
+    The index from the client random to the lines of the key log file, e.g., CLIENT_RANDOM (TLS 1.2), or
+    CLIENT_HANDSHAKE_TRAFFIC_SECRET, SERVER_TRAFFIC_SECRET_0, etc. (TLS 1.3).
+
+    The key log file is read incrementally, i.e., update only parses the lines appended since the last update.
+    """
+    def __init__(self, keylog_file):
+        self.keylog_file = keylog_file
+        self._index = dict()
+        self._rsa_lines = []
+        self._offset = 0
+        self.update()
+
+    def update(self):
+        if not os.path.exists(self.keylog_file):
+            return
+        with open(self.keylog_file, 'rb') as f:
+            f.seek(self._offset)
+            content = f.read()
+        content = content[:content.rfind(b'\n') + 1]  # Leave the incomplete line to the next update
+        self._offset += len(content)
+
+        for line in content.decode(errors='replace').splitlines():
+            parsed = parse_keylog_line(line)
+            if parsed is None:
+                continue
+            label, client_random, _ = parsed
+            if label == 'RSA':
+                # Not keyed by the client random, always kept.
+                self._rsa_lines.append(line)
+            else:
+                self._index.setdefault(client_random, []).append(line)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, client_random):
+        return client_random.lower() in self._index
+
+    def lines(self, randoms : Iterable[str]) -> list:
+        """
+        Return the key log lines of the given client randoms.
+        """
+        lines = list(self._rsa_lines)
+        for random in randoms:
+            lines.extend(self._index.get(random.lower(), []))
+        return lines
+
+    def minimal_keylog(self, file, output_file=None) -> str:
+        """
+        Write the minimal key log file for a capture, i.e., only the secrets for the client randoms in the
+        capture, and return its path. The file is reused if it is newer than both the capture and the key log.
+
+        Params
+        ------
+        file : str
+            The path to the .pcap(ng) file.
+
+        output_file : str
+            The path to the minimal key log file, the capture with the suffix .keylog by default.
+        """
+        output_file = Path(file).with_suffix('.keylog') if output_file is None else Path(output_file)
+        if output_file.exists():
+            mtime = output_file.stat().st_mtime
+            if mtime >= os.path.getmtime(file) and \
+               (not os.path.exists(self.keylog_file) or mtime >= os.path.getmtime(self.keylog_file)):
+                return str(output_file)
+
+        self.update()
+        # Extracted before opening the output file, which is never written for a failed tshark run. The randoms are
+        # sorted, such that a regenerated keylog has the same content (and DissectionCache key) in every process.
+        lines = self.lines(sorted(client_randoms(file)))
+        with open(output_file, 'w') as f:
+            f.writelines(line + '\n' for line in lines)
+
+        return str(output_file)
@@ -0,0 +1,212 @@
+"""
+A module for live capture, which turns the packets into features while the page is still loading, instead of
+writing a .pcap(ng) file and re-dissecting it with PcapFormatter afterwards. The workflow is as follows.
+
+tshark -l -T fields ---> reader thread ---> ring buffer of the session
+                                      |---> ring buffer of each flow (TCP/UDP stream)
+                                      |---> subscribers, callback(key, time, direction, length)
+
+Writing a .pcap(ng) file at the same time is optional (output_file).
+
+Usage
+-----
+```
+with LiveCapture(iface="lo", src={"127.0.0.1"}, capture_filter="udp port 9999") as live:
+    ...
+    features = live.snapshot()  # {'time': ..., 'direction': ..., 'length': ...}
+```
+"""
+
+from WFlib.tools.capture import common_filter
+from WFlib.tools.formatter import column_fields
+
+import numpy as np
+import subprocess
+import threading
+from typing import Iterable
+
+class RingBuffer(object):
+    """
+    A fixed-capacity ring buffer of the packets, which keeps the latest capacity packets.
+    """
+    def __init__(self, capacity=5000):
+        self._capacity = capacity
+        self._time = np.zeros(capacity, dtype=np.float64)
+        self._direction = np.zeros(capacity, dtype=np.int64)
+        self._length = np.zeros(capacity, dtype=np.int64)
+        self._count = 0  # The number of packets ever appended
+
+    def append(self, time, direction, length):
+        idx = self._count % self._capacity
+        self._time[idx] = time
+        self._direction[idx] = direction
+        self._length[idx] = length
+        self._count += 1
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def snapshot(self) -> dict:
+        """
+        Copy the buffered packets out in the chronological order.
+
+        Returns
+        -------
+        features : dict
+            time : float64, the relative time of each packet (frame.time_relative);
+            direction : int64, 1 for outgoing and -1 for incoming;
+            length : int64, the frame length.
+        """
+        if self._count <= self._capacity:
+            order = slice(0, self._count)
+            return {
+                'time': self._time[order].copy(),
+                'direction': self._direction[order].copy(),
+                'length': self._length[order].copy(),
+            }
+        order = np.roll(np.arange(self._capacity), -(self._count % self._capacity))
+        return {
+            'time': self._time[order],
+            'direction': self._direction[order],
+            'length': self._length[order],
+        }
+
+class LiveCapture(object):
+    """
+    Capture packets on an interface and keep the direction/time/length sequences in ring buffers, one for the whole
+    session and one per flow, where a flow is a TCP or UDP stream of tshark, keyed by ('tcp', idx) or ('udp', idx).
+
+    Params
+    ------
+    iface : str
+        The interface to perform capture.
+
+    src : Iterable[str]
+        The client addresses, packets sent from which are outgoing (1), otherwise incoming (-1), the same as
+        DirectionExtractor.
+
+    capture_filter : str
+        The capture filter using the BPF syntax to pass to tshark, common_filter is used by default.
+
+    output_file : str
+        If given, the packets are also written into this .pcap(ng) file.
+
+    capacity : int
+        The capacity of each ring buffer.
+    """
+    def __init__(self, iface, src : Iterable[str], capture_filter=common_filter, output_file=None, capacity=5000):
+        self._iface = iface
+        self._src = set(src)
+        self._capture_filter = capture_filter
+        self._output_file = output_file
+        self._capacity = capacity
+
+        self._lock = threading.Lock()
+        self._session = RingBuffer(capacity)
+        self._flows = dict()
+        self._subscribers = []
+
+        self._tshark_process = None
+        self._reader = None
+        self._ready = threading.Event()
+
+    def subscribe(self, callback):
+        """
+        Register callback(key, time, direction, length), which is called in the reader thread for each packet.
+        key is the flow of the packet, None for packets out of any TCP/UDP stream. The callback should return
+        quickly, otherwise the pipe of tshark would be blocked.
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def _consume(self, lines):
+        """
+        Parse the tab-separated rows exported by tshark (with the fields in column_fields) and dispatch them.
+        """
+        for line in lines:
+            row = line.rstrip('\n').split('\t')
+            if len(row) < len(column_fields):
+                continue
+
+            time = float(row[0])
+            direction = 1 if (row[1] or row[2]) in self._src else -1
+            length = int(row[5])
+            if row[6]:
+                key = ('tcp', int(row[6]))
+            elif row[7]:
+                key = ('udp', int(row[7]))
+            else:
+                key = None
+
+            with self._lock:
+                self._session.append(time, direction, length)
+                if key is not None:
+                    if key not in self._flows:
+                        self._flows[key] = RingBuffer(self._capacity)
+                    self._flows[key].append(time, direction, length)
+
+            for callback in self._subscribers:
+                callback(key, time, direction, length)
+
+    def start(self):
+        cmd = ['tshark', '-i', self._iface, '-f', self._capture_filter, '-l', '-n',
+               '-T', 'fields', '-E', 'separator=/t', '-E', 'occurrence=f']
+        if self._output_file is not None:
+            cmd += ['-w', self._output_file, '-P']  # -P keeps printing the fields while writing the file
+        for field in column_fields:
+            cmd += ['-e', field]
+
+        self._ready.clear()
+        self._tshark_process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        self._reader = threading.Thread(target=self._consume, args=(self._tshark_process.stdout,), daemon=True)
+        self._reader.start()
+        threading.Thread(target=self._monitor_stderr, args=(self._tshark_process.stderr,), daemon=True).start()
+
+    def _monitor_stderr(self, stderr):
+        # tshark reports "Capturing on 'iface'" once the capture has started.
+        for line in stderr:
+            if "Capturing on" in line:
+                self._ready.set()
+        self._ready.set()  # Exited, do not keep the waiters waiting.
+
+    def wait_ready(self, timeout=None) -> bool:
+        """
+        Block until tshark has started capturing (or exited), return False on timeout.
+        """
+        return self._ready.wait(timeout)
+
+    def stop(self):
+        if self._tshark_process is None:
+            return
+        if self._tshark_process.poll() is None:
+            self._tshark_process.terminate()
+        self._tshark_process.wait()
+        self._reader.join()
+        self._tshark_process.stdout.close()
+        self._tshark_process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def flows(self) -> list:
+        with self._lock:
+            return list(self._flows.keys())
+
+    def snapshot(self, key=None) -> dict:
+        """
+        Copy the features of the session (key=None) or of a flow out, see RingBuffer.snapshot.
+        """
+        with self._lock:
+            buffer = self._session if key is None else self._flows[key]
+            return buffer.snapshot()
@@ -0,0 +1,150 @@
+"""
+A module for the capture manifest, an SQLite database recording every visit of batch_capture (or
+parallel_capture). With the manifest, the output file index is allocated in O(1) instead of scanning the host
+directory, and an interrupted capture could be resumed by computing the remaining (host, repeat) work from the
+database without scanning the tree. The manifest is usually placed at base_dir/manifest.db.
+
+The visit status is one of
+    running     : the visit is in progress;
+    ok          : the visit succeeded;
+    failed      : the visit raised an exception, the .pcap(ng) file should be cleared (see clear_capture.py);
+    interrupted : the visit was in progress when the capture crashed (see CaptureManifest.recover);
+    cleared     : the file of a failed visit has been removed.
+"""
+
+from WFlib.tools.capture import decide_output_file_idx
+
+import sqlite3
+import os
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+schema = """
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY,
+    next_idx INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS visits (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    host TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    file TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL,
+    bytes INTEGER,
+    packets INTEGER,
+    status TEXT NOT NULL,
+    error TEXT,
+    UNIQUE (host, idx)
+);
+CREATE INDEX IF NOT EXISTS visits_host_status ON visits (host, status);
+"""
+
+class CaptureManifest(object):
+    """
+    The SQLite-backed capture manifest. Each process should open its own CaptureManifest on the same file, the
+    allocation is serialized by SQLite.
+
+    Params
+    ------
+    path : str
+        The path to the database, created if not exists.
+
+    base_dir : str
+        The base directory of the capture. The first allocation of a host, which is not in the manifest yet,
+        falls back to decide_output_file_idx on base_dir/host, such that the manifest could be introduced to an
+        existing capture directory.
+    """
+    def __init__(self, path, base_dir=None):
+        self._base_dir = base_dir
+        # Autocommit mode, the transactions are issued explicitly.
+        self._conn = sqlite3.connect(str(path), timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(schema)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def allocate(self, host) -> int:
+        """
+        Allocate the next output file index of the host.
+        """
+        cursor = self._conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")  # Take the write lock before reading next_idx
+        try:
+            row = cursor.execute("SELECT next_idx FROM hosts WHERE host = ?", (host,)).fetchone()
+            if row is not None:
+                idx = row[0]
+            elif self._base_dir is not None:
+                idx = decide_output_file_idx(directory=Path(f"{self._base_dir}/{host}"))
+            else:
+                idx = 0
+            cursor.execute("INSERT OR REPLACE INTO hosts (host, next_idx) VALUES (?, ?)", (host, idx + 1))
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+
+        return idx
+
+    def begin_visit(self, host, idx, file) -> int:
+        """
+        Record the start of a visit, return the id of the visit.
+        """
+        cursor = self._conn.execute(
+            "INSERT INTO visits (host, idx, file, start, status) VALUES (?, ?, ?, ?, 'running')",
+            (host, idx, str(file), time.time())
+        )
+        return cursor.lastrowid
+
+    def end_visit(self, visit_id, packets=None, error=None):
+        """
+        Record the end of a visit, the visit failed if error is given. The size of the file is recorded as well.
+        """
+        file = self._conn.execute("SELECT file FROM visits WHERE id = ?", (visit_id,)).fetchone()[0]
+        size = os.path.getsize(file) if os.path.exists(file) else None
+        status = 'ok' if error is None else 'failed'
+        self._conn.execute(
+            "UPDATE visits SET end = ?, bytes = ?, packets = ?, status = ?, error = ? WHERE id = ?",
+            (time.time(), size, packets, status, error, visit_id)
+        )
+
+    def recover(self) -> int:
+        """
+        Mark the visits left running by a crashed capture as interrupted, return the number of such visits.
+
+        NOTE: Call it before (not during) a capture, otherwise the visits in progress are marked as well.
+        """
+        cursor = self._conn.execute("UPDATE visits SET status = 'interrupted' WHERE status = 'running'")
+        return cursor.rowcount
+
+    def remaining(self, host_list, repeat) -> List[Tuple[str, int]]:
+        """
+        Compute the remaining (host, repeat) work such that each host has repeat successful visits in total.
+        The jobs are in the same order as batch_capture, i.e., round by round over the host list.
+        """
+        succeeded = dict(self._conn.execute("SELECT host, COUNT(*) FROM visits WHERE status = 'ok' GROUP BY host"))
+        host_list = [host.strip() for host in host_list]
+        return [(host, i) for i in range(repeat) for host in host_list if i >= succeeded.get(host, 0)]
+
+    def visits(self, status=None) -> list:
+        """
+        List the visits as dicts, optionally of the given status only.
+        """
+        columns = ['id', 'host', 'idx', 'file', 'start', 'end', 'bytes', 'packets', 'status', 'error']
+        query = f"SELECT {', '.join(columns)} FROM visits"
+        if status is not None:
+            rows = self._conn.execute(query + " WHERE status = ? ORDER BY id", (status,))
+        else:
+            rows = self._conn.execute(query + " ORDER BY id")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def set_status(self, visit_id, status):
+        self._conn.execute("UPDATE visits SET status = ? WHERE id = ?", (status, visit_id))
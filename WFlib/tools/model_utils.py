@@ -2,6 +2,9 @@ import numpy as np
 import torch
 import os
 import json
+import time
+import hashlib
+from pathlib import Path
 import torch.nn.functional as F
 from pytorch_metric_learning import miners, losses
 from sklearn.metrics.pairwise import cosine_similarity
@@ -24,42 +27,51 @@ def knn_monitor(net, device, memory_data_loader, test_data_loader, num_classes,
     Returns:
     tuple: True labels and predicted labels.
     """
-    net.eval()
-    total_num = 0
-    feature_bank, feature_labels = [], []
+    memory_X, memory_y = loader_tensors(memory_data_loader)
+    test_X, test_y = loader_tensors(test_data_loader)
+    batch_size = test_data_loader.batch_size
+    y_pred = knn_classify(model_outputs(net, memory_X, device, batch_size), memory_y.numpy(),
+                          model_outputs(net, test_X, device, batch_size), num_classes, k, t, device, batch_size)
+
+    return test_y.numpy().flatten(), y_pred
+
+def knn_classify(bank_embs, bank_labels, embs, num_classes, k=200, t=0.1, device="cpu", batch_size=256):
+    """
+    Predict the labels of the embeddings by weighted kNN search over the feature bank, given the embeddings
+    computed by the model, e.g., by InferenceEngine.
+
+    Parameters:
+    bank_embs (ndarray or Tensor): Embeddings of the memory bank (N, D), e.g., FeatureBank.features.
+    bank_labels (ndarray or Tensor): Labels of the memory bank (N,).
+    embs (ndarray): Embeddings to classify (M, D).
+    num_classes (int): Number of classes.
+    k (int): Number of nearest neighbors to use.
+    t (float): Temperature parameter for scaling.
+    device (torch.device): The device to run the search on.
+    batch_size (int): Number of embeddings searched at once.
+
+    Returns:
+    ndarray: Predicted labels (M,).
+    """
+    feature_bank = F.normalize(torch.as_tensor(bank_embs, device=device).float(), dim=1).t().contiguous()
+    feature_labels = torch.as_tensor(bank_labels, device=device).flatten()
+    embs = torch.as_tensor(embs).float()
+
     y_pred = []
-    y_true = []
-    
-    with torch.no_grad():
-        # Generate feature bank
-        for data, target in memory_data_loader:
-            feature = net(data.to(device))
-            feature = F.normalize(feature, dim=1)
-            feature_bank.append(feature)
-            feature_labels.append(target)
-
-        feature_bank = torch.cat(feature_bank, dim=0).t().contiguous().to(device)
-        feature_labels = torch.cat(feature_labels, dim=0).t().contiguous().to(device)
-
-        # Loop through test data to predict the label by weighted kNN search
-        for data, target in test_data_loader:
-            data, target = data.to(device), target.to(device)
-            feature = net(data)
-            feature = F.normalize(feature, dim=1)
-            pred_labels = knn_predict(feature, feature_bank, feature_labels, num_classes, k, t)
-            total_num += data.size(0)
-            y_pred.append(pred_labels[:, 0].cpu().numpy())
-            y_true.append(target.cpu().numpy())
-    
-    y_true = np.concatenate(y_true).flatten()
-    y_pred = np.concatenate(y_pred).flatten()
-    
-    return y_true, y_pred
+    for start in range(0, embs.shape[0], batch_size):
+        feature = F.normalize(embs[start:start + batch_size].to(device), dim=1)
+        y_pred.append(knn_predict(feature, feature_bank, feature_labels, num_classes, k, t)[:, 0])
 
-def knn_predict(feature, feature_bank, feature_labels, classes, knn_k, knn_t):
+    # Copy the predictions to the host at once
+    return torch.cat(y_pred).cpu().numpy().flatten() if y_pred else np.zeros(0, dtype=np.int64)
+
+def knn_predict(feature, feature_bank, feature_labels, classes, knn_k, knn_t, chunk_size=8192):
     """
     Predict labels using k-Nearest Neighbors (kNN) with cosine similarity.
 
+    The similarities are computed over chunks of the feature bank with a running top-k, such that the memory is
+    bounded by the chunk size rather than the size of the bank, and the weights are voted by scatter_add.
+
     Parameters:
     feature (Tensor): Feature tensor.
     feature_bank (Tensor): Feature bank tensor.
@@ -67,22 +79,203 @@ def knn_predict(feature, feature_bank, feature_labels, classes, knn_k, knn_t):
     classes (int): Number of classes.
     knn_k (int): Number of nearest neighbors to use.
     knn_t (float): Temperature parameter for scaling.
+    chunk_size (int): Number of bank features compared at once.
 
     Returns:
     Tensor: Predicted labels.
     """
-    sim_matrix = torch.mm(feature, feature_bank)
-    sim_weight, sim_indices = sim_matrix.topk(k=knn_k, dim=-1)
-    sim_labels = torch.gather(feature_labels.expand(feature.size(0), -1), dim=-1, index=sim_indices)
+    knn_k = min(knn_k, feature_bank.size(1))
+    sim_weight = feature.new_empty((feature.size(0), 0))
+    sim_labels = feature_labels.new_empty((feature.size(0), 0))
+    for start in range(0, feature_bank.size(1), chunk_size):
+        chunk_weight = torch.mm(feature, feature_bank[:, start:start + chunk_size])
+        chunk_labels = feature_labels[start:start + chunk_size].expand(feature.size(0), -1)
+        # Merge the top-k so far with the chunk
+        chunk_weight = torch.cat([sim_weight, chunk_weight], dim=1)
+        sim_weight, sim_indices = chunk_weight.topk(k=min(knn_k, chunk_weight.size(1)), dim=-1)
+        sim_labels = torch.gather(torch.cat([sim_labels, chunk_labels], dim=1), dim=-1, index=sim_indices)
     sim_weight = (sim_weight / knn_t).exp()
 
-    one_hot_label = torch.zeros(feature.size(0) * knn_k, classes, device=sim_labels.device)
-    one_hot_label = one_hot_label.scatter(dim=-1, index=sim_labels.view(-1, 1), value=1.0)
-    pred_scores = torch.sum(one_hot_label.view(feature.size(0), -1, classes) * sim_weight.unsqueeze(dim=-1), dim=1)
+    pred_scores = torch.zeros(feature.size(0), classes, device=sim_weight.device, dtype=sim_weight.dtype)
+    pred_scores.scatter_add_(dim=-1, index=sim_labels, src=sim_weight)
     pred_labels = pred_scores.argsort(dim=-1, descending=True)
     
     return pred_labels
 
+class FeatureBank(object):
+    """
+    A fixed-size queue of the normalized embeddings and labels of the training samples, updated with the embeddings
+    already computed by the training forward passes, such that the kNN monitor need not run the model over the
+    training set again. The oldest embeddings are replaced first once the bank is full.
+
+    Params
+    ------
+    size : int
+        Maximum number of embeddings in the bank.
+    device : torch.device
+        The device to keep the bank on.
+    """
+    def __init__(self, size, device):
+        self.size = size
+        self.device = device
+        self._features = None
+        self._labels = torch.zeros(size, dtype=torch.long, device=device)
+        self._ptr = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def update(self, features, labels):
+        """
+        Enqueue a batch of embeddings (detached and normalized) and their labels.
+        """
+        features = F.normalize(features.detach().float(), dim=1)[-self.size:]
+        labels = labels.detach().flatten()[-self.size:]
+        if self._features is None:
+            self._features = torch.zeros((self.size, features.size(1)), device=self.device)
+
+        indices = (self._ptr + torch.arange(features.size(0), device=self.device)) % self.size
+        self._features[indices] = features.to(self.device)
+        self._labels[indices] = labels.to(self.device)
+        self._ptr = (self._ptr + features.size(0)) % self.size
+        self._count = min(self._count + features.size(0), self.size)
+
+    @property
+    def features(self):
+        return self._features[:self._count]
+
+    @property
+    def labels(self):
+        return self._labels[:self._count]
+
+"""
+The version of the cached model outputs, bump it whenever model_outputs changes the results to invalidate the cache.
+"""
+inference_version = 1
+
+def model_digest(model, digest=None):
+    """
+    Feed the parameters and buffers of a model, i.e., the content of its checkpoint, into the hash object digest
+    (a new sha256 if None), return the hash object.
+    """
+    digest = hashlib.sha256() if digest is None else digest
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().numpy().tobytes())
+    return digest
+
+def dataset_digest(X, digest=None):
+    """
+    Feed the shape, dtype and content of the inputs X into the hash object digest (a new sha256 if None), return
+    the hash object.
+    """
+    digest = hashlib.sha256() if digest is None else digest
+    X = torch.as_tensor(X)
+    digest.update(f"{tuple(X.shape)}\n{X.dtype}\n".encode())
+    digest.update(X.detach().cpu().contiguous().numpy().tobytes())
+    return digest
+
+def loader_tensors(data_loader):
+    """
+    The (X, y) tensors behind a data loader of data_processor.load_iter.
+    """
+    return data_loader.dataset.tensors
+
+def model_outputs(model, X, device, batch_size=1024):
+    """
+    Run the model over the inputs in large no-grad batches.
+
+    Parameters:
+    model (nn.Module): The neural network model.
+    X (Tensor): Input tensor.
+    device (torch.device): The device to run the model on.
+    batch_size (int): Number of samples per forward pass.
+
+    Returns:
+    ndarray: The outputs of the model, i.e., the logits of classifiers or the embeddings of kNN/Holmes models.
+    """
+    model.eval()
+    outputs = []
+    with torch.no_grad():
+        for start in range(0, X.shape[0], batch_size):
+            outputs.append(model(X[start:start + batch_size].to(device)).float())
+    # Copy the outputs to the host at once
+    return torch.cat(outputs).cpu().numpy()
+
+class InferenceCache(object):
+    """
+    The on-disk cache of the model outputs, one .npz file per (model checkpoint, dataset).
+
+    Params
+    ------
+    cache_dir : str
+        The directory of the cache, created if not exists.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, model, X) -> str:
+        digest = hashlib.sha256(f"{inference_version}\n{type(model).__name__}\n".encode())
+        model_digest(model, digest)
+        dataset_digest(X, digest)
+        return digest.hexdigest()
+
+    def path(self, model, X) -> Path:
+        return self.cache_dir / f"{self.key(model, X)}.npz"
+
+    def load(self, path) -> np.ndarray:
+        with np.load(path) as data:
+            return data['outputs']
+
+    def save(self, path, outputs):
+        # Write to a temporary file first, such that concurrent readers never see partial results.
+        tmp_path = Path(path).with_suffix(f".{os.getpid()}.tmp.npz")
+        np.savez(tmp_path, outputs=outputs)
+        os.replace(tmp_path, path)
+
+class InferenceEngine(object):
+    """
+    Run a model checkpoint over each dataset once, and serve its outputs to all the evaluation methods and metrics.
+    The outputs are kept in memory, and on disk if cache_dir is given, keyed by the checkpoint and dataset hashes.
+
+    Params
+    ------
+    model : nn.Module
+        The neural network model, whose weights should not change while the engine is in use.
+    device : torch.device
+        The device to run the model on.
+    batch_size : int
+        Number of samples per forward pass.
+    cache_dir : str
+        The directory of the InferenceCache, None to disable the on-disk cache.
+    """
+    def __init__(self, model, device, batch_size=1024, cache_dir=None):
+        self.model = model
+        self.device = device
+        self.batch_size = batch_size
+        self.cache = None if cache_dir is None else InferenceCache(cache_dir)
+        self._outputs = {}
+
+    def outputs(self, X) -> np.ndarray:
+        """
+        The outputs of the model over the inputs X, computed only on the first request.
+        """
+        key = dataset_digest(X).hexdigest()
+        if key in self._outputs:
+            return self._outputs[key]
+
+        path = None if self.cache is None else self.cache.path(self.model, X)
+        if path is not None and path.exists():
+            outputs = self.cache.load(path)
+        else:
+            outputs = model_outputs(self.model, X, self.device, self.batch_size)
+            if path is not None:
+                self.cache.save(path, outputs)
+        self._outputs[key] = outputs
+        return outputs
+
 def fast_count_burst(arr):
     """
     Count bursts of continuous values in an array.
@@ -103,6 +296,108 @@ def fast_count_burst(arr):
     
     return adjusted_lengths
 
+def amp_settings(device, amp="none"):
+    """
+    Decide the autocast dtype and whether to scale the gradients for the given mixed-precision mode.
+
+    Parameters:
+    device (torch.device): The device to train on.
+    amp (str): "none" (fp32), "bf16", "fp16", or "auto" (bf16 on CPU, fp16 on CUDA).
+
+    Returns:
+    tuple: The autocast dtype (None for fp32) and whether a GradScaler is needed (fp16 only).
+    """
+    device = torch.device(device)
+    if amp == "none":
+        return None, False
+    if amp == "auto":
+        amp = "fp16" if device.type == "cuda" else "bf16"
+    if amp == "bf16":
+        return torch.bfloat16, False
+    if amp == "fp16":
+        return torch.float16, True
+    raise ValueError(f"Mixed-precision mode {amp} is not matched.")
+
+def to_memory_format(X, channels_last=False):
+    """
+    Convert a batch of 2-D inputs (N, C, H, W) to the channels-last memory format if required.
+    """
+    if channels_last and X.dim() == 4:
+        return X.contiguous(memory_format=torch.channels_last)
+    return X
+
+def train_log_file(out_file):
+    """
+    The JSON lines file of the training instrumentation next to the checkpoint, e.g., base.pth -> base.train.jsonl.
+    """
+    return os.path.splitext(out_file)[0] + ".train.jsonl"
+
+def peak_memory(device):
+    """
+    The peak memory in bytes, i.e., the peak allocated memory of the CUDA device, or the peak resident set size of
+    the process on CPU.
+    """
+    device = torch.device(device)
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device)
+    try:
+        import resource  # Unavailable on Windows
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KiB on Linux
+
+class EpochTimer(object):
+    """
+    Split the wall time of an epoch into the time waiting for the data loader (data_time) and the rest of the
+    steps (compute_time). Note that CUDA kernels run asynchronously, hence the device is only synchronized once
+    at the end of the epoch, and the compute time queued behind a slow step may be counted as data time.
+
+    Parameters:
+    device (torch.device): The device to train on.
+    """
+    def __init__(self, device):
+        self.device = torch.device(device)
+        self.data_time = 0.
+        self.steps = 0
+        if self.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self.start_time = time.perf_counter()
+        self.elapsed = None
+
+    def wrap(self, data_iter):
+        """
+        Iterate over the data loader, and count the time waiting for each batch.
+        """
+        data_iter = iter(data_iter)
+        while True:
+            wait_start = time.perf_counter()
+            try:
+                batch = next(data_iter)
+            except StopIteration:
+                break
+            self.data_time += time.perf_counter() - wait_start
+            self.steps += 1
+            yield batch
+
+    def stop(self):
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        self.elapsed = time.perf_counter() - self.start_time
+
+    def summary(self, samples):
+        compute_time = self.elapsed - self.data_time
+        steps = max(self.steps, 1)
+        return {
+            "steps": self.steps,
+            "train_time": self.elapsed,
+            "data_time": self.data_time,
+            "compute_time": compute_time,
+            "data_time_per_step": self.data_time / steps,
+            "compute_time_per_step": compute_time / steps,
+            "samples_per_sec": samples / self.elapsed,
+            "peak_memory": peak_memory(self.device),
+        }
+
 def model_train(
     model,
     optimizer,
@@ -116,8 +411,25 @@ def model_train(
     num_classes,
     num_tabs,
     device,
-    lradj
+    lradj,
+    amp="none",
+    channels_last=False,
+    knn_bank_size=None
 ):
+    """
+    Train the model and save the checkpoint with the best save_metric on the validation set.
+
+    The mixed-precision mode amp (see amp_settings) runs the forward passes under autocast, and channels_last
+    converts the 2-D convolutions (e.g., of RF and Holmes) and their inputs to the channels-last memory format.
+    The training throughput of each epoch is printed along with the modes for comparison.
+
+    The losses and predictions are accumulated on the device and copied to the host once per epoch. The timing of
+    each epoch (see EpochTimer) is appended as a JSON line to the file next to out_file (see train_log_file).
+
+    With TripletMarginLoss or SupConLoss, the kNN monitor searches a FeatureBank of the embeddings computed by the
+    training forward passes, at most knn_bank_size (default: the size of the training set) of the most recent ones,
+    such that the validation only runs the model over the validation set.
+    """
     if loss_name in ["CrossEntropyLoss", "BCEWithLogitsLoss", "MultiLabelSoftMarginLoss"]:
         criterion = eval(f"torch.nn.{loss_name}")()
     elif loss_name == "TripletMarginLoss":
@@ -137,41 +449,66 @@ def model_train(
     metric_best_value = 0
     best_epoch = 0
 
+    device = torch.device(device)
+    amp_dtype, use_scaler = amp_settings(device, amp)
+    scaler = torch.amp.GradScaler(device.type, enabled=use_scaler)
+    if channels_last:
+        model.to(memory_format=torch.channels_last)  # Only the 4-D weights, i.e., of Conv2d, are converted
+
+    if loss_name in ["TripletMarginLoss", "SupConLoss"]:
+        bank = FeatureBank(knn_bank_size or len(train_iter.dataset), device)
+        valid_X, valid_y = loader_tensors(valid_iter)
+
+    log_file = train_log_file(out_file)
     for epoch in range(train_epochs):
         model.train()
-        sum_loss = 0
+        sum_loss = torch.zeros((), device=device)
         sum_count = 0
+        timer = EpochTimer(device)
         
-        for index, cur_data in enumerate(train_iter):
-            cur_X, cur_y = cur_data[0].to(device), cur_data[1].to(device)
+        for index, cur_data in enumerate(timer.wrap(train_iter)):
+            cur_X, cur_y = to_memory_format(cur_data[0].to(device), channels_last), cur_data[1].to(device)
             optimizer.zero_grad()
-            outs = model(cur_X)
-
-            if loss_name == "TripletMarginLoss":
-                hard_pairs = miner(outs, cur_y)
-                loss = criterion(outs, cur_y, hard_pairs)
-            elif loss_name == "SupConLoss":
-                loss = criterion(outs, cur_y)
-            elif loss_name == "MultiCrossEntropyLoss":
-                loss = 0
-                cur_indices = torch.nonzero(cur_y)
-                cur_indices = cur_indices[:,1].view(-1, num_tabs)
-                for ct in range(num_tabs):
-                    loss_ct = criterion(outs[:, ct], cur_indices[:, ct])
-                    loss = loss + loss_ct
-            else:
-                loss = criterion(outs, cur_y)
+            with torch.autocast(device.type, dtype=amp_dtype, enabled=amp_dtype is not None):
+                outs = model(cur_X)
+
+                if loss_name in ["TripletMarginLoss", "SupConLoss"]:
+                    bank.update(outs, cur_y)
+
+                if loss_name == "TripletMarginLoss":
+                    hard_pairs = miner(outs, cur_y)
+                    loss = criterion(outs, cur_y, hard_pairs)
+                elif loss_name == "SupConLoss":
+                    loss = criterion(outs, cur_y)
+                elif loss_name == "MultiCrossEntropyLoss":
+                    loss = 0
+                    cur_indices = torch.nonzero(cur_y)
+                    cur_indices = cur_indices[:,1].view(-1, num_tabs)
+                    for ct in range(num_tabs):
+                        loss_ct = criterion(outs[:, ct], cur_indices[:, ct])
+                        loss = loss + loss_ct
+                else:
+                    loss = criterion(outs, cur_y)
             
-            loss.backward()
-            optimizer.step()
-            sum_loss += loss.data.cpu().numpy() * outs.shape[0]
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+            sum_loss += loss.detach().float() * outs.shape[0]  # Stay on the device, no sync per step
             sum_count += outs.shape[0]
 
-        train_loss = round(sum_loss / sum_count, 3)
+        timer.stop()
+        train_loss = round(sum_loss.item() / sum_count, 3)
+        record = {"epoch": epoch, "train_loss": train_loss, "samples": sum_count, **timer.summary(sum_count)}
         print(f"epoch {epoch}: train_loss = {train_loss}")
+        print(f"epoch {epoch}: throughput = {record['samples_per_sec']:.1f} samples/s "
+              f"(amp={amp}, channels_last={channels_last})")
 
+        valid_start_time = time.perf_counter()
         if loss_name in ["TripletMarginLoss", "SupConLoss"]:
-            valid_true, valid_pred = knn_monitor(model, device, train_iter, valid_iter, num_classes, 10)
+            valid_embs = model_outputs(model, valid_X, device, valid_iter.batch_size)
+            valid_pred = knn_classify(bank.features, bank.labels, valid_embs, num_classes, 10, 0.1,
+                                      device, valid_iter.batch_size)
+            valid_true = valid_y.numpy().flatten()
         else:
             with torch.no_grad():
                 model.eval()
@@ -181,8 +518,10 @@ def model_train(
                 valid_true = []
 
                 for index, cur_data in enumerate(valid_iter):
-                    cur_X, cur_y = cur_data[0].to(device), cur_data[1].to(device)
-                    outs = model(cur_X)
+                    cur_X, cur_y = to_memory_format(cur_data[0].to(device), channels_last), cur_data[1].to(device)
+                    with torch.autocast(device.type, dtype=amp_dtype, enabled=amp_dtype is not None):
+                        outs = model(cur_X)
+                    outs = outs.float()
                     
                     if loss_name in ["BCEWithLogitsLoss", "MultiLabelSoftMarginLoss"]:
                         cur_pred = torch.sigmoid(outs)
@@ -197,14 +536,21 @@ def model_train(
                     else:
                         raise ValueError(f"Loss function {loss_name} is not matched.")
 
-                    valid_pred.append(cur_pred.cpu().numpy())
-                    valid_true.append(cur_y.cpu().numpy())
+                    valid_pred.append(cur_pred)
+                    valid_true.append(cur_y)
                 
-                valid_pred = np.concatenate(valid_pred)
-                valid_true = np.concatenate(valid_true)
+                # Copy the predictions to the host at once
+                valid_pred = torch.cat(valid_pred).cpu().numpy()
+                valid_true = torch.cat(valid_true).cpu().numpy()
         
         valid_result = measurement(valid_true, valid_pred, eval_metrics, num_tabs)
+        valid_time = time.perf_counter() - valid_start_time
         print(f"{epoch}: {valid_result}")
+
+        record.update({"valid_time": valid_time, "amp": amp, "channels_last": channels_last,
+                       "valid": {metric: float(value) for metric, value in valid_result.items()}})
+        with open(log_file, "a") as f:
+            f.write(json.dumps(record) + "\n")
         
         if valid_result[save_metric] > metric_best_value:
             metric_best_value = valid_result[save_metric]
@@ -214,6 +560,54 @@ def model_train(
         if lradj != "None":
             scheduler.step()
 
+def logits_predict(outs, num_tabs, num_classes):
+    """
+    Convert the logits of a classifier into the predictions expected by measurement.
+
+    Parameters:
+    outs (ndarray): The logits, (N, C) or (N, num_tabs, C) for multi-tab models with per-tab outputs.
+    num_tabs (int): Maximum number of tabs opened by users while browsing.
+    num_classes (int): Number of classes.
+
+    Returns:
+    ndarray: Predicted labels (N,) for single-tab, or per-class scores (N, C) for multi-tab.
+    """
+    if num_tabs == 1:
+        return np.argmax(outs, axis=1)
+    if len(outs.shape) <= 2:
+        return torch.sigmoid(torch.from_numpy(outs)).numpy()
+    # Count the predicted class of each tab
+    cur_indices = np.argmax(outs, axis=-1)
+    y_pred = np.zeros((cur_indices.shape[0], num_classes), dtype=np.float32)
+    for cur_tab in range(cur_indices.shape[1]):
+        np.add.at(y_pred, (np.arange(y_pred.shape[0]), cur_indices[:, cur_tab]), 1)
+    return y_pred
+
+def holmes_predict(embs, webs_centroid, webs_radius, num_classes, scenario, open_threshold=1e-2):
+    """
+    Predict the labels of the embeddings by the distances to the spatial distribution of each website.
+
+    Parameters:
+    embs (ndarray): The embeddings of the Holmes model.
+    webs_centroid (ndarray): Centroid of each website, generated by spatial_analysis.py.
+    webs_radius (ndarray): Radius of each website, generated by spatial_analysis.py.
+    num_classes (int): Number of classes.
+    scenario (str): Attack scenario, the unmonitored class (num_classes - 1) is predicted in the Open-world scenario
+        if all the distances exceed open_threshold.
+
+    Returns:
+    ndarray: Predicted labels.
+    """
+    all_sims = 1 - cosine_similarity(embs, webs_centroid)
+    all_sims -= webs_radius
+    outs = np.argmin(all_sims, axis=1)
+
+    if scenario == "Open-world":
+        outs_d = np.min(all_sims, axis=1)
+        open_indices = np.where(outs_d > open_threshold)[0]
+        outs[open_indices] = num_classes - 1
+    return outs
+
 def model_eval(
         model, 
         test_iter, 
@@ -225,36 +619,23 @@ def model_eval(
         ckp_path, 
         scenario,
         num_tabs,
-        device
+        device,
+        engine=None
     ):
-    if eval_method == "common":
-        with torch.no_grad():
-            model.eval()
-            y_pred = []
-            y_true = []
+    # All the evaluation methods read the model outputs from the engine, such that each checkpoint runs over each
+    # dataset only once, across the methods and runs if the engine has a cache directory.
+    if engine is None:
+        engine = InferenceEngine(model, device, batch_size=test_iter.batch_size)
+    test_X, test_y = loader_tensors(test_iter)
+    y_true = test_y.numpy()
 
-            for index, cur_data in enumerate(test_iter):
-                cur_X, cur_y = cur_data[0].to(device), cur_data[1].to(device)
-                outs = model(cur_X)
-                if num_tabs == 1:
-                    cur_pred = torch.argsort(outs, dim=1, descending=True)[:,0]
-                else:
-                    if len(outs.shape) <= 2:
-                        cur_pred = torch.sigmoid(outs)
-                    else:
-                        cur_indices = torch.argmax(outs, dim=-1).cpu()
-                        cur_pred = torch.zeros((cur_indices.shape[0], num_classes))
-                        for cur_tab in range(cur_indices.shape[1]):
-                            row_indices = torch.arange(cur_pred.shape[0])
-                            cur_pred[row_indices,cur_indices[:,cur_tab]] += 1
-
-                y_pred.append(cur_pred.cpu().numpy())
-                y_true.append(cur_y.cpu().numpy())
-
-            y_pred = np.concatenate(y_pred)
-            y_true = np.concatenate(y_true)
+    if eval_method == "common":
+        y_pred = logits_predict(engine.outputs(test_X), num_tabs, num_classes)
     elif eval_method == "kNN":
-        y_true, y_pred = knn_monitor(model, device, valid_iter, test_iter, num_classes, 10)
+        valid_X, valid_y = loader_tensors(valid_iter)
+        y_pred = knn_classify(engine.outputs(valid_X), valid_y.numpy(), engine.outputs(test_X),
+                              num_classes, 10, 0.1, device, test_iter.batch_size)
+        y_true = y_true.flatten()
     elif eval_method == "Holmes":
         open_threshold = 1e-2
         spatial_dist_file = os.path.join(ckp_path, "spatial_distribution.npz")
@@ -263,29 +644,9 @@ def model_eval(
         webs_centroid = spatial_data["centroid"]
         webs_radius = spatial_data["radius"]
 
-        with torch.no_grad():
-            model.eval()
-            y_pred = []
-            y_true = []
-
-            for index, cur_data in enumerate(test_iter):
-                cur_X, cur_y = cur_data[0].to(device), cur_data[1].to(device)
-                embs = model(cur_X).cpu().numpy()
-                cur_y = cur_y.cpu().numpy()
-
-                all_sims = 1 - cosine_similarity(embs, webs_centroid)
-                all_sims -= webs_radius
-                outs = np.argmin(all_sims, axis=1)
-
-                if scenario == "Open-world":
-                    outs_d = np.min(all_sims, axis=1)
-                    open_indices = np.where(outs_d > open_threshold)[0]
-                    outs[open_indices] = num_classes - 1
-
-                y_pred.append(outs)
-                y_true.append(cur_y)
-            y_pred = np.concatenate(y_pred).flatten()
-            y_true = np.concatenate(y_true).flatten()
+        y_pred = holmes_predict(engine.outputs(test_X), webs_centroid, webs_radius, num_classes, scenario,
+                                open_threshold).flatten()
+        y_true = y_true.flatten()
     else:
         raise ValueError(f"Evaluation method {eval_method} is not matched.")
     
@@ -0,0 +1,134 @@
+"""
+A module for excluding known-noise flows at capture time. common_filter only drops noise by port, while the
+SNI-based noise (e.g., exp/data_extract/filter.txt) is removed after the fact by SNI_exclude_filter, which costs an
+extra dissection pass per file. NoiseFilter learns the IP addresses behind the excluded SNIs, from earlier
+captures (ClientHello SNI -> destination) and from resolving the SNIs directly, and compiles them into a BPF
+exclusion appended to the capture filter, such that the noise never hits the disk.
+
+NOTE: DNS answers are not learned from the captures, since common_filter drops port 53, i.e., the captures hold no
+DNS traffic. The resolver side is covered by refresh, which resolves the SNIs directly.
+
+```
+noise_filter = NoiseFilter(read_host_list("exp/data_extract/filter.txt"), protect=host_list)
+noise_filter.learn_from_captures(previous_files)
+batch_capture(..., noise_filter=noise_filter)
+```
+
+NOTE: The exclusion is best-effort, a noise flow to an IP not learned yet still needs SNI_exclude_filter.
+"""
+
+from WFlib.tools.capture import common_filter
+
+import socket
+import subprocess
+import time
+from collections import Counter
+from typing import Iterable
+
+noise_fields = ['tls.handshake.extensions_server_name', 'ip.dst', 'ipv6.dst']
+
+def parse_noise_rows(lines, SNIs) -> Counter:
+    """
+    Parse the rows exported by tshark (with the fields in noise_fields, occurrence=a) and count the IP addresses
+    of the given SNIs, i.e., the destinations of the ClientHellos carrying the SNIs.
+    """
+    addresses = Counter()
+    for line in lines:
+        row = line.rstrip('\n').split('\t')
+        if len(row) < len(noise_fields):
+            continue
+        server_names, dst, dst6 = row[:3]
+
+        if any(name in SNIs for name in server_names.split(',') if name):
+            addresses[dst or dst6] += 1
+
+    return addresses
+
+def resolve(hostname) -> set:
+    """
+    Resolve all IPv4/IPv6 addresses of the hostname, empty if failed.
+    """
+    try:
+        return {info[4][0] for info in socket.getaddrinfo(hostname, 443, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        return set()
+
+class NoiseFilter(object):
+    """
+    The dynamic BPF exclusion of the noise flows.
+
+    Params
+    ------
+    SNIs : Iterable[str]
+        The SNIs of the noise flows, e.g., read_host_list("exp/data_extract/filter.txt").
+
+    protect : Iterable[str]
+        The hostnames to capture. Their addresses are never excluded, since CDNs may serve a noise SNI and the
+        website from the same address.
+
+    refresh_interval : float
+        The seconds after which the SNIs are resolved again, the addresses behind them change over time.
+
+    max_hosts : int
+        The maximum number of excluded addresses (the most frequently seen first), which keeps the BPF program
+        within the kernel limit.
+    """
+    def __init__(self, SNIs : Iterable[str], protect : Iterable[str] = (), refresh_interval=600., max_hosts=200):
+        self.SNIs = set(SNIs)
+        self.protect = set(protect)
+        self._refresh_interval = refresh_interval
+        self._max_hosts = max_hosts
+        self._learned = Counter()
+        self._resolved = Counter()
+        self._protected = set()
+        self._last_refresh = None
+
+    def learn(self, addresses : Counter):
+        self._learned.update(addresses)
+
+    def learn_from_capture(self, file):
+        """
+        Learn the addresses of the noise SNIs from a capture with one tshark pass over the ClientHellos.
+        """
+        cmd = ['tshark', '-r', str(file), '-Y', 'tls.handshake.type == 1',
+               '-T', 'fields', '-E', 'separator=/t', '-E', 'occurrence=a']
+        for field in noise_fields:
+            cmd += ['-e', field]
+        output = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout
+        self.learn(parse_noise_rows(output.splitlines(), self.SNIs))
+
+    def learn_from_captures(self, files):
+        for file in files:
+            self.learn_from_capture(file)
+
+    def refresh(self):
+        """
+        Resolve the noise SNIs and the protected hostnames again.
+        """
+        self._resolved = Counter()
+        for SNI in self.SNIs:
+            self._resolved.update(resolve(SNI))
+        self._protected = set()
+        for host in self.protect:
+            self._protected |= resolve(host)
+        self._last_refresh = time.time()
+
+    @property
+    def addresses(self) -> list:
+        """
+        The excluded addresses, the most frequently seen first.
+        """
+        if self._last_refresh is None or time.time() - self._last_refresh >= self._refresh_interval:
+            self.refresh()
+        counts = self._learned + self._resolved
+        return [address for address, _ in counts.most_common() if address not in self._protected][:self._max_hosts]
+
+    def bpf(self, capture_filter=common_filter) -> str:
+        """
+        Append the exclusion of the noise addresses to the capture filter.
+        """
+        addresses = self.addresses
+        if len(addresses) == 0:
+            return capture_filter
+        exclusion = " or ".join(f"host {address}" for address in addresses)
+        return f"({capture_filter}) and not ({exclusion})"
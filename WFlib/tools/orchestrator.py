@@ -0,0 +1,302 @@
+"""
+A module for parallel traffic capture. batch_capture visits the hosts one by one, while the orchestrator runs
+K capture workers at once. To keep the traffic of each visit separated, every worker lives in its own network
+namespace, which is connected to the host by a veth pair and NATed to the uplink. Each worker runs its own
+tshark (on the namespace side of the veth pair) and its own browser, so one capture never sees the traffic of
+another. The workflow is as follows.
+
+                   job queue: (host, repeat), ...
+                     |               |               |
+worker 0 (wflib0)    v-- capture --> v-- capture --> v-- ...
+worker 1 (wflib1)    v-- capture --> v-- capture --> ...
+...
+
+host (default netns)                          worker k (netns wflibk)
+    wflibkh  10.200.k.1/30  <----- veth ----->  wflibkn  10.200.k.2/30
+       |                                           |
+    NAT (MASQUERADE) to uplink                  tshark -i wflibkn, geckodriver, firefox
+
+NOTE: Setting up namespaces requires root (or CAP_NET_ADMIN and CAP_SYS_ADMIN), as well as the ip, iptables and
+sysctl commands.
+"""
+
+from WFlib.tools.capture import capture, common_filter, decide_output_file_idx, BrowserPool, FULL_PROFILE, HEADER_PROFILE
+from WFlib.tools.manifest import CaptureManifest
+from selenium.common.exceptions import WebDriverException
+
+import ctypes
+import multiprocessing
+import subprocess
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+CLONE_NEWNET = 0x40000000
+CLONE_NEWNS = 0x00020000
+MS_BIND = 4096
+MS_REC = 16384
+MS_PRIVATE = 1 << 18
+
+def _run(cmd, check=True):
+    return subprocess.run(cmd, check=check, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+class NetnsSlot(object):
+    """
+    An isolated network namespace for one capture worker.
+
+    Attributes
+    ----------
+    name : str
+        The name of the network namespace, i.e., wflib{idx}.
+
+    host_iface, ns_iface : str
+        The host side and the namespace side of the veth pair. Capture should be performed on ns_iface
+        from inside the namespace.
+
+    host_addr, ns_addr : str
+        The addresses of the veth pair, host_addr is the default gateway of the namespace. Note that a local
+        HTTP server listening on host_addr is reachable from the worker, which is handy for testing.
+    """
+    def __init__(self, idx, subnet="10.200", nameserver="1.1.1.1"):
+        self.name = f"wflib{idx}"
+        self.host_iface = f"wflib{idx}h"
+        self.ns_iface = f"wflib{idx}n"
+        self.host_addr = f"{subnet}.{idx}.1"
+        self.ns_addr = f"{subnet}.{idx}.2"
+        self.network = f"{subnet}.{idx}.0/30"
+        self.nameserver = nameserver
+
+    @property
+    def resolv_conf(self):
+        return Path(f"/etc/netns/{self.name}/resolv.conf")
+
+    def setup(self):
+        """
+        Create the namespace, the veth pair, the default route and the NAT rule.
+        """
+        self.teardown()  # Remove the leftovers of a crashed run, if any.
+
+        netns_exec = ['ip', 'netns', 'exec', self.name]
+        _run(['ip', 'netns', 'add', self.name])
+        _run(['ip', 'link', 'add', self.host_iface, 'type', 'veth', 'peer', 'name', self.ns_iface])
+        _run(['ip', 'link', 'set', self.ns_iface, 'netns', self.name])
+        _run(['ip', 'addr', 'add', f"{self.host_addr}/30", 'dev', self.host_iface])
+        _run(['ip', 'link', 'set', self.host_iface, 'up'])
+        _run(netns_exec + ['ip', 'addr', 'add', f"{self.ns_addr}/30", 'dev', self.ns_iface])
+        _run(netns_exec + ['ip', 'link', 'set', self.ns_iface, 'up'])
+        _run(netns_exec + ['ip', 'link', 'set', 'lo', 'up'])
+        _run(netns_exec + ['ip', 'route', 'add', 'default', 'via', self.host_addr])
+        _run(['sysctl', '-q', '-w', 'net.ipv4.ip_forward=1'])
+        _run(['iptables', '-t', 'nat', '-A', 'POSTROUTING', '-s', self.network, '-j', 'MASQUERADE'])
+
+        # The host resolver (e.g., 127.0.0.53 of systemd-resolved) is not reachable from the namespace.
+        self.resolv_conf.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.resolv_conf, 'w') as f:
+            f.write(f"nameserver {self.nameserver}\n")
+
+    def teardown(self):
+        """
+        Remove the namespace and the NAT rule. Deleting the namespace also destroys the veth pair.
+        """
+        _run(['iptables', '-t', 'nat', '-D', 'POSTROUTING', '-s', self.network, '-j', 'MASQUERADE'], check=False)
+        _run(['ip', 'netns', 'del', self.name], check=False)
+        _run(['ip', 'link', 'del', self.host_iface], check=False)
+        if self.resolv_conf.exists():
+            self.resolv_conf.unlink()
+
+    def enter(self):
+        """
+        Move the calling process into the namespace, the same way as `ip netns exec` does. All the threads and
+        processes spawned afterwards, e.g., tshark, geckodriver and firefox, inherit the namespace.
+
+        NOTE: This should be called at the very beginning of a fresh worker process, since setns(2) only
+        affects the calling thread.
+        """
+        libc = ctypes.CDLL(None, use_errno=True)
+        with open(f"/var/run/netns/{self.name}") as f:
+            if libc.setns(f.fileno(), CLONE_NEWNET) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"Failed to enter the network namespace {self.name}: {os.strerror(errno)}")
+
+        # Bind-mount the resolv.conf of the namespace in a private mount namespace.
+        if libc.unshare(CLONE_NEWNS) != 0 or \
+           libc.mount(b"none", b"/", None, MS_REC | MS_PRIVATE, None) != 0 or \
+           libc.mount(str(self.resolv_conf).encode(), b"/etc/resolv.conf", None, MS_BIND, None) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"Failed to set up resolv.conf for {self.name}: {os.strerror(errno)}")
+
+class IndexAllocator(object):
+    """
+    Allocate the output file index of each host across the workers, which keeps the same output layout as
+    batch_capture (see decide_output_file_idx). The host directory is scanned only once, at the first allocation
+    of the host, afterwards the index is simply increased under a shared lock.
+    """
+    def __init__(self, base_dir, manager):
+        self._base_dir = base_dir
+        self._next_idx = manager.dict()
+        self._lock = manager.Lock()
+
+    def allocate(self, host) -> int:
+        with self._lock:
+            if host not in self._next_idx:
+                self._next_idx[host] = decide_output_file_idx(directory=Path(f"{self._base_dir}/{host}"))
+            idx = self._next_idx[host]
+            self._next_idx[host] = idx + 1
+
+        return idx
+
+def build_jobs(host_list, repeat) -> List[Tuple[str, int]]:
+    """
+    Build the (host, repeat) jobs in the same order as batch_capture, i.e., round by round over the host list,
+    such that the visits to the same host are spread over time.
+    """
+    return [(host.strip(), i) for i in range(repeat) for host in host_list]
+
+def capture_worker(slot : NetnsSlot, job_queue, allocator : IndexAllocator, base_dir, timeout,
+                   capture_filter, ill_files, log_output, proto_header, warm_browser=False, max_uses=20,
+                   idle_window=5., manifest_file=None, decrypt=True, profile=FULL_PROFILE):
+    """
+    The worker process: enter its namespace, then fetch and capture jobs until the None sentinel is met.
+    """
+    slot.enter()
+    # The browsers must be launched after entering the namespace.
+    browser_pool = BrowserPool(size=1, max_uses=max_uses) if warm_browser else None
+    # Each process opens its own connection to the manifest.
+    manifest = CaptureManifest(manifest_file, base_dir=base_dir) if manifest_file is not None else None
+
+    try:
+        while True:
+            job = job_queue.get()
+            if job is None:
+                break
+
+            host, _ = job
+            output_dir = Path("{}/{}".format(base_dir, host))
+            if manifest is not None:
+                output_file_idx = manifest.allocate(host)
+            else:
+                output_file_idx = allocator.allocate(host)
+            output_file = os.path.join(base_dir, host, "{}_{}.pcapng".format(host, output_file_idx))
+            output_dir.mkdir(parents=True, exist_ok=True)
+
+            # The environment is per-process, so the workers do not interfere with each other.
+            if decrypt:
+                os.environ["SSLKEYLOGFILE"] = f"{base_dir}/{host}/keylog.txt"
+            else:
+                os.environ.pop("SSLKEYLOGFILE", None)
+
+            if manifest is not None:
+                visit_id = manifest.begin_visit(host, output_file_idx, output_file)
+
+            result = capture(url=proto_header + host,
+                             iface=slot.ns_iface,
+                             output_file=output_file,
+                             timeout=timeout,
+                             capture_filter=capture_filter,
+                             ill_files=ill_files,
+                             log_output=log_output,
+                             browser_pool=browser_pool,
+                             idle_window=idle_window,
+                             profile=profile)
+
+            if manifest is not None:
+                manifest.end_visit(visit_id, packets=result['packets'], error=result['error'])
+
+            # Recycle the stale browsers only now that the sniffer has stopped.
+            if browser_pool is not None:
+                try:
+                    browser_pool.replenish()
+                except WebDriverException as e:
+                    if log_output is not None:
+                        with open(log_output, 'a+') as f:
+                            f.write(f"The browser pool fails to relaunch a browser after {output_file}: {e}\n")
+    finally:
+        if browser_pool is not None:
+            browser_pool.close()
+        if manifest is not None:
+            manifest.close()
+
+def parallel_capture(base_dir, host_list,
+                     num_workers=4,
+                     repeat=20,
+                     timeout=200,
+                     capture_filter=common_filter,
+                     ill_files=None,
+                     log_output=None,
+                     proto_header="https://",
+                     subnet="10.200",
+                     nameserver="1.1.1.1",
+                     warm_browser=False,
+                     max_uses=20,
+                     idle_window=5.,
+                     manifest_file=None,
+                     decrypt=True,
+                     profile=None):
+    """
+    Capture the traffic of a list of hosts with num_workers workers at once. The resulting directory is the
+    same as that of batch_capture.
+
+    Params
+    ------
+    base_dir : str
+        The base directory to hold all captures for each hostname.
+
+    host_list : list
+        The list of hostnames to perform capture.
+
+    num_workers : int
+        The number of capture workers, each of which owns a network namespace {subnet}.{idx}.0/30.
+
+    proto_header : str
+        The protocol prepended to the hostname, e.g., set it to "http://" to test against local HTTP servers.
+
+    nameserver : str
+        The DNS server used inside the namespaces.
+
+    warm_browser : bool
+        Whether each worker reuses a pre-launched browser (see BrowserPool), which is relaunched every max_uses
+        visits.
+
+    manifest_file : str
+        The path to the capture manifest (see CaptureManifest). If given, only the remaining work is captured,
+        the same as batch_capture with a manifest.
+
+    See batch_capture for the other parameters.
+    """
+    if profile is None:
+        profile = FULL_PROFILE if decrypt else HEADER_PROFILE
+    slots = [NetnsSlot(idx, subnet=subnet, nameserver=nameserver) for idx in range(num_workers)]
+    if manifest_file is not None:
+        with CaptureManifest(manifest_file, base_dir=base_dir) as manifest:
+            manifest.recover()
+            jobs = manifest.remaining(host_list, repeat)
+    else:
+        jobs = build_jobs(host_list, repeat)
+
+    with multiprocessing.Manager() as manager:
+        allocator = IndexAllocator(base_dir, manager)
+        job_queue = multiprocessing.Queue()
+        for job in jobs:
+            job_queue.put(job)
+        for _ in slots:
+            job_queue.put(None)  # One sentinel per worker
+
+        workers = []
+        try:
+            for slot in slots:
+                slot.setup()
+            for slot in slots:
+                worker = multiprocessing.Process(target=capture_worker,
+                                                 args=(slot, job_queue, allocator, base_dir, timeout, capture_filter,
+                                                       ill_files, log_output, proto_header, warm_browser, max_uses,
+                                                       idle_window, manifest_file, decrypt, profile))
+                worker.start()
+                workers.append(worker)
+            for worker in workers:
+                worker.join()
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+            for slot in slots:
+                slot.teardown()
@@ -0,0 +1,537 @@
+"""
+A native parser of the TLS ClientHellos in a .pcap(ng) file, over TCP as well as in the QUIC Initial packets. The
+QUIC Initial packets are protected with keys derived from the Destination Connection ID only (RFC 9001, Sec. 5.2),
+so they could be decrypted without any secret. Compared to SNI_extract with pyshark, no tshark pass is needed to
+collect the SNIs of a file, which makes an SNI census of a large capture tree cheap.
+
+The TCP/UDP stream indices follow tshark (tcp.stream/udp.stream), i.e., the streams are numbered by their first
+packets, such that the results could be passed to stream_extract_filter and stream_exclude_filter.
+
+NOTE: A TCP stream whose ports are reused starts a new stream upon a SYN after FIN/RST, which is close to but not
+exactly the heuristics of tshark, and fragmented IP packets are skipped, which tshark reassembles. Since the stream
+numbers are fed into tshark display filters, SNI_stream_numbers falls back to tshark for the files with IP fragments
+or reused TCP ports (see AmbiguousStreamError), where the native numbering may drift.
+
+```
+hellos = client_hellos("www.google.com.pcapng")
+SNIs = extract_SNIs("www.google.com.pcapng")
+tcp_stream_numbers, udp_stream_numbers = SNI_stream_numbers("www.google.com.pcapng", {"www.google.com"})
+```
+"""
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+import functools
+import hashlib
+import hmac
+import socket
+import struct
+import subprocess
+from typing import Iterable, Tuple, Union
+
+"""
+The QUIC versions whose Initial packets could be decrypted: version -> (initial salt, label prefix, Initial type).
+"""
+quic_versions = {
+    0x00000001: (bytes.fromhex("38762cf7f55934b34d179ae6a4c80cadccbb7f0a"), b"quic ", 0),    # RFC 9001
+    0x6b3343cf: (bytes.fromhex("0dede3def700a6db819381be6e269dcbf9bd2ed9"), b"quicv2 ", 1),  # RFC 9369
+}
+
+"""
+The maximum number of bytes buffered to reassemble a ClientHello, a larger ClientHello is given up.
+"""
+max_hello_size = 1 << 16
+
+class AmbiguousStreamError(ValueError):
+    """
+    Raised by client_hellos(strict=True) if the native stream numbering may differ from tshark, i.e., upon an IP
+    fragment or a SYN starting a new connection on a TCP conversation already seen.
+    """
+    pass
+
+class ClientHello(object):
+    """
+    A ClientHello found in a capture.
+
+    proto : 'tcp' or 'udp' (QUIC);
+    stream : the tcp.stream or udp.stream index of tshark;
+    frame : the frame number (from 1) of the packet completing the ClientHello;
+    src, sport, dst, dport : the addresses and ports of the client and the server;
+    server_name : the SNI, None if absent;
+    random : the client random in lowercase hex.
+    """
+    def __init__(self, proto, stream, frame, src, sport, dst, dport, server_name, random):
+        self.proto = proto
+        self.stream = stream
+        self.frame = frame
+        self.src = src
+        self.sport = sport
+        self.dst = dst
+        self.dport = dport
+        self.server_name = server_name
+        self.random = random
+
+    def __repr__(self):
+        return f"ClientHello({self.proto}.stream == {self.stream}, {self.src}:{self.sport} -> {self.dst}:{self.dport}, {self.server_name})"
+
+def read_packets(file):
+    """
+    Iterate over the packets of a .pcap or .pcapng file, yield (linktype, data).
+    """
+    with open(file, 'rb') as f:
+        magic = f.read(4)
+        if magic == b'\x0a\x0d\x0d\x0a':
+            yield from _read_pcapng(f, magic)
+        elif magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+            yield from _read_pcap(f, '<')
+        elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+            yield from _read_pcap(f, '>')
+        else:
+            raise ValueError(f"{file} is not a .pcap(ng) file")
+
+def _read_pcap(f, endian):
+    header = f.read(20)
+    linktype = struct.unpack(endian + 'HHiIII', header)[-1] & 0xffff
+    record = struct.Struct(endian + 'IIII')
+    while True:
+        record_header = f.read(16)
+        if len(record_header) < 16:
+            return
+        _, _, caplen, _ = record.unpack(record_header)
+        yield linktype, f.read(caplen)
+
+def _read_pcapng(f, magic):
+    endian = '<'
+    linktypes = []
+    block_header = magic
+    while True:
+        block_header += f.read(8 - len(block_header))
+        if len(block_header) < 8:
+            return
+        if block_header[:4] == b'\x0a\x0d\x0d\x0a':
+            # Section Header Block, which decides the byte order of the section.
+            byte_order = f.read(4)
+            endian = '<' if byte_order == b'\x4d\x3c\x2b\x1a' else '>'
+            length = struct.unpack(endian + 'I', block_header[4:])[0]
+            f.read(length - 12)
+            linktypes = []
+            block_header = b''
+            continue
+
+        block_type, length = struct.unpack(endian + 'II', block_header)
+        body = f.read(length - 8)
+        block_header = b''
+        if len(body) < length - 8:
+            return
+        if block_type == 1:  # Interface Description Block
+            linktypes.append(struct.unpack(endian + 'H', body[:2])[0])
+        elif block_type == 6:  # Enhanced Packet Block
+            interface, _, _, caplen, _ = struct.unpack(endian + 'IIIII', body[:20])
+            yield linktypes[interface], body[20:20 + caplen]
+        elif block_type == 3:  # Simple Packet Block
+            yield linktypes[0], body[4:length - 12]
+        elif block_type == 2:  # Packet Block (obsolete)
+            interface, _, _, _, caplen, _ = struct.unpack(endian + 'HHIIII', body[:20])
+            yield linktypes[interface], body[20:20 + caplen]
+
+def _link_payload(linktype, data) -> Tuple[Union[int, None], bytes]:
+    """
+    Strip the link layer of a packet, return (IP version, IP packet), where the version is None for non-IP packets.
+    """
+    if linktype == 1:  # Ethernet
+        ethertype, offset = struct.unpack('!H', data[12:14])[0], 14
+        while ethertype in (0x8100, 0x88a8) and len(data) >= offset + 4:  # VLAN tags
+            ethertype, offset = struct.unpack('!H', data[offset + 2:offset + 4])[0], offset + 4
+        data = data[offset:]
+        version = {0x0800: 4, 0x86dd: 6}.get(ethertype)
+    elif linktype == 113:  # Linux cooked capture
+        version = {0x0800: 4, 0x86dd: 6}.get(struct.unpack('!H', data[14:16])[0])
+        data = data[16:]
+    elif linktype == 276:  # Linux cooked capture v2
+        version = {0x0800: 4, 0x86dd: 6}.get(struct.unpack('!H', data[0:2])[0])
+        data = data[20:]
+    elif linktype == 0:  # BSD loopback, the family in the host byte order
+        family = max(struct.unpack('<I', data[:4])[0], struct.unpack('>I', data[:4])[0]) if len(data) >= 4 else None
+        version = 4 if family == 2 else 6 if family in (10, 24, 28, 30) else None
+        data = data[4:]
+    elif linktype in (12, 14, 101, 228, 229):  # Raw IP
+        version = data[0] >> 4 if len(data) > 0 else None
+    else:
+        version = None
+    return version, data
+
+def is_fragment(linktype, data) -> bool:
+    """
+    Check whether a packet is a fragment of an IPv4 or IPv6 packet.
+    """
+    version, data = _link_payload(linktype, data)
+    if version == 4 and len(data) >= 20:
+        return bool(struct.unpack('!H', data[6:8])[0] & 0x3fff)
+    elif version == 6 and len(data) >= 40:
+        next_header, offset = data[6], 40
+        while next_header in (0, 43, 60) and len(data) >= offset + 2:  # Hop-by-hop, routing and destination options
+            next_header, offset = data[offset], offset + (data[offset + 1] + 1) * 8
+        return next_header == 44
+    return False
+
+def parse_ip(linktype, data) -> Union[tuple, None]:
+    """
+    Parse a packet into (src, dst, proto, payload) at the IP layer, where proto is the IP protocol number, e.g., 6
+    for TCP and 17 for UDP. Return None for the non-IP and the fragmented packets.
+    """
+    version, data = _link_payload(linktype, data)
+    if version == 4 and len(data) >= 20:
+        header_length = (data[0] & 0x0f) * 4
+        total_length, flags_offset = struct.unpack('!H2xH', data[2:8])
+        if flags_offset & 0x3fff:  # More fragments or a non-zero fragment offset
+            return None
+        return socket.inet_ntop(socket.AF_INET, data[12:16]), socket.inet_ntop(socket.AF_INET, data[16:20]), \
+            data[9], data[header_length:total_length or None]
+    elif version == 6 and len(data) >= 40:
+        payload_length, next_header = struct.unpack('!HB', data[4:7])
+        payload, offset = data[:40 + payload_length], 40
+        while next_header in (0, 43, 60):  # Hop-by-hop, routing and destination options
+            next_header, offset = payload[offset], offset + (payload[offset + 1] + 1) * 8
+        if next_header == 44:  # Fragment
+            return None
+        return socket.inet_ntop(socket.AF_INET6, data[8:24]), socket.inet_ntop(socket.AF_INET6, data[24:40]), \
+            next_header, payload[offset:]
+    return None
+
+def parse_client_hello(handshake) -> Tuple[Union[str, None], str]:
+    """
+    Parse a ClientHello handshake message (with the 4-byte handshake header) into (server_name, random). Raise
+    ValueError if the message is not a ClientHello.
+    """
+    if len(handshake) < 4 or handshake[0] != 1:
+        raise ValueError("Not a ClientHello")
+    body = handshake[4:4 + int.from_bytes(handshake[1:4], 'big')]
+    random = body[2:34].hex()
+    offset = 34
+    offset += 1 + body[offset]  # Session ID
+    offset += 2 + int.from_bytes(body[offset:offset + 2], 'big')  # Cipher suites
+    offset += 1 + body[offset]  # Compression methods
+    if offset + 2 > len(body):
+        return None, random  # No extensions
+    end = offset + 2 + int.from_bytes(body[offset:offset + 2], 'big')
+    offset += 2
+    while offset + 4 <= end:
+        extension_type, extension_length = struct.unpack('!HH', body[offset:offset + 4])
+        extension = body[offset + 4:offset + 4 + extension_length]
+        offset += 4 + extension_length
+        if extension_type != 0:  # server_name
+            continue
+        position = 2  # Skip the length of the server name list
+        while position + 3 <= len(extension):
+            name_type, name_length = struct.unpack('!BH', extension[position:position + 3])
+            if name_type == 0:  # host_name
+                return extension[position + 3:position + 3 + name_length].decode(errors='replace'), random
+            position += 3 + name_length
+    return None, random
+
+def tls_handshake(records) -> Union[bytes, None]:
+    """
+    Reassemble the first handshake message from the TLS records sent at the start of a TCP stream. Return None if
+    more records are needed, raise ValueError if the stream is not TLS.
+    """
+    handshake = bytearray()
+    offset = 0
+    while offset + 5 <= len(records):
+        if records[offset] != 22 or records[offset + 1] != 3:  # Handshake records of TLS (or SSL 3.0)
+            raise ValueError("Not a TLS handshake")
+        length = int.from_bytes(records[offset + 3:offset + 5], 'big')
+        handshake += records[offset + 5:offset + 5 + length]
+        offset += 5 + length
+        if len(handshake) >= 4 and len(handshake) >= 4 + int.from_bytes(handshake[1:4], 'big'):
+            return bytes(handshake)
+    return None
+
+def _varint(data, offset) -> Tuple[int, int]:
+    """
+    Decode a QUIC variable-length integer at offset, return (value, next offset).
+    """
+    length = 1 << (data[offset] >> 6)
+    if offset + length > len(data):
+        raise ValueError("Truncated variable-length integer")
+    return int.from_bytes(data[offset:offset + length], 'big') & ((1 << (8 * length - 2)) - 1), offset + length
+
+def _hkdf_expand_label(secret, label, length) -> bytes:
+    label = b"tls13 " + label
+    info = length.to_bytes(2, 'big') + bytes([len(label)]) + label + b"\x00"
+    output, block, counter = b"", b"", 1
+    while len(output) < length:
+        block = hmac.new(secret, block + info + bytes([counter]), hashlib.sha256).digest()
+        output += block
+        counter += 1
+    return output[:length]
+
+@functools.lru_cache(maxsize=4096)
+def quic_initial_keys(dcid : bytes, version=0x00000001) -> Tuple[bytes, bytes, bytes]:
+    """
+    Derive the client Initial (key, iv, hp) of a QUIC connection from the Destination Connection ID of the first
+    Initial packet of the client.
+    """
+    salt, prefix, _ = quic_versions[version]
+    initial_secret = hmac.new(salt, dcid, hashlib.sha256).digest()  # HKDF-Extract
+    client_secret = _hkdf_expand_label(initial_secret, b"client in", 32)
+    return _hkdf_expand_label(client_secret, prefix + b"key", 16), \
+        _hkdf_expand_label(client_secret, prefix + b"iv", 12), \
+        _hkdf_expand_label(client_secret, prefix + b"hp", 16)
+
+def quic_client_initials(datagram) -> list:
+    """
+    Decrypt the client Initial packets coalesced in a UDP datagram, return a list of (dcid, plaintext). The packets
+    failing the decryption, e.g., the server Initial packets, are skipped.
+    """
+    initials = []
+    offset = 0
+    while offset + 7 <= len(datagram) and datagram[offset] & 0x80:  # Long header
+        start = offset
+        version = int.from_bytes(datagram[offset + 1:offset + 5], 'big')
+        if version not in quic_versions:
+            break
+        packet_type = (datagram[offset] >> 4) & 0x03
+        offset += 5
+        dcid = bytes(datagram[offset + 1:offset + 1 + datagram[offset]])
+        offset += 1 + datagram[offset]
+        offset += 1 + datagram[offset]  # Source Connection ID
+        initial = packet_type == quic_versions[version][2]
+        if initial:
+            token_length, offset = _varint(datagram, offset)
+            offset += token_length
+        elif packet_type == (quic_versions[version][2] + 3) % 4:  # Retry, which has no length field
+            break
+        length, pn_offset = _varint(datagram, offset)
+        offset = pn_offset + length
+        if not initial or offset > len(datagram) or pn_offset + 20 > offset:
+            continue
+
+        key, iv, hp = quic_initial_keys(dcid, version)
+        sample = bytes(datagram[pn_offset + 4:pn_offset + 20])
+        mask = Cipher(algorithms.AES(hp), modes.ECB()).encryptor().update(sample)
+        header = bytearray(datagram[start:pn_offset + 4])
+        header[0] ^= mask[0] & 0x0f
+        pn_length = (header[0] & 0x03) + 1
+        header = header[:pn_offset - start + pn_length]
+        for i in range(pn_length):
+            header[pn_offset - start + i] ^= mask[1 + i]
+        packet_number = int.from_bytes(header[pn_offset - start:], 'big')
+        nonce = bytes(a ^ b for a, b in zip(iv, packet_number.to_bytes(12, 'big')))
+        try:
+            plaintext = AESGCM(key).decrypt(nonce, bytes(datagram[pn_offset + pn_length:offset]), bytes(header))
+        except InvalidTag:
+            continue
+        initials.append((dcid, plaintext))
+
+    return initials
+
+def crypto_frames(plaintext) -> list:
+    """
+    Extract the CRYPTO frames from the plaintext of a QUIC Initial packet, return a list of (offset, data). Only
+    the frames allowed in the Initial packets are parsed.
+    """
+    frames = []
+    offset = 0
+    while offset < len(plaintext):
+        frame_type = plaintext[offset]
+        offset += 1
+        if frame_type in (0x00, 0x01):  # PADDING, PING
+            continue
+        elif frame_type in (0x02, 0x03):  # ACK
+            _, offset = _varint(plaintext, offset)  # Largest acknowledged
+            _, offset = _varint(plaintext, offset)  # ACK delay
+            range_count, offset = _varint(plaintext, offset)
+            for _ in range(2 * range_count + 1):
+                _, offset = _varint(plaintext, offset)
+            for _ in range(3 if frame_type == 0x03 else 0):  # ECN counts
+                _, offset = _varint(plaintext, offset)
+        elif frame_type == 0x06:  # CRYPTO
+            crypto_offset, offset = _varint(plaintext, offset)
+            length, offset = _varint(plaintext, offset)
+            frames.append((crypto_offset, plaintext[offset:offset + length]))
+            offset += length
+        elif frame_type in (0x1c, 0x1d):  # CONNECTION_CLOSE
+            _, offset = _varint(plaintext, offset)  # Error code
+            if frame_type == 0x1c:
+                _, offset = _varint(plaintext, offset)  # Frame type
+            length, offset = _varint(plaintext, offset)
+            offset += length
+        else:
+            break
+    return frames
+
+class _Fragments(object):
+    """
+    The out-of-order fragments of a byte stream, keyed by their offsets from base, i.e., the sequence number
+    following the SYN if started, otherwise that of the earliest TCP segment seen so far.
+    """
+    def __init__(self, base=0, started=False):
+        self.base = base
+        self.started = started
+        self.fragments = dict()
+        self.size = 0
+        self.done = False
+
+    def add_segment(self, seq, data):
+        offset = (seq - self.base) % (1 << 32)
+        if offset >= 1 << 31:  # Earlier than base, a reordered segment if not started, otherwise a stale one
+            if self.started:
+                return
+            shift = (1 << 32) - offset
+            self.fragments = {fragment_offset + shift: fragment for fragment_offset, fragment in self.fragments.items()}
+            self.base, offset = seq, 0
+        self.add(offset, data)
+
+    def add(self, offset, data):
+        if len(data) > len(self.fragments.get(offset, b'')):
+            self.size += len(data) - len(self.fragments.get(offset, b''))
+            self.fragments[offset] = bytes(data)
+
+    def contiguous(self) -> bytes:
+        data = bytearray()
+        for offset in sorted(self.fragments):
+            if offset > len(data):
+                break
+            data += self.fragments[offset][len(data) - offset:]
+        return bytes(data)
+
+def client_hellos(file, strict=False) -> list:
+    """
+    Find all ClientHellos of a .pcap(ng) file, over TCP and in QUIC Initial packets, return a list of ClientHello.
+    If strict, raise AmbiguousStreamError once the stream numbers may differ from tshark.
+    """
+    hellos = []
+    tcp_streams, udp_streams = dict(), dict()  # conversation -> stream index (whether closed and the SYN for TCP)
+    tcp_count = 0
+    tcp_hellos = dict()   # (stream, src, sport) -> _Fragments
+    quic_hellos = dict()  # (stream, dcid) -> _Fragments
+
+    for frame, (linktype, data) in enumerate(read_packets(file), start=1):
+        try:
+            parsed = parse_ip(linktype, data)
+        except (struct.error, IndexError):
+            continue
+        if parsed is None:
+            if strict and is_fragment(linktype, data):
+                raise AmbiguousStreamError(f"Frame {frame} is an IP fragment")
+            continue
+        src, dst, proto, payload = parsed
+
+        if proto == 6 and len(payload) >= 20:
+            sport, dport, seq, offset_flags = struct.unpack('!HHI4xH', payload[:14])
+            flags = offset_flags & 0x3f
+            conversation = tuple(sorted([(src, sport), (dst, dport)]))
+            state = tcp_streams.get(conversation)
+            if strict and state is not None and flags & 0x12 == 0x02 and state[2] != seq:
+                # Not a retransmitted SYN, the ports are reused.
+                raise AmbiguousStreamError(f"Frame {frame} reuses the ports of TCP stream {state[0]}")
+            # A new stream upon the first packet, or upon a SYN after FIN/RST of a reused conversation.
+            if state is None or (flags & 0x12 == 0x02 and state[1]):
+                state = [tcp_count, False, None]
+                tcp_streams[conversation] = state
+                tcp_count += 1
+            if flags & 0x12 == 0x02:
+                state[2] = seq
+            if flags & 0x05:  # FIN or RST
+                state[1] = True
+            key = (state[0], src, sport)
+            if flags & 0x02:  # SYN, the stream starts right after it
+                tcp_hellos[key] = _Fragments(seq + 1, started=True)
+            segment = payload[(offset_flags >> 12) * 4:]
+            if len(segment) == 0:
+                continue
+
+            if key not in tcp_hellos:
+                tcp_hellos[key] = _Fragments(seq)
+            fragments = tcp_hellos[key]
+            if fragments.done:
+                continue
+            fragments.add_segment(seq + 1 if flags & 0x02 else seq, segment)  # The data of a SYN follows the SYN
+            try:
+                handshake = tls_handshake(fragments.contiguous())
+                if handshake is not None:
+                    fragments.done = True
+                    server_name, random = parse_client_hello(handshake)
+                    hellos.append(ClientHello('tcp', state[0], frame, src, sport, dst, dport, server_name, random))
+            except (ValueError, IndexError, struct.error):
+                # Not TLS, or not started by a ClientHello. Without the SYN, the start of the stream is unknown,
+                # and the segments before the first one seen may still arrive.
+                fragments.done = fragments.started
+            if fragments.size > max_hello_size:
+                fragments.done = True
+
+        elif proto == 17 and len(payload) >= 8:
+            sport, dport = struct.unpack('!HH', payload[:4])
+            conversation = tuple(sorted([(src, sport), (dst, dport)]))
+            stream = udp_streams.setdefault(conversation, len(udp_streams))
+
+            try:
+                initials = quic_client_initials(payload[8:])
+            except (ValueError, IndexError):
+                continue  # Not QUIC
+            for dcid, plaintext in initials:
+                fragments = quic_hellos.setdefault((stream, dcid), _Fragments())
+                if fragments.done:
+                    continue
+                try:
+                    for offset, crypto in crypto_frames(plaintext):
+                        fragments.add(offset, crypto)
+                    handshake = fragments.contiguous()
+                    if len(handshake) >= 4 and len(handshake) >= 4 + int.from_bytes(handshake[1:4], 'big'):
+                        fragments.done = True
+                        server_name, random = parse_client_hello(handshake)
+                        hellos.append(ClientHello('udp', stream, frame, src, sport, dst, dport, server_name, random))
+                except (ValueError, IndexError, struct.error):
+                    fragments.done = True
+                if fragments.size > max_hello_size:
+                    fragments.done = True
+
+    return hellos
+
+def extract_SNIs(file) -> set:
+    """
+    Extract all SNIs of a .pcap(ng) file, the native counterpart of SNI_extract.
+    """
+    return {hello.server_name for hello in client_hellos(file) if hello.server_name is not None}
+
+def SNI_stream_numbers(file, SNIs : Iterable[str]) -> Tuple[set, set]:
+    """
+    Find the TCP and UDP stream numbers (as strings, the same as stream_number_extract) of a .pcap(ng) file whose
+    ClientHello carries an SNI in SNIs. Fall back to tshark (see tshark_SNI_stream_numbers) if the native stream
+    numbering is ambiguous.
+    """
+    SNIs = set(SNIs)
+    try:
+        hellos = client_hellos(file, strict=True)
+    except AmbiguousStreamError:
+        return tshark_SNI_stream_numbers(file, SNIs)
+    tcp_stream_numbers, udp_stream_numbers = set(), set()
+    for hello in hellos:
+        if hello.server_name in SNIs:
+            (tcp_stream_numbers if hello.proto == 'tcp' else udp_stream_numbers).add(str(hello.stream))
+    return tcp_stream_numbers, udp_stream_numbers
+
+def tshark_SNI_stream_numbers(file, SNIs : Iterable[str]) -> Tuple[set, set]:
+    """
+    The same as SNI_stream_numbers, but the ClientHellos and their streams are found by a tshark fields export.
+    """
+    SNIs = set(SNIs)
+    cmd = ['tshark', '-r', str(file), '-Y', "tls.handshake.type == 1", '-T', 'fields', '-E', 'separator=/t',
+           '-E', 'occurrence=a', '-E', 'aggregator=,',
+           '-e', 'tcp.stream', '-e', 'udp.stream', '-e', 'tls.handshake.extensions_server_name']
+    process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"tshark exited with {process.returncode}: {process.stderr.strip()}")
+
+    tcp_stream_numbers, udp_stream_numbers = set(), set()
+    for line in process.stdout.splitlines():
+        tcp_stream, udp_stream, server_names = (line.split('\t') + ['', '', ''])[:3]
+        if SNIs.isdisjoint(server_names.split(',')):
+            continue
+        if tcp_stream:
+            tcp_stream_numbers.add(tcp_stream.split(',')[0])
+        elif udp_stream:
+            udp_stream_numbers.add(udp_stream.split(',')[0])
+    return tcp_stream_numbers, udp_stream_numbers
@@ -39,6 +39,10 @@ parser.add_argument("--seq_len", type=int, default=5000, help="Input sequence le
 # Optimization parameters
 parser.add_argument("--num_workers", type=int, default=10, help="Number of workers for data loader")
 parser.add_argument("--batch_size", type=int, default=256, help="Batch size of training input data")
+parser.add_argument("--attr_batch_classes", type=int, default=4, help="Number of classes attributed by one attribute call")
+parser.add_argument("--attr_workers", type=int, default=1, help="Number of processes to attribute the classes (CPU only)")
+parser.add_argument("--attr_cache", type=str, default=None,
+                    help="Directory of the attribution cache, <checkpoints>/attr_cache by default, 'none' to disable")
 
 # Output parameters
 parser.add_argument("--checkpoints", type=str, default="./checkpoints/", help="Directory to save model checkpoints")
@@ -81,8 +85,14 @@ print(f"num_classes: {num_classes}")
 model = eval(f"models.{args.model}")(num_classes)
 model.load_state_dict(torch.load(os.path.join(ckp_path, f"{args.save_name}.pth"), map_location="cpu"))
 
+# Reuse the results of the same checkpoint, method and inputs
+attr_cache = os.path.join(args.checkpoints, "attr_cache") if args.attr_cache is None else args.attr_cache
+cache = analyzer.AttributionCache(attr_cache) if attr_cache.lower() != "none" else None
+
 # Perform feature attribution using the specified method
-attr_values = analyzer.feature_attr(model, args.attr_method, valid_X, valid_y, num_classes)
+attr_values = analyzer.feature_attr(model, args.attr_method, valid_X, valid_y, num_classes,
+                                    classes_per_batch=args.attr_batch_classes, num_workers=args.attr_workers,
+                                    device=device, cache=cache)
 
 # Print the shape of the attribution values
 print("shape of attr_values:", attr_values.shape)
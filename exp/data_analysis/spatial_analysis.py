@@ -7,7 +7,7 @@ import argparse
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 from WFlib import models
-from WFlib.tools import data_processor, evaluator
+from WFlib.tools import data_processor, evaluator, model_utils
 
 # Set a fixed seed for reproducibility of experiments
 fix_seed = 2024
@@ -35,6 +35,8 @@ parser.add_argument("--batch_size", type=int, default=256, help="Batch size of t
 # Output parameters
 parser.add_argument("--checkpoints", type=str, default="./checkpoints/", help="Directory to save model checkpoints")
 parser.add_argument("--save_name", type=str, default="base", help="Name of the model file")
+parser.add_argument("--inference_cache", type=str, default=None,
+                    help="Directory to cache the model outputs, default=<checkpoints>/<dataset>/<model>/inference_cache, 'none' to disable")
 
 # Parse command-line arguments
 args = parser.parse_args()
@@ -67,27 +69,23 @@ assert num_classes == valid_y.max() + 1, "Labels are not continuous"
 print(f"Valid: X={valid_X.shape}, y={valid_y.shape}")
 print(f"num_classes: {num_classes}")
 
-# Load data into iterators
-valid_iter = data_processor.load_iter(valid_X, valid_y, args.batch_size, False, args.num_workers)
-
 # Initialize the model
 model = eval(f"models.{args.model}")(num_classes)
 model.load_state_dict(torch.load(os.path.join(ckp_path, f"{args.save_name}.pth"), map_location="cpu"))
 model.to(device)
 
-# Initialize a dictionary to store embeddings for each class
+# Collect embeddings for the validation set, shared with test.py through the inference cache
+if args.inference_cache is None:
+    args.inference_cache = os.path.join(ckp_path, "inference_cache")
+inference_cache = None if args.inference_cache == "none" else args.inference_cache
+engine = model_utils.InferenceEngine(model, device, batch_size=args.batch_size, cache_dir=inference_cache)
+valid_embs = engine.outputs(valid_X)
+
+# Group the embeddings by class
 embs_pool = {}
+valid_labels = valid_y.numpy()
 for web in range(num_classes):
-    embs_pool[web] = []
-
-# Collect embeddings for the validation set
-with torch.no_grad():
-    model.eval()
-    for index, cur_data in enumerate(valid_iter):
-        cur_X, cur_y = cur_data[0].to(device), cur_data[1].to(device)
-        embs = model(cur_X).cpu().numpy()
-        for i, web in enumerate(cur_y.cpu().numpy()):
-            embs_pool[web].append(embs[i])
+    embs_pool[web] = valid_embs[valid_labels == web]
 
 # Calculate centroids and radii for each class
 webs_centroid = []
@@ -5,10 +5,15 @@ representing the request to the same website.
 For example, there are 100 .pcap(ng) files representing requests to pan.baidu.com, which transfers content
 mainly through the domain nd-static.bdstatic.com. Therefore, for each file, we first find TCP streams conveying
 HTTP/2 DATA frames.
+
+Without --host, all hosts of the base dir are processed in parallel by batch_statistics, where each file is
+dissected once with all the byte counters, and the results go to one columnar table (statistics/stats.npz).
 """
 import pyshark
 from WFlib.tools.capture import *
 from WFlib.tools.analyzer import *
+from WFlib.tools.keylog import KeylogIndex
+from WFlib.tools.dissection import DissectionCache
 from pathlib import Path
 import json
 import argparse
@@ -17,12 +22,13 @@ def tls_stat(base_dir_path : Path, SNIs, keylog_file):
     stat = {'host': base_dir_path.name, 'SNIs': SNIs, 'file': []}
 
     tls_counter = TLSByteCounter()
+    keylog_index = KeylogIndex(keylog_file)
 
     for file in sorted(base_dir_path.iterdir()):
         if file.is_file() and file.suffix in ['.pcapng', '.pcap']:
             idx = str(file).split('.')[-2].split('_')[-1]  # Only the index of the filename is needed.
             pkt_count, byte_count = 0, 0
-            tcp_stream, _ = h2data_SNI_intersect(file, SNIs, keylog_file=keylog_file, custom_parameters={"-C": "Customized"})
+            tcp_stream, _ = h2data_SNI_intersect(file, SNIs, keylog_file=keylog_index.minimal_keylog(file), custom_parameters={"-C": "Customized"})
             tcp_stream_filter = stream_extract_filter(tcp_stream, [])
             display_filter = "tls" + " and " + tcp_stream_filter
             if tcp_stream_filter == "":
@@ -51,13 +57,14 @@ def tcp_stat(base_dir_path : Path, SNIs, keylog_file):
     stat = {'host': base_dir_path.name, 'SNIs': SNIs, 'file': []}
 
     tcp_counter = TCPByteCounter()
+    keylog_index = KeylogIndex(keylog_file)
 
     for file in sorted(base_dir_path.iterdir()):
         if file.is_file() and file.suffix in ['.pcapng', '.pcap']:
             idx = str(file).split('.')[-2].split('_')[-1]  # Only the index of the filename is needed.
             pkt_count, byte_count = 0, 0
 
-            tcp_stream, _ = h2data_SNI_intersect(file, SNIs, keylog_file=keylog_file, custom_parameters={"-C": "Customized"})
+            tcp_stream, _ = h2data_SNI_intersect(file, SNIs, keylog_file=keylog_index.minimal_keylog(file), custom_parameters={"-C": "Customized"})
             tcp_stream_filter = stream_extract_filter(tcp_stream, [])
             display_filter = tcp_stream_filter
             if tcp_stream_filter == "":
@@ -112,11 +119,14 @@ def http2_stat(base_dir_path : Path, SNIs, keylog_file):
     tcp_stat = {'host': base_dir_path.name, 'SNIs': SNIs, 'file': []}
 
     counter = CaptureCounter(TCPByteCounter(), TLSByteCounter(), HTTP2ByteCounter())
+    keylog_index = KeylogIndex(keylog_file)
 
     for file in sorted(base_dir_path.iterdir()):
         if file.is_file() and file.suffix in ['.pcapng', '.pcap']:
             idx = str(file).split('.')[-2].split('_')[-1]  # Only the index of the filename is needed.
-            tcp_stream, _ = h2data_SNI_intersect(file, SNIs, keylog_file=keylog_file, 
+            # Only load the secrets of this capture instead of the whole keylog.txt of the host.
+            file_keylog = keylog_index.minimal_keylog(file)
+            tcp_stream, _ = h2data_SNI_intersect(file, SNIs, keylog_file=file_keylog, 
                                                  custom_parameters=["-C", "Customized", "-2"])
             tcp_stream_filter = stream_extract_filter(tcp_stream, [])
             if tcp_stream_filter == "":
@@ -124,7 +134,7 @@ def http2_stat(base_dir_path : Path, SNIs, keylog_file):
                 continue
             cap = pyshark.FileCapture(input_file=file, display_filter=tcp_stream_filter,
                                       custom_parameters=["-C", "Customized", "-2"],
-                                      override_prefs={'tls.keylog_file': os.path.abspath(keylog_file)})
+                                      override_prefs={'tls.keylog_file': os.path.abspath(file_keylog)})
             try:
                 result = counter.count(cap)
             except AttributeError as e:
@@ -153,12 +163,15 @@ def http3_stat(base_dir_path : Path, SNIs, keylog_file):
     udp_stat = {'host': base_dir_path.name, 'SNIs': SNIs, 'file': []}
 
     counter = CaptureCounter(UDPByteCounter(), QUICByteCounter(), HTTP3ByteCounter())
+    keylog_index = KeylogIndex(keylog_file)
 
     for file in sorted(base_dir_path.iterdir()):
         if file.is_file() and file.suffix in ['.pcapng', '.pcap']:
             idx = str(file).split('.')[-2].split('_')[-1]  # Only the index of the filename is needed.
+            # Only load the secrets of this capture instead of the whole keylog.txt of the host.
+            file_keylog = keylog_index.minimal_keylog(file)
 
-            _, udp_stream = h3data_SNI_intersect(file, SNIs, keylog_file=keylog_file, 
+            _, udp_stream = h3data_SNI_intersect(file, SNIs, keylog_file=file_keylog, 
                                                  custom_parameters=["-C", "Customized", "-2"])
             udp_stream_filter = stream_extract_filter([], udp_stream)
             if udp_stream_filter == "":
@@ -166,7 +179,7 @@ def http3_stat(base_dir_path : Path, SNIs, keylog_file):
                 continue
             cap = pyshark.FileCapture(input_file=file, display_filter=udp_stream_filter,
                                       custom_parameters=["-C", "Customized", "-2"],
-                                      override_prefs={'tls.keylog_file': os.path.abspath(keylog_file)})
+                                      override_prefs={'tls.keylog_file': os.path.abspath(file_keylog)})
             
             result = counter.count(cap)
 
@@ -190,16 +203,32 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     # Flag argument
     parser.add_argument("-d", "--dir", default="exp/normal_capture", type=str, help="The base dir for statistics.")
-    parser.add_argument("--host", required=True, type=str, help="The host to analyze.")
-    parser.add_argument("-s", "--sni", required=True, type=str, help="The domain to analyze.")
+    parser.add_argument("--host", default=None, type=str, help="The host to analyze, all hosts in one table if not given.")
+    parser.add_argument("-s", "--sni", default=None, type=str, help="The domain to analyze.")
     parser.add_argument("-k", "--keylog", type=str, default=None, help="Path to keylog file")
     parser.add_argument("-p", "--protocol", type=str, default="http2", help="Protocol to analyze")
+    parser.add_argument("-m", "--sni-map", type=str, default=None, help="A JSON file mapping each host to its SNIs, the host itself if absent.")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="The number of parallel processes.")
+    parser.add_argument("-o", "--output", type=str, default="statistics/stats.npz", help="The columnar table of all hosts.")
+    parser.add_argument("-c", "--cache-dir", type=str, default=None, help="The cache of the decrypted per-frame tables, reused across runs.")
     args = parser.parse_args()
-    
+
+    if args.host is None:
+        # Count all protocols of all hosts in a single pass per file.
+        SNI_map = None
+        if args.sni_map is not None:
+            with open(args.sni_map) as f:
+                SNI_map = json.load(f)
+        cache = DissectionCache(args.cache_dir) if args.cache_dir is not None else None
+        table = batch_statistics(args.dir, SNI_map=SNI_map, num_workers=args.jobs, cache=cache)
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        save_statistics(table, args.output)
+        exit(0)
+
     base_dir = f"{args.dir}/{args.host}"
     base_dir_path = Path(base_dir)
     keylog_file = f"{base_dir}/keylog.txt" if args.keylog is None else args.keylog
-    SNIs = [args.sni]
+    SNIs = [args.host if args.sni is None else args.sni]
     if not base_dir_path.exists():
         print("Invalid base directory.")
         exit(1)
@@ -209,4 +238,4 @@ if __name__ == '__main__':
     elif args.protocol == "http3":
         http3_stat(base_dir_path, SNIs, keylog_file)
     else:
-        print("Invalid protocol.")
\ No newline at end of file
+        print("Invalid protocol.")
@@ -2,7 +2,10 @@
 This file is used to test batch_capture. Also, it could be used as a simple script to for capture.
 """
 
-from WFlib.tools.capture import batch_capture, read_host_list, decide_output_file_idx
+from WFlib.tools.capture import batch_capture, read_host_list, decide_output_file_idx, BrowserPool, QualityGate, CaptureProfile, \
+    ProxySupervisor, default_proxy_binary
+from WFlib.tools.manifest import CaptureManifest
+from WFlib.tools.noise import NoiseFilter
 import argparse
 import os
 from pathlib import Path
@@ -16,6 +19,23 @@ if __name__ == '__main__':
     parser.add_argument('-r', '--repeat', type=int, default=20, help="How many times the request will repeat")
     parser.add_argument('-t', '--timeout', type=int, default=200, help="The living time for a browsing session")
     parser.add_argument('--use-proxy', action='store_true', help="To use proxy for proxied traffic capture.")
+    parser.add_argument('--idle-window', type=float, default=5., help="The seconds of network idleness to end a visit before timeout")
+    parser.add_argument('--fixed-sleep', action='store_true', help="To always browse for timeout seconds.")
+    parser.add_argument('--manifest', action='store_true', help="To record the visits in base_dir/manifest.db and resume from it.")
+    parser.add_argument('--quality-gate', action='store_true', help="To check each capture right after it finishes and recapture the rejected ones.")
+    parser.add_argument('--min-packets', type=int, default=50, help="The minimum number of packets of a good capture.")
+    parser.add_argument('--min-duration', type=float, default=0., help="The minimum seconds between the first and the last packet of a good capture.")
+    parser.add_argument('--max-attempts', type=int, default=3, help="The maximum number of attempts of each visit.")
+    parser.add_argument('--backoff', type=float, default=30., help="The base backoff in seconds before recapturing a rejected visit.")
+    parser.add_argument('--warm-browser', action='store_true', help="To reuse pre-launched browsers instead of launching one per visit.")
+    parser.add_argument('--max-uses', type=int, default=20, help="The number of visits after which a pre-launched browser is relaunched.")
+    parser.add_argument('--no-decrypt', action='store_true', help="To skip the keylog files, the header-only profile is used unless specified otherwise.")
+    parser.add_argument('--snaplen', type=int, default=None, help="The number of bytes kept per packet, 0 for the full packet.")
+    parser.add_argument('--dumpcap', action='store_true', help="To capture with dumpcap instead of tshark.")
+    parser.add_argument('--buffer-size', type=int, default=None, help="The kernel capture buffer size in MiB.")
+    parser.add_argument('--proxy-bin', type=str, default=default_proxy_binary, help="The proxy client to launch with --use-proxy.")
+    parser.add_argument('--proxy-port', type=int, default=7890, help="The local port of the proxy client.")
+    parser.add_argument('--noise-filter', type=str, default=None, help="The SNI list (e.g., exp/data_extract/filter.txt) whose addresses are excluded at capture time.")
     parser.add_argument('--dry-run', action='store_true', help="To output the file names will be created without actual creation.")
     args = parser.parse_args()
 
@@ -24,6 +44,9 @@ if __name__ == '__main__':
     host_list = read_host_list(args.list)
 
     proxy_log = os.path.join(args.dir, "proxy_log.txt") if args.use_proxy else None
+    profile = None
+    if args.snaplen is not None or args.dumpcap or args.buffer_size is not None:
+        profile = CaptureProfile(snaplen=args.snaplen or 0, use_dumpcap=args.dumpcap, buffer_size=args.buffer_size)
 
 
     if args.dry_run:
@@ -46,12 +69,44 @@ if __name__ == '__main__':
         if proxy_log is not None:
             print(proxy_log)
     else:
-        batch_capture(base_dir=args.dir, 
-                      host_list=host_list, 
-                      iface=args.iface, 
-                      repeat=args.repeat, 
-                      timeout=args.timeout,
-                      ill_files=ill_files,
-                      log_output=log_output,
-                      proxy_log=proxy_log
-                      )
\ No newline at end of file
+        browser_pool = BrowserPool(size=1, max_uses=args.max_uses, proxy=args.use_proxy, proxy_port=args.proxy_port) \
+            if args.warm_browser else None
+        proxy = None
+        if args.use_proxy:
+            os.makedirs(args.dir, exist_ok=True)
+            proxy = ProxySupervisor(binary=args.proxy_bin, port=args.proxy_port,
+                                    keylog_file=os.path.join(args.dir, "proxy_keylog.txt"), log_file=proxy_log)
+        quality_gate = QualityGate(min_packets=args.min_packets, min_duration=args.min_duration) if args.quality_gate else None
+        noise_filter = NoiseFilter(read_host_list(args.noise_filter), protect=host_list) \
+            if args.noise_filter is not None else None
+        manifest = None
+        if args.manifest:
+            os.makedirs(args.dir, exist_ok=True)
+            manifest = CaptureManifest(os.path.join(args.dir, "manifest.db"), base_dir=args.dir)
+        try:
+            batch_capture(base_dir=args.dir, 
+                          host_list=host_list, 
+                          iface=args.iface, 
+                          repeat=args.repeat, 
+                          timeout=args.timeout,
+                          ill_files=ill_files,
+                          log_output=log_output,
+                          proxy_log=proxy_log,
+                          browser_pool=browser_pool,
+                          idle_window=None if args.fixed_sleep else args.idle_window,
+                          manifest=manifest,
+                          quality_gate=quality_gate,
+                          max_attempts=args.max_attempts,
+                          backoff=args.backoff,
+                          decrypt=not args.no_decrypt,
+                          profile=profile,
+                          proxy=proxy,
+                          noise_filter=noise_filter
+                          )
+        finally:
+            if browser_pool is not None:
+                browser_pool.close()
+            if manifest is not None:
+                manifest.close()
+            if proxy is not None:
+                proxy.close()
\ No newline at end of file
@@ -1,8 +1,11 @@
 """
 This file aims to do some clean-up for the files specified by the given file (ill_files.txt by default).
 The user could specify 
+Alternatively, the files of the failed (or interrupted) visits could be taken from the capture manifest.
 """
 
+from WFlib.tools.manifest import CaptureManifest
+
 import os
 import sys
 import argparse
@@ -34,6 +37,18 @@ def delete_files(file_path, verbose=False, clear_content=False):
     except Exception as e:
         print(f"An error occurred: {e}")
 
+def clear_manifest(manifest_file, verbose=False):
+    """
+    Delete the files of the failed and interrupted visits recorded in the manifest, and mark them as cleared.
+    """
+    with CaptureManifest(manifest_file) as manifest:
+        for visit in manifest.visits('failed') + manifest.visits('interrupted'):
+            if os.path.isfile(visit['file']):
+                os.remove(visit['file'])
+                if verbose:
+                    print(f"Deleted file: {visit['file']}")
+            manifest.set_status(visit['id'], 'cleared')
+
 def ask_proceed():
     while True:
         user_input = input("Proceed? [Y/N]").strip().lower()
@@ -50,10 +65,21 @@ def ask_proceed():
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-l', '--list', type=str, help="The file list to delete")
+    parser.add_argument('-m', '--manifest', type=str, default=None, help="The capture manifest, whose failed visits will be deleted")
     parser.add_argument('--verbose', action='store_true', help="Verbose output")
     parser.add_argument('--clear-content', action='store_true', help="If specified, the content of the specified file will be cleared")
     args = parser.parse_args()
 
+    if args.manifest is not None:
+        with CaptureManifest(args.manifest) as manifest:
+            visits = manifest.visits('failed') + manifest.visits('interrupted')
+        print("The following files will be removed:")
+        for visit in visits:
+            print(f"\t{visit['file']}")
+        if ask_proceed():
+            clear_manifest(args.manifest, verbose=args.verbose)
+        sys.exit(0)
+
     try:
         # Open the list file for reading
         with open(args.list, 'r') as f:
@@ -0,0 +1,57 @@
+"""
+This file runs the capture with several workers at once, each in its own network namespace (see
+WFlib.tools.orchestrator). It must be run as root. To test it against a local HTTP server, serve on the host side
+address of a worker (e.g., `python -m http.server -b 10.200.0.1 8000`) and capture `10.200.0.1:8000` with
+`--proto http://`.
+"""
+
+from WFlib.tools.orchestrator import parallel_capture
+from WFlib.tools.capture import read_host_list, CaptureProfile
+import argparse
+import os
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-l', '--list', type=str, help="The hostname list file to read")
+    parser.add_argument('-d', '--dir', type=str, help="The base dir to which the capture will output")
+    parser.add_argument('-w', '--workers', type=int, default=4, help="The number of capture workers")
+    parser.add_argument('-r', '--repeat', type=int, default=20, help="How many times the request will repeat")
+    parser.add_argument('-t', '--timeout', type=int, default=200, help="The living time for a browsing session")
+    parser.add_argument('--proto', type=str, default="https://", help="The protocol prepended to the hostnames")
+    parser.add_argument('--subnet', type=str, default="10.200", help="The /16 prefix of the worker namespaces")
+    parser.add_argument('--nameserver', type=str, default="1.1.1.1", help="The DNS server used by the workers")
+    parser.add_argument('--idle-window', type=float, default=5., help="The seconds of network idleness to end a visit before timeout")
+    parser.add_argument('--fixed-sleep', action='store_true', help="To always browse for timeout seconds.")
+    parser.add_argument('--manifest', action='store_true', help="To record the visits in base_dir/manifest.db and resume from it.")
+    parser.add_argument('--warm-browser', action='store_true', help="To reuse pre-launched browsers instead of launching one per visit")
+    parser.add_argument('--max-uses', type=int, default=20, help="The number of visits after which a pre-launched browser is relaunched")
+    parser.add_argument('--no-decrypt', action='store_true', help="To skip the keylog files, the header-only profile is used unless specified otherwise.")
+    parser.add_argument('--snaplen', type=int, default=None, help="The number of bytes kept per packet, 0 for the full packet.")
+    parser.add_argument('--dumpcap', action='store_true', help="To capture with dumpcap instead of tshark.")
+    parser.add_argument('--buffer-size', type=int, default=None, help="The kernel capture buffer size in MiB.")
+    args = parser.parse_args()
+
+    log_output = os.path.join(args.dir, "log.txt")
+    ill_files = os.path.join(args.dir, "ill_files.txt")
+    host_list = read_host_list(args.list)
+    os.makedirs(args.dir, exist_ok=True)
+    profile = None
+    if args.snaplen is not None or args.dumpcap or args.buffer_size is not None:
+        profile = CaptureProfile(snaplen=args.snaplen or 0, use_dumpcap=args.dumpcap, buffer_size=args.buffer_size)
+
+    parallel_capture(base_dir=args.dir,
+                     host_list=host_list,
+                     num_workers=args.workers,
+                     repeat=args.repeat,
+                     timeout=args.timeout,
+                     ill_files=ill_files,
+                     log_output=log_output,
+                     proto_header=args.proto,
+                     subnet=args.subnet,
+                     nameserver=args.nameserver,
+                     warm_browser=args.warm_browser,
+                     max_uses=args.max_uses,
+                     idle_window=None if args.fixed_sleep else args.idle_window,
+                     manifest_file=os.path.join(args.dir, "manifest.db") if args.manifest else None,
+                     decrypt=not args.no_decrypt,
+                     profile=profile)
@@ -1,38 +1,53 @@
 """
 This file extract SNIs from each .pcap(ng) files in the base dir, and summarize the results
 into a JSON file.
+
+By default, the SNIs are extracted by pyshark as before, i.e., only from the ClientHellos over TCP port 443.
+Pass --native to extract them by the native parser (see WFlib.tools.sni), which is much faster but changes the
+output: the SNIs of the ClientHellos in QUIC Initial packets and over the ports other than 443 are included too.
 """
 
-from WFlib.tools.capture import SNI_extract
+from WFlib.tools.capture import SNI_extract, read_host_list
+from WFlib.tools.sni import extract_SNIs
 from pathlib import Path
 import pyshark
 import json
 import argparse
+import multiprocessing
+
+def tshark_extract_SNIs(file) -> set:
+    cap = pyshark.FileCapture(file, display_filter="tcp.port == 443 and tls.handshake.type == 1")
+    SNIs = SNI_extract(cap)
+    cap.close()
+    return SNIs
 
 if __name__=="__main__":
     parser = argparse.ArgumentParser()
     # Flag argument
     parser.add_argument('-d', '--dir', required=True, type=str, help="The base dir where to extract SNIs")
     parser.add_argument('-f', '--filter', default=None, type=str, help="The original filter, used to find new SNIs only")
+    parser.add_argument('-j', '--jobs', default=multiprocessing.cpu_count(), type=int, help="The number of parallel processes")
+    parser.add_argument('--native', action='store_true',
+                        help="To extract the SNIs by the native parser instead of pyshark, NOTE: the output also includes "
+                             "the SNIs over QUIC and over the ports other than TCP 443")
     args = parser.parse_args()
 
     existing_filter_SNIs = set()
     if args.filter is not None:
-        # Read in existing filter SNIs
-        with open(args.filter, 'r') as f:
-            existing_filter_SNIs = set([SNI.strip() for SNI in f])
+        # Read in existing filter SNIs, the inline comments are ignored.
+        existing_filter_SNIs = set(read_host_list(args.filter))
 
     json_file = "sni.json"
-    results = dict()
     base_dir_path = Path(args.dir)
-    for subdir in sorted(base_dir_path.iterdir()):
-        if subdir.is_dir():  # Check if it's a directory
-            for file in subdir.iterdir():
-                if file.is_file() and file.suffix in ['.pcapng', '.pcap']:  # Ensure it's a pcap(ng) file
-                    cap = pyshark.FileCapture(file, display_filter="tcp.port == 443 and tls.handshake.type == 1")
-                    SNIs = SNI_extract(cap) - existing_filter_SNIs
-                    cap.close()
-                    results[file.name] = list(SNIs)
-                    
+    files = [file for subdir in sorted(base_dir_path.iterdir()) if subdir.is_dir()  # Check if it's a directory
+             for file in subdir.iterdir() if file.is_file() and file.suffix in ['.pcapng', '.pcap']]  # Ensure it's a pcap(ng) file
+
+    with multiprocessing.Pool(args.jobs) as pool:
+        file_SNIs = pool.map(extract_SNIs if args.native else tshark_extract_SNIs, files, chunksize=16)
+
+    results = dict()
+    for file, SNIs in zip(files, file_SNIs):
+        results[file.name] = list(SNIs - existing_filter_SNIs)
+
     with open(json_file, "w") as f:
-        json.dump(results, f)
\ No newline at end of file
+        json.dump(results, f)
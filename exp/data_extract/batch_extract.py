@@ -7,8 +7,9 @@ NOTE: Currently, only .pcap files are supported. More file format (.json, .csv,
 NOTE: The extractors are now hard-coded into the script. Passing extractors as flags might be supported in the future.
 """
 
-from WFlib.tools.formatter import DistriPcapFormatter, DirectionExtractor, TimeExtractor
+from WFlib.tools.formatter import DistriPcapFormatter, DirectionExtractor, TimeExtractor, DeltaExtractor
 from WFlib.tools.capture import read_host_list
+from WFlib.tools.analyzer import CellFeatureExtractor
 import argparse
 
 if __name__ == '__main__':
@@ -17,17 +18,26 @@ if __name__ == '__main__':
     parser.add_argument('-l', '--length', type=int, default=5000, help="The length of the expect feature vectors")
     # parser.add_argument('-f', '--filter', type=str, default=None, help="The DISPLAY filter")
     parser.add_argument('-s', '--src', nargs='+', type=str, default="192.168.5.5", help="The source IP address")
-    parser.add_argument('-o', '--output_file', type=str, help="The path to the files to hold the output file")
-    parser.add_argument('-f', '--feature', default='direction', type=str, help="The name of the feature, current support [direction, time]")
+    parser.add_argument('-o', '--output_file', type=str, help="The path to the files to hold the output file, "
+                        "with --length 0 (raw), a name ending with .ragged dumps a ragged container instead of .json")
+    parser.add_argument('-f', '--feature', default='direction', type=str, help="The name of the feature, current support [direction, time, delta, cell]")
     parser.add_argument('-n', '--num_worker', type=int, default=6, help="Number of processes to extract features")
+    parser.add_argument('--columnar', action='store_true', help="Read each capture into columns with one tshark fields export")
+    parser.add_argument('--lazy', action='store_true', help="Stop reading each capture once the expected length is reached")
+    parser.add_argument('--keylog-name', type=str, default="keylog.txt", help="The key log file in each host directory to decrypt the HTTP/2 cells")
     args = parser.parse_args()
 
-    formatter = DistriPcapFormatter(length=args.length, num_worker=args.num_worker)
+    formatter = DistriPcapFormatter(length=args.length, num_worker=args.num_worker, columnar=args.columnar, lazy=args.lazy)
 
     if args.feature == "direction":
         extractor = DirectionExtractor(src=args.src)
     elif args.feature == "time":
         extractor = TimeExtractor(src=args.src)
+    elif args.feature == "delta":
+        extractor = DeltaExtractor()
+    elif args.feature == "cell":
+        # The signed sizes of the HTTP/2 cells, which decrypts each capture with its own pass.
+        extractor = CellFeatureExtractor(src=args.src, keylog_name=args.keylog_name)
     else:
         raise NotImplementedError(f"The feature {args.feature} is not supported yet, exit...")
     
@@ -0,0 +1,35 @@
+"""
+This file converts the .json files dumped by the raw extraction (length <= 0) into ragged containers, which
+could be memory-mapped and aligned by RaggedFormatter. Optionally, the features could be aligned to the given
+lengths and dumped into a .npz file at the same time.
+"""
+
+from WFlib.tools.formatter import json_to_ragged, RaggedFormatter
+from pathlib import Path
+import argparse
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', required=True, nargs='+', type=str, help="The .json files to convert")
+    parser.add_argument('-o', '--output_dir', default=None, type=str, help="The directory to hold the containers, next to the .json files by default")
+    parser.add_argument('-f', '--feature', nargs='+', default=[], type=str, help="The features to align, e.g., direction:5000 time:5000")
+    args = parser.parse_args()
+
+    lengths = dict()
+    for feature in args.feature:
+        name, length = feature.split(':')
+        lengths[name] = int(length)
+
+    for json_file in args.input:
+        json_path = Path(json_file)
+        output_dir = json_path.parent if args.output_dir is None else Path(args.output_dir)
+        container = output_dir / f"{json_path.stem}.ragged"
+        json_to_ragged(json_path, container)
+        print(f"Converted {json_path} to {container}")
+
+        if len(lengths) > 0:
+            formatter = RaggedFormatter()
+            formatter.load(container)
+            formatter.transform(**lengths)
+            formatter.dump(output_dir / f"{json_path.stem}.npz")
+            print(f"Aligned {container} to {output_dir / json_path.stem}.npz")
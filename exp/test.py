@@ -45,6 +45,8 @@ parser.add_argument("--log_path", type=str, default="./logs/", help="Log path")
 parser.add_argument("--checkpoints", type=str, default="./checkpoints/", help="Location of model checkpoints")
 parser.add_argument("--load_name", type=str, default="base", help="Name of the model file")
 parser.add_argument("--result_file", type=str, default="result", help="File to save test results")
+parser.add_argument("--inference_cache", type=str, default=None,
+                    help="Directory to cache the model outputs, default=<checkpoints>/<dataset>/<model>/inference_cache, 'none' to disable")
 
 # Parse arguments
 args = parser.parse_args()
@@ -93,6 +95,12 @@ else:
 model.load_state_dict(torch.load(os.path.join(ckp_path, f"{args.load_name}.pth"), map_location="cpu"))
 model.to(device)
 
+# The outputs of the checkpoint are shared by the evaluation methods and metrics of different runs
+if args.inference_cache is None:
+    args.inference_cache = os.path.join(ckp_path, "inference_cache")
+inference_cache = None if args.inference_cache == "none" else args.inference_cache
+engine = model_utils.InferenceEngine(model, device, batch_size=args.batch_size, cache_dir=inference_cache)
+
 # Evaluation
 model_utils.model_eval(
     model,
@@ -105,5 +113,6 @@ model_utils.model_eval(
     ckp_path,
     args.scenario,
     args.num_tabs,
-    device
+    device,
+    engine
 )
\ No newline at end of file
@@ -5,6 +5,7 @@ from WFlib.tools.analyzer import *
 from pathlib import Path
 import pyshark
 import os
+from tempfile import TemporaryDirectory
 
 baidu_proxied_file = "exp/test_dataset/realworld_dataset/www.baidu.com_proxied.pcapng"
 google_file = "exp/test_dataset/realworld_dataset/www.google.com.pcapng"
@@ -291,6 +292,30 @@ def test_seq_filter_01():
     result = seq_filter(seq, label_func=lambda x: 0 if x == 'x' else 1)
     assert target == result
 
+def test_seq_match_1():
+    """
+    This test covers the matches of seq_match, and the consistency with a naive implementation of seq_filter.
+    """
+    seq = ['x1', 'y1', 'x2', 'x3', 'x4', 'y2', 'y3', 'y4', 'y5']
+    result = list(seq_match(iter(seq), label_func=lambda x: 0 if x[0] == 'x' else 1))
+    assert result == [('x1', 'y1'), ('x2', 'y2'), ('x3', 'y3'), ('x4', 'y4'), ('y5', None)]
+
+    result = list(seq_match(iter(['y1', 'x1', 'y2', 'x2']), label_func=lambda x: 0 if x[0] == 'x' else 1))
+    assert result == [('y1', None), ('x1', 'y2'), ('x2', None)]
+
+    def naive_seq_filter(labels):
+        eliminated = set()
+        for i, label in enumerate(labels):
+            if label == 0:
+                j = next(j for j in range(i + 1, len(labels)) if labels[j] == 1 and j not in eliminated)
+                eliminated.add(j)
+        return [i for i in range(len(labels)) if i not in eliminated]
+
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        labels = list(rng.integers(0, 2, size=rng.integers(1, 20))) + [1] * 20
+        assert seq_filter(list(range(len(labels))), label_func=lambda i: labels[i]) == naive_seq_filter(labels)
+
 def test_seq_filter_02():
     """
     This test covers seq_filter with more complex labeling functions.
@@ -348,4 +373,131 @@ def test_match_segment_number_01():
 #                                 override_prefs={'tls.keylog_file': os.path.abspath(keylog_file)})
     
 #     reassemble_info = get_reassemble_info(cap)
-#     cap.close()
\ No newline at end of file
+#     cap.close()
+
+
+class FakeField():
+    def __init__(self, showname, value):
+        self.showname = showname
+        self.value = value
+
+    def get_default_value(self):
+        return self.value
+
+class FakeLayer():
+    def __init__(self, layer_name, **fields):
+        self.layer_name = layer_name
+        self.field_names = list(fields.keys())
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def get_field(self, name):
+        return getattr(self, name)
+
+def test_HTTP2CellExtractor_1():
+    """
+    This test covers the cells of a DATA layer (reassembled from 2 TLS records), an HTTP/2 frame and the preface.
+    """
+    extractor = HTTP2CellExtractor()
+    segments = FakeField("2 Reassembled TLS segments (1434 bytes): #101(1400), #104(34)", "#101(1400), #104(34)")
+    cells = [
+        extractor.layer_extract(FakeLayer("DATA", tls_segments=segments), 104),
+        extractor.layer_extract(FakeLayer("http2", length='72'), 104),
+        extractor.layer_extract(FakeLayer("http2", magic='PRI * HTTP/2.0'), 105),
+    ]
+    cells[0].direction, cells[1].direction, cells[2].direction = -1, -1, 1
+    assert [cell.size for cell in cells] == [1434, 81, 24]
+
+    arrays = cell_arrays(cells)
+    assert list(arrays.keys()) == cell_columns
+    assert list(arrays['frame']) == [104, 104, 105]
+    assert list(arrays['direction']) == [-1, -1, 1]
+    assert list(arrays['size']) == [1434, 81, 24]
+    assert list(arrays['segment_count']) == [2, 1, 1]
+    assert list(arrays['segment_frame']) == [101, 104, 104, 105]
+    assert list(arrays['segment_size']) == [1400, 34, 81, 24]
+
+    try:
+        extractor.layer_extract(FakeLayer("tls"), 104)
+        assert False
+    except ValueError:
+        pass
+
+def test_cell_sequence_1():
+    """
+    This test covers the cells of tcp.stream 0 of the apple capture, see test_seq_filter_02.
+    """
+    keylog_file = "exp/test_dataset/realworld_dataset/decryption/keylog.txt"
+    arrays = cell_sequence(apple_file, ["192.168.5.5"], keylog_file=keylog_file, display_filter="tcp.stream == 0")
+
+    assert len(arrays['frame']) > 0 and (arrays['segment_count'] >= 1).all()
+    assert arrays['segment_count'].sum() == len(arrays['segment_frame']) == len(arrays['segment_size'])
+    offsets = np.concatenate([[0], np.cumsum(arrays['segment_count'])])
+    for i in range(len(arrays['frame'])):
+        # Each cell is completed in its last segment.
+        assert arrays['segment_frame'][offsets[i + 1] - 1] == arrays['frame'][i]
+        assert arrays['segment_size'][offsets[i]:offsets[i + 1]].sum() == arrays['size'][i]
+    # Frame 104 holds one HTTP/2 frame within a record and one reassembled from multiple records.
+    segment_count = arrays['segment_count'][arrays['frame'] == 104]
+    assert len(segment_count) == 2 and segment_count[0] == 1 and segment_count[1] > 1
+
+def test_stream_statistics_1():
+    """
+    This test covers the single-pass counting, which should agree with test_capture_counter_2.
+    """
+    keylog_file = "exp/test_dataset/realworld_dataset/decryption/keylog.txt"
+    rows = stream_statistics(tiktok_file, ["lf16-cdn-tos.tiktokcdn-us.com"], keylog_file=keylog_file, custom_parameters=[])
+
+    assert rows == [(0, 'http3', 22, 42925), (0, 'quic', 80, 55878), (0, 'udp', 80, 56518)]
+
+def test_save_statistics_1():
+    table = {
+        'host': np.array(['www.apple.com', 'www.apple.com']),
+        'file': np.array(['www.apple.com_0.pcapng', 'www.apple.com_0.pcapng']),
+        'stream': np.array([0, 0]),
+        'protocol': np.array(['tcp', 'http2']),
+        'packets': np.array([32, 9]),
+        'bytes': np.array([11408, 3242]),
+    }
+    with TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "stats.npz")
+        save_statistics(table, file)
+        loaded = load_statistics(file)
+
+    assert list(loaded.keys()) == stat_columns
+    for column in stat_columns:
+        assert (loaded[column] == table[column]).all()
+
+class TinyModel(torch.nn.Module):
+    def __init__(self, num_classes):
+        super().__init__()
+        self.conv = torch.nn.Conv1d(1, 4, 5, padding=2)
+        self.fc = torch.nn.Linear(4 * 50, num_classes)
+
+    def forward(self, x):
+        return self.fc(torch.relu(self.conv(x)).flatten(1))
+
+def test_feature_attr_1():
+    """
+    This test covers the batched attribution, which should agree with attributing one class at a time, and
+    the attribution cache.
+    """
+    torch.manual_seed(0)
+    num_classes = 5
+    X = torch.randn(num_classes * 12, 1, 50)
+    y = torch.arange(num_classes).repeat_interleave(12)
+    model = TinyModel(num_classes)
+
+    target = feature_attr(model, "DeepLiftShap", X, y, num_classes)
+    result = feature_attr(model, "DeepLiftShap", X, y, num_classes, classes_per_batch=3)
+    assert target.shape == (num_classes,) and np.allclose(target, result, atol=1e-5)
+
+    with TemporaryDirectory() as tmp_dir:
+        cache = AttributionCache(tmp_dir)
+        result = feature_attr(model, "DeepLiftShap", X, y, num_classes, classes_per_batch=3, cache=cache)
+        assert len(os.listdir(tmp_dir)) == 1 and np.allclose(target, result, atol=1e-5)
+
+        # The cached results are reused, while another checkpoint misses the cache.
+        assert (feature_attr(model, "DeepLiftShap", X, y, num_classes, cache=cache) == result).all()
+        feature_attr(TinyModel(num_classes), "DeepLiftShap", X, y, num_classes, classes_per_batch=5, cache=cache)
+        assert len(os.listdir(tmp_dir)) == 2
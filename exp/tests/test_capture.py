@@ -1,6 +1,12 @@
 from WFlib.tools.capture import *
 from WFlib.tools.analyzer import packet_count
 import pyshark
+import contextlib
+import tempfile
+import os
+import time
+import threading
+import socket
 
 
 baidu_proxied_file = "exp/test_dataset/realworld_dataset/www.baidu.com_proxied.pcapng"
@@ -153,4 +159,354 @@ def test_h3data_SNI_intersect_1():
 
     target = {'0'}
 
-    assert udp_stream_numbers == target
\ No newline at end of file
+    assert udp_stream_numbers == target
+
+
+class FakeDriver(object):
+    CONTEXT_CHROME = "chrome"
+
+    def __init__(self, keylog_file):
+        self.keylog_file = keylog_file
+        self.window_handles = ["main"]
+        self.switch_to = self
+        self.cleared = 0
+        self.closed = False
+
+    def window(self, handle):
+        pass
+
+    def get(self, url):
+        with open(self.keylog_file, 'a') as f:
+            f.write(f"CLIENT_RANDOM {url}\n")
+
+    @contextlib.contextmanager
+    def context(self, context):
+        yield
+
+    def execute_async_script(self, script):
+        self.cleared += 1
+
+    def quit(self):
+        self.closed = True
+
+class FakeBrowserPool(BrowserPool):
+    def _launch(self):
+        keylog_file = os.path.join(self._keylog_dir, f"keylog_{self._launched}.txt")
+        self._launched += 1
+        with open(keylog_file, 'w') as f:
+            f.write("CLIENT_RANDOM startup\n")
+        browser = PooledBrowser(FakeDriver(keylog_file), keylog_file)
+        self._browsers.append(browser)
+        return browser
+
+def test_BrowserPool_1():
+    pool = FakeBrowserPool(size=1, max_uses=2)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        keylog_a = os.path.join(tmp_dir, "a.txt")
+        keylog_b = os.path.join(tmp_dir, "b.txt")
+
+        with pool.lease(keylog_file=keylog_a) as driver_1:
+            driver_1.get("a")
+        assert driver_1.cleared == 1 and not driver_1.closed
+
+        with pool.lease(keylog_file=keylog_b) as driver_2:
+            driver_2.get("b")
+        # Recycled after max_uses visits, by replenish only.
+        assert driver_2 is driver_1 and not driver_1.closed
+        pool.replenish()
+        assert driver_1.closed and pool._launched == 2
+
+        with pool.lease(keylog_file=keylog_a) as driver_3:
+            driver_3.get("a")
+        assert driver_3 is not driver_1
+
+        # The startup keys are dropped, and each visit only gets its own keys.
+        with open(keylog_a) as f:
+            assert f.read() == "CLIENT_RANDOM a\nCLIENT_RANDOM a\n"
+        with open(keylog_b) as f:
+            assert f.read() == "CLIENT_RANDOM b\n"
+
+    pool.close()
+    assert driver_3.closed
+
+class EventDriver(FakeDriver):
+    def __init__(self, keylog_file, events):
+        super().__init__(keylog_file)
+        self.events = events
+
+    def get(self, url):
+        super().get(url)
+        if url != "about:blank":
+            self.events.append(f"get {url}")
+
+    def quit(self):
+        super().quit()
+        self.events.append("quit")
+
+class EventBrowserPool(FakeBrowserPool):
+    def __init__(self, events, **kwargs):
+        self.events = events
+        super().__init__(**kwargs)
+
+    def _launch(self):
+        browser = super()._launch()
+        browser.driver = EventDriver(browser.keylog_file, self.events)
+        self.events.append("launch")
+        return browser
+
+def test_BrowserPool_2():
+    """
+    A recycled browser should be quit and relaunched only after the capture, i.e., once stop_event is set, such
+    that its shutdown and startup traffic is not captured.
+    """
+    events = []
+    pool = EventBrowserPool(events, size=1, max_uses=1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        capture("https://www.example.com", "lo", os.path.join(tmp_dir, "a.pcapng"), timeout=0, idle_window=None,
+                browser_pool=pool, ready_timeout=.1, quiesce_timeout=.1)
+        events.append("stopped")
+        pool.replenish()
+
+    assert events == ["launch", "get https://www.example.com", "stopped", "quit", "launch"]
+    pool.close()
+
+class FakeLoadingDriver(object):
+    def __init__(self, load_time):
+        self.start = time.time()
+        self.load_time = load_time
+
+    def execute_script(self, script):
+        elapsed = time.time() - self.start
+        if elapsed < self.load_time:
+            return -1
+        return (elapsed - self.load_time) * 1000
+
+def test_wait_for_page_load_1():
+    import multiprocessing
+    driver = FakeLoadingDriver(load_time=.2)
+    last_packet = multiprocessing.Value('d', time.time())
+
+    # The page is loaded and the network is idle.
+    elapsed = wait_for_page_load(driver, timeout=5, idle_window=.3, last_packet=last_packet, poll_interval=.05)
+    assert .5 <= elapsed < 1.5
+
+    # The network keeps busy, the waiting stops at timeout.
+    def keep_busy():
+        while not done.is_set():
+            last_packet.value = time.time()
+            time.sleep(.05)
+    done = threading.Event()
+    busy_thread = threading.Thread(target=keep_busy)
+    busy_thread.start()
+    elapsed = wait_for_page_load(driver, timeout=1, idle_window=.3, last_packet=last_packet, poll_interval=.05)
+    done.set()
+    busy_thread.join()
+    assert 1 <= elapsed < 1.5
+
+def test_read_host_list_1():
+    with tempfile.NamedTemporaryFile('w', suffix=".txt", delete=False) as f:
+        f.write("# comment\nwww.baidu.com\nhttps://www.google.com # inline\nwww.baidu.com\n\nwww.google.com\n")
+    host_list = read_host_list(f.name)
+    os.remove(f.name)
+
+    assert host_list == ["www.baidu.com", "www.google.com"]
+
+io_stat_output = """
+===================================================================
+| IO Statistics                                                   |
+|                                                                 |
+| Duration: 12.345678 secs                                        |
+| Interval: 12.345678 secs                                        |
+|                                                                 |
+| Col 1: Frames and bytes                                         |
+|-----------------------------------------------------------------|
+|                |1                |                              |
+| Interval       | Frames |  Bytes |                              |
+|---------------------------------|                              |
+|  0.000 <> 12.346 |    150 | 123456 |                            |
+===================================================================
+"""
+
+def test_QualityGate_1():
+    stats = parse_io_stat(io_stat_output)
+    assert stats == {'packets': 150, 'bytes': 123456, 'duration': 12.345678}
+
+    gate = QualityGate(min_packets=100, min_duration=10.)
+    assert gate.check({'error': None}, stats) is None
+    assert gate.check({'error': "Timeout"}, stats).startswith("browser error")
+    assert gate.check({'error': None}, {**stats, 'packets': 20}).startswith("too few packets")
+    assert gate.check({'error': None}, {**stats, 'duration': 3.}).startswith("too short")
+
+def test_RetryScheduler_1():
+    scheduler = RetryScheduler([("a.com", 0), ("b.com", 0), ("c.com", 0)], max_attempts=2, backoff=0.)
+    visited = []
+    for host, i, attempt in scheduler:
+        visited.append((host, attempt))
+        if host == "a.com":
+            scheduler.retry(host, i, attempt)
+
+    # The retry of a.com is interleaved with the other hosts (without backoff, right after the next one, but never
+    # right after its own failure), and stops at max_attempts.
+    assert visited == [("a.com", 0), ("b.com", 0), ("a.com", 1), ("c.com", 0)]
+
+def test_RetryScheduler_2():
+    """
+    A retry runs once its backoff has elapsed, in between the remaining jobs rather than after all of them.
+    """
+    now = [0.]
+    jobs = [(host, 0) for host in ["a.com", "b.com", "c.com", "d.com", "e.com"]]
+    scheduler = RetryScheduler(jobs, max_attempts=2, backoff=15., clock=lambda: now[0])
+    visited = []
+    for host, i, attempt in scheduler:
+        visited.append((host, attempt))
+        now[0] += 10.  # Each visit takes 10 seconds
+        if host == "a.com":
+            scheduler.retry(host, i, attempt)
+
+    # a.com fails at 10s and is ready again at 25s, i.e., right after c.com (20s-30s).
+    assert visited == [("a.com", 0), ("b.com", 0), ("c.com", 0), ("a.com", 1), ("d.com", 0), ("e.com", 0)]
+
+def test_CaptureProfile_1():
+    assert FULL_PROFILE.command("eth0", "tcp", "a.pcapng") == \
+        ['tshark', '-i', 'eth0', '-f', 'tcp', '-w', 'a.pcapng', '-P', '-l', '-T', 'fields', '-e', 'frame.number']
+
+    profile = CaptureProfile(snaplen=128, use_dumpcap=True, buffer_size=64)
+    assert profile.command("eth0", "tcp", "a.pcapng") == \
+        ['dumpcap', '-i', 'eth0', '-f', 'tcp', '-w', 'a.pcapng', '-s', '128', '-B', '64', '-q']
+
+def test_wait_for_port_1():
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        port = server.getsockname()[1]
+
+        # Not listening yet
+        try:
+            wait_for_port("127.0.0.1", port, timeout=.2)
+            assert False
+        except TimeoutError:
+            pass
+
+        server.listen()
+        assert wait_for_port("127.0.0.1", port, timeout=1.) < 1.
+
+def test_wait_for_quiescence_1():
+    header = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+    established = "   0: 0100000A:A000 08080808:01BB 01 00000000:00000000 00:00000000 00000000     0        0 1\n"
+    loopback = "   1: 0100007F:A001 0100007F:1F90 01 00000000:00000000 00:00000000 00000000     0        0 2\n"
+    time_wait = "   2: 0100000A:A002 08080808:01BB 06 00000000:00000000 00:00000000 00000000     0        0 3\n"
+
+    with tempfile.TemporaryDirectory() as proc_net:
+        with open(os.path.join(proc_net, "tcp"), 'w') as f:
+            f.write(header + established + loopback + time_wait)
+
+        assert active_connections(proc_net) == {('tcp', '0100000A:A000', '08080808:01BB')}
+        # The connection is still open
+        assert wait_for_quiescence(set(), timeout=.3, proc_net=proc_net) >= .3
+        # ... unless it is in the baseline.
+        assert wait_for_quiescence(active_connections(proc_net), timeout=.3, proc_net=proc_net) < .3
+
+        with open(os.path.join(proc_net, "tcp"), 'w') as f:
+            f.write(header + loopback + time_wait)
+        assert wait_for_quiescence(set(), timeout=.3, proc_net=proc_net) < .3
+
+class FakeConnectionDriver(FakeDriver):
+    """
+    A browser keeping the connection of the visit open until the reset closes the idle connections.
+    """
+    header = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+    established = "   0: 0100000A:A000 08080808:01BB 01 00000000:00000000 00:00000000 00000000     0        0 1\n"
+
+    def __init__(self, keylog_file, proc_net):
+        super().__init__(keylog_file)
+        self.proc_net = proc_net
+
+    def get(self, url):
+        super().get(url)
+        if url != "about:blank":  # Leaving the page does not close the connection.
+            with open(os.path.join(self.proc_net, "tcp"), 'w') as f:
+                f.write(self.header + self.established)
+
+    def execute_async_script(self, script):
+        super().execute_async_script(script)
+        if "net:prune-all-connections" in script:
+            with open(os.path.join(self.proc_net, "tcp"), 'w') as f:
+                f.write(self.header)
+
+class FakeConnectionPool(FakeBrowserPool):
+    def __init__(self, proc_net, **kwargs):
+        self.proc_net = proc_net
+        super().__init__(**kwargs)
+
+    def _launch(self):
+        browser = super()._launch()
+        browser.driver = FakeConnectionDriver(browser.keylog_file, self.proc_net)
+        return browser
+
+def test_wait_for_quiescence_2():
+    """
+    A pooled browser is not quit after the visit, the reset should close its connections such that the capture
+    does not wait until the timeout.
+    """
+    with tempfile.TemporaryDirectory() as proc_net:
+        with open(os.path.join(proc_net, "tcp"), 'w') as f:
+            f.write(FakeConnectionDriver.header)
+        pool = FakeConnectionPool(proc_net, size=1, max_uses=5)
+        baseline = active_connections(proc_net)
+
+        with pool.lease() as driver:
+            driver.get("https://www.example.com")
+            # The connection of the visit is open until the browser is given back to the pool.
+            assert wait_for_quiescence(baseline, timeout=.3, proc_net=proc_net) >= .3
+        assert not driver.closed
+        assert wait_for_quiescence(baseline, timeout=.3, proc_net=proc_net) < .3
+        pool.close()
+
+fake_proxy_script = """
+import socket, sys, time
+keylog, port = sys.argv[1], int(sys.argv[2])
+server = socket.socket()
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind(("127.0.0.1", port))
+server.listen()
+while True:
+    conn, _ = server.accept()
+    conn.close()
+    with open(keylog, 'a') as f:
+        f.write("CLIENT_RANDOM connection\\n")
+"""
+
+def test_ProxySupervisor_1():
+    import sys
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # The keylog file persists across runs, the keys of the earlier runs should not be moved to the first host.
+        proxy_keylog = os.path.join(tmp_dir, "proxy_keylog.txt")
+        with open(proxy_keylog, 'w') as f:
+            f.write("CLIENT_RANDOM earlier_run\n")
+
+        proxy = ProxySupervisor(binary=sys.executable, args=('-c', fake_proxy_script, '{keylog}', str(port)), port=port,
+                                keylog_file=proxy_keylog)
+        assert not proxy.healthy()
+        proxy.ensure()
+        assert proxy.healthy()  # The health check itself logs a key in the fake proxy
+        time.sleep(.2)
+
+        keylog_a = os.path.join(tmp_dir, "a.txt")
+        assert proxy.rotate(keylog_a) > 0
+        assert proxy.rotate(keylog_a) == 0
+        with open(keylog_a) as f:
+            assert "earlier_run" not in f.read()
+
+        # Restart only on failure
+        proxy.ensure()
+        assert proxy.restarts == 0
+        proxy._process.kill()
+        proxy._process.wait()
+        proxy.ensure()
+        assert proxy.restarts == 1 and proxy.healthy()
+
+        proxy.close()
+        assert not proxy.healthy()
@@ -0,0 +1,190 @@
+from WFlib.tools.dissection import *
+from WFlib.tools.analyzer import *
+import os
+import sys
+import shutil
+import subprocess
+import pyshark
+import numpy as np
+from tempfile import TemporaryDirectory
+
+
+apple_file = "exp/test_dataset/realworld_dataset/decryption/www.apple.com.pcapng"
+keylog_file = "exp/test_dataset/realworld_dataset/decryption/keylog.txt"
+
+def ragged(*frames):
+    lengths = [len(frame) for frame in frames]
+    return np.array([value for frame in frames for value in frame], dtype=np.int64), \
+        np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+def fake_table():
+    """
+    Frame 1: TCP with 2 TLS records, the HTTP/2 preface and a DATA frame;
+    Frame 2: UDP with 2 QUIC packets and an HTTP/3 DATA frame (1-byte type, 2-byte length);
+    Frame 3: UDP with a QUIC packet followed by coalesced padding.
+    """
+    columns = {
+        'frame': np.array([1, 2, 3]),
+        'tcp_stream': np.array([0, -1, -1]),
+        'udp_stream': np.array([-1, 0, 1]),
+        'tcp_bytes': np.array([100, 0, 0]),
+        'udp_bytes': np.array([0, 1208, 1208]),
+        'quic_padded': np.array([False, False, True]),
+    }
+    for name, values in {
+        'tls_record_length': ragged([30, 50], [], []),
+        'http2_type': ragged([-1, 0], [], []),
+        'http2_length': ragged([0, 10], [], []),
+        'http2_streamid': ragged([0, 1], [], []),
+        'quic_packet_length': ragged([], [600, 500], [300]),
+        'http3_frame_type': ragged([], [0], []),
+        'http3_frame_length': ragged([], [400], []),
+        'http3_bytes': ragged([], [402, 1], []),
+    }.items():
+        columns[f"{name}.values"], columns[f"{name}.offsets"] = values
+    return DissectionTable(columns)
+
+def test_column_count_1():
+    table = fake_table()
+    assert list(TCPByteCounter().column_count(table)) == [100, 0, 0]
+    assert list(TLSByteCounter().column_count(table)) == [88, 0, 0]
+    assert list(HTTP2ByteCounter().column_count(table)) == [24 + 19, 0, 0]
+    assert list(UDPByteCounter().column_count(table)) == [0, 1208, 1208]
+    assert list(QUICByteCounter().column_count(table)) == [0, 1100, 1200]
+    assert list(HTTP3ByteCounter().column_count(table)) == [0, 403, 0]
+    assert list(table.data_frames()) == [True, True, False]
+
+    counter = CaptureCounter(UDPByteCounter(), QUICByteCounter(), HTTP3ByteCounter())
+    result = counter.count_table(table, mask=table['udp_stream'] == 0)
+    assert result == {'udp': [1, 1208], 'quic': [1, 1100], 'http3': [1, 403]}
+
+    rows = table_stream_statistics(table, {'0'}, {'0', '1'}, default_stat_counters())
+    assert rows == [(0, 'http2', 1, 43), (0, 'tcp', 1, 100), (0, 'tls', 1, 88),
+                    (0, 'http3', 1, 403), (0, 'quic', 1, 1100), (0, 'udp', 1, 1208)]
+
+def test_DissectionCache_1():
+    with TemporaryDirectory() as tmp_dir:
+        capture_file, keylog = os.path.join(tmp_dir, "a.pcapng"), os.path.join(tmp_dir, "a.keylog")
+        with open(capture_file, 'wb') as f:
+            f.write(b"capture")
+        with open(keylog, 'w') as f:
+            f.write("CLIENT_RANDOM aa bb\n")
+
+        cache = DissectionCache(os.path.join(tmp_dir, "cache"))
+        key = cache.key(capture_file, keylog)
+        assert key != cache.key(capture_file) and key == cache.key(capture_file, keylog)
+        with open(keylog, 'a') as f:
+            f.write("CLIENT_RANDOM cc dd\n")
+        assert key != cache.key(capture_file, keylog)
+
+        # A cached table is loaded without dissection.
+        fake_table().save(cache.path(capture_file, keylog))
+        table = cache.load(capture_file, keylog)
+        assert len(table) == 3 and list(table.ragged('http2_type')[0]) == [-1, 0]
+
+def test_DissectionCache_2():
+    """
+    A failed export should raise instead of caching an empty table.
+    """
+    with TemporaryDirectory() as tmp_dir:
+        capture_file = os.path.join(tmp_dir, "a.pcapng")
+        with open(capture_file, 'wb') as f:
+            f.write(b"not a capture")
+
+        cache = DissectionCache(os.path.join(tmp_dir, "cache"), backend='fields')
+        for keylog in [None, os.path.join(tmp_dir, "missing.keylog")]:
+            try:
+                cache.load(capture_file, keylog)
+                assert False
+            except (RuntimeError, FileNotFoundError):
+                pass
+        assert os.listdir(os.path.join(tmp_dir, "cache")) == []
+
+def test_DissectionCache_3():
+    """
+    The key of a capture should stay the same after its minimal keylog is regenerated, e.g., by another process
+    (with another string hash seed) once keylog.txt is appended.
+    """
+    with TemporaryDirectory() as tmp_dir:
+        capture_file = shutil.copy(apple_file, tmp_dir)
+        cache = DissectionCache(os.path.join(tmp_dir, "cache"), backend='fields')
+        script = "import sys; from WFlib.tools.keylog import KeylogIndex; KeylogIndex(sys.argv[1]).minimal_keylog(sys.argv[2])"
+
+        keys = set()
+        for seed in ["1", "2", "3"]:
+            minimal_keylog = os.path.join(tmp_dir, "www.apple.com.keylog")
+            if os.path.exists(minimal_keylog):
+                os.remove(minimal_keylog)
+            subprocess.run([sys.executable, "-c", script, keylog_file, capture_file], check=True,
+                           env=dict(os.environ, PYTHONHASHSEED=seed))
+            keys.add(cache.key(capture_file, minimal_keylog))
+        assert len(keys) == 1
+
+def test_stream_statistics_fields_1():
+    """
+    The fields-export backend has no HTTP/3 column, the default counters should leave HTTP/3 out rather than
+    fail on every file, and an explicit HTTP/3 counter should be rejected up front.
+    """
+    with TemporaryDirectory() as tmp_dir:
+        cache = DissectionCache(tmp_dir, backend='fields')
+        assert 'http3' not in [counter.name for counter in default_stat_counters(cache)]
+        assert 'http3' in [counter.name for counter in default_stat_counters(DissectionCache(tmp_dir))]
+        try:
+            stream_statistics(apple_file, ["is1-ssl.mzstatic.com"], counters=[HTTP3ByteCounter()], cache=cache)
+            assert False
+        except ValueError:
+            pass
+
+def test_dissect_1():
+    """
+    The cached table should agree with test_capture_counter_1.
+    """
+    table = dissect(apple_file, keylog_file=keylog_file, custom_parameters=[])
+    counter = CaptureCounter(TCPByteCounter(), TLSByteCounter(), HTTP2ByteCounter())
+    result = counter.count_table(table, mask=table['tcp_stream'] == 2)
+
+    assert result == {'tcp': [32, 11408], 'tls': [16, 10347], 'http2': [9, 3242]}
+
+def test_parse_export_rows_1():
+    """
+    The exported rows of the frames in fake_table, which should lead to the same counts except for HTTP/3.
+    """
+    rows = [
+        "1\t0\t\t80\t20\t\t\t30,50\tPRI * HTTP/2.0\\r\\n\\r\\nSM\\r\\n\\r\\n\t0\t10\t1\t\t\t\n",
+        "2\t\t0\t\t\t1208\t\t\t\t\t\t\t600,500\t0x0000000000000000\t400\n",
+        "3\t\t1\t\t\t1208\t0000\t\t\t\t\t\t300\t\t\n",
+    ]
+    table = DissectionTable(parse_export_rows(rows))
+    target = fake_table()
+    for name in frame_columns:
+        assert (table[name] == target[name]).all()
+    for name in ragged_columns[:-1]:
+        for values, target_values in zip(table.ragged(name), target.ragged(name)):
+            assert (values == target_values).all()
+
+    counter = CaptureCounter(TCPByteCounter(), TLSByteCounter(), HTTP2ByteCounter(), UDPByteCounter(), QUICByteCounter())
+    assert counter.count_table(table) == counter.count_table(target)
+    assert list(table.data_frames()) == [True, True, False]
+    try:
+        HTTP3ByteCounter().column_count(table)
+        assert False
+    except ValueError:
+        pass
+
+    # The chunks are concatenated into the same table.
+    chunked = DissectionTable(concat_columns([parse_export_rows(rows[:1]), parse_export_rows(rows[1:])]))
+    for name in table._columns:
+        assert (chunked[name] == table[name]).all()
+
+def test_count_columns_1():
+    """
+    The fields export should agree with the per-packet counters, which are the reference implementation.
+    """
+    counter = CaptureCounter(TCPByteCounter(), TLSByteCounter(), HTTP2ByteCounter(), UDPByteCounter(), QUICByteCounter())
+    for file in [apple_file, "exp/test_dataset/realworld_dataset/decryption/www.tiktok.com.pcapng"]:
+        cap = pyshark.FileCapture(input_file=file, custom_parameters=["-2"],
+                                  override_prefs={'tls.keylog_file': os.path.abspath(keylog_file)})
+        target = counter.count(cap)
+        cap.close()
+
+        assert counter.count_columns(file, keylog_file=keylog_file) == target
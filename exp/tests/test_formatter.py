@@ -417,6 +417,228 @@ def test_TimeExtractor_2():
 
     loaded_data.close()
 
+def test_DeltaExtractor_1():
+    """
+    This test covers extracting the delta time feature per packet, where the delta is taken between
+    consecutive displayed packets.
+    """
+    extractor = DeltaExtractor()
+
+    formatter = PcapFormatter(length=6, display_filter="tcp.stream != 1")
+
+    formatter.load(google_file)
+    formatter.transform("www.google.com", 0, extractor)
+
+    formatter.load(google_file)
+    formatter.transform("www.google.com", 0, extractor)
+
+    target = np.array([[0, 0.019226, 5.542842, 0.000734, 0, 0]] * 2)
+    assert np.allclose(np.stack(formatter._buf['delta']), target)
+
+def test_batch_extract_1():
+    """
+    This test covers the columnar extractors over hand-made columns, without reading any capture.
+    """
+    columns = {'time': np.array([0., 0.5, 0.75, 2.]),
+               'src': np.array(["192.168.5.5", "1.1.1.1", "10.4.0.3", "1.1.1.1"]),
+               'dst': np.array(["1.1.1.1", "192.168.5.5", "1.1.1.1", "10.4.0.3"]),
+               'length': np.array([60, 1500, 60, 1500]),
+               'tcp_stream': np.array([0, 0, 1, 1]),
+               'udp_stream': np.array([-1, -1, -1, -1])}
+
+    direction = DirectionExtractor(src=["192.168.5.5", "10.4.0.3"]).batch_extract(columns)
+    assert np.all(direction == np.array([1, -1, 1, -1]))
+
+    time = TimeExtractor().batch_extract(columns)
+    assert np.all(time == np.array([0., 0.5, 0.75, 2.]))
+
+    time = TimeExtractor(src="192.168.5.5").batch_extract(columns)
+    assert np.all(time == np.array([0., -0.5, -0.75, -2.]))
+
+    delta = DeltaExtractor().batch_extract(columns)
+    assert np.all(delta == np.array([0., 0.5, 0.25, 1.25]))
+
+    empty = {k: v[:0] for k, v in columns.items()}
+    assert DeltaExtractor().batch_extract(empty).shape == (0,)
+
+def test_parse_packet_columns_1():
+    """
+    This test covers parsing the rows exported by tshark into aligned columns, including IPv6 and non-TCP packets.
+    """
+    lines = ["0.000000000\t192.168.5.5\t\t1.1.1.1\t\t66\t0\t\n",
+             "0.019226000\t\tfe80::1\t\tfe80::2\t1292\t\t3\n"]
+    columns = parse_packet_columns(lines)
+
+    assert np.all(columns['time'] == np.array([0., 0.019226]))
+    assert np.all(columns['src'] == np.array(["192.168.5.5", "fe80::1"]))
+    assert np.all(columns['dst'] == np.array(["1.1.1.1", "fe80::2"]))
+    assert np.all(columns['length'] == np.array([66, 1292]))
+    assert np.all(columns['tcp_stream'] == np.array([0, -1]))
+    assert np.all(columns['udp_stream'] == np.array([-1, 3]))
+
+def test_read_packet_columns_1():
+    """
+    A failed export, e.g., of a missing file, should raise with the error message of tshark, rather than result in
+    empty columns (and all-zero features after align_feature).
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            read_packet_columns(os.path.join(tmp_dir, "missing.pcapng"))
+            assert False
+        except RuntimeError as e:
+            assert "tshark exited" in str(e)
+
+    # Nor should a failure within the first max_packets rows be taken for the early termination.
+    try:
+        read_packet_columns("exp/test_dataset/simple_dataset/simple_pcap_01.pcapng", "invalid filter (", max_packets=10)
+        assert False
+    except RuntimeError as e:
+        assert "tshark exited" in str(e)
+
+def test_PcapFormatter_columnar_1():
+    """
+    This test covers the columnar mode, whose results should be the same as the per-packet mode (test_PcapFormatter_3).
+    """
+    formatter = PcapFormatter(length=10, columnar=True)
+
+    extractor = DirectionExtractor(src="192.168.5.5")
+
+    formatter.load("exp/test_dataset/simple_dataset/simple_pcap_01.pcapng")
+    formatter.transform("www.baidu.com", 0, extractor)
+
+    formatter.load("exp/test_dataset/simple_dataset/simple_pcap_02.pcapng")
+    formatter.transform("www.baidu.com", 0, extractor)
+
+    formatter.load("exp/test_dataset/simple_dataset/simple_pcap_03.pcapng")
+    formatter.transform("www.zhihu.com", 1, extractor)
+
+    # Create an in-memory bytes buffer
+    buffer = io.BytesIO()
+
+    formatter.dump(buffer)
+
+    buffer.seek(0)  # Move to the start of the buffer
+    loaded_data = np.load(buffer)
+
+    target = {"hosts" : np.array(["www.baidu.com", "www.zhihu.com"]), 
+              "labels": np.array([0, 0, 1]), 
+              "direction": np.array([
+                  [1, 1, 1, 1, 1, 1, -1, 1, 1, -1],
+                  [1, 1, -1, 1, 1, 0, 0, 0, 0, 0],
+                  [-1, -1, 1, -1, 1, -1, 1, 1, -1, -1]
+                  ])}
+    for k, v in loaded_data.items():
+        assert np.all(target[k] == v)
+
+    loaded_data.close()
+
+def test_PcapFormatter_columnar_2():
+    """
+    This test covers the columnar mode with directional timestamps, compared against test_TimeExtractor_2.
+    """
+    extractor = TimeExtractor(src=["192.168.5.5", "10.4.0.3"])
+
+    formatter = PcapFormatter(length=5, columnar=True)
+
+    formatter.load(google_file)
+    formatter.transform("www.google.com", 0, extractor)
+
+    formatter.load(apple_file)
+    formatter.transform("www.apple.com", 1, extractor)
+
+    formatter.load(tiktok_file)
+    formatter.transform("www.tiktok.com", 2, extractor)
+
+    target = np.array([[0.000000, 0.019226, 2.936487, -3.055774, -3.055790],
+                       [0.000000000, 0.000096556, -0.001713993, 0.001745523, -0.001829495],
+                       [0.000000000, -0.001680410, 0.001703165, 0.002265464, 0.002269337]])
+    assert np.allclose(np.stack(formatter._buf['time']), target)
+
+def test_PcapFormatter_lazy_1():
+    """
+    This test covers the lazy mode, whose results should be the same as the eager mode (test_PcapFormatter_3).
+    """
+    for columnar in [False, True]:
+        formatter = PcapFormatter(length=10, columnar=columnar, lazy=True)
+
+        extractor = DirectionExtractor(src="192.168.5.5")
+
+        formatter.load("exp/test_dataset/simple_dataset/simple_pcap_01.pcapng")
+        formatter.transform("www.baidu.com", 0, extractor)
+
+        formatter.load("exp/test_dataset/simple_dataset/simple_pcap_02.pcapng")
+        formatter.transform("www.baidu.com", 0, extractor)
+
+        formatter.load("exp/test_dataset/simple_dataset/simple_pcap_03.pcapng")
+        formatter.transform("www.zhihu.com", 1, extractor)
+
+        target = np.array([
+            [1, 1, 1, 1, 1, 1, -1, 1, 1, -1],
+            [1, 1, -1, 1, 1, 0, 0, 0, 0, 0],
+            [-1, -1, 1, -1, 1, -1, 1, 1, -1, -1]
+            ])
+        assert np.all(np.stack(formatter._buf['direction']) == target)
+
+def test_PcapFormatter_lazy_2():
+    """
+    This test covers that the lazy mode stops iterating over the capture once the length is reached.
+    """
+    class FakePacket(object):
+        def __init__(self, source, time):
+            self.source = source
+            self.time = time
+
+    class FakeCapture(object):
+        def __init__(self, num):
+            self.consumed = 0
+            self.closed = False
+            self.num = num
+
+        def __iter__(self):
+            for i in range(self.num):
+                self.consumed += 1
+                yield FakePacket("192.168.5.5" if i % 2 == 0 else "1.1.1.1", i * 0.5)
+
+        def close(self):
+            self.closed = True
+
+    extractors = [DirectionExtractor(src="192.168.5.5"), TimeExtractor()]
+
+    formatter = PcapFormatter(length=3, lazy=True)
+    cap = FakeCapture(100)
+    tmp_buf = formatter._extract(cap, None, *extractors)
+    assert cap.consumed == 3 and cap.closed
+    assert tmp_buf['direction'] == [1, -1, 1] and tmp_buf['time'] == [0, 0.5, 1.0]
+
+    formatter = PcapFormatter(length=3)
+    cap = FakeCapture(100)
+    formatter._extract(cap, None, *extractors)
+    assert cap.consumed == 100 and cap.closed
+
+    # The lazy mode does not apply to the raw mode.
+    formatter = PcapFormatter(length=0, lazy=True)
+    cap = FakeCapture(100)
+    formatter._extract(cap, None, *extractors)
+    assert cap.consumed == 100
+
+def test_PcapFormatter_capture_level_1():
+    """
+    This test covers the capture-level extractors, which are handed the file instead of the packets.
+    """
+    class FileSizeExtractor(Extractor):
+        def capture_extract(self, file, display_filter=None):
+            return np.array([os.path.getsize(file)])
+
+    extractor = FileSizeExtractor(name="file_size")
+    assert extractor.capture_level and not DirectionExtractor(src="192.168.5.5").capture_level
+
+    file = "exp/test_dataset/simple_dataset/simple_pcap_01.pcapng"
+    formatter = PcapFormatter(length=2)
+    formatter.load(file)
+    formatter.transform("www.baidu.com", 0, extractor)
+
+    assert np.all(formatter._buf['file_size'][0] == np.array([os.path.getsize(file), 0]))
+
 def test_JsonFormatter_1():
     """
     This test covers reading a .json file, and extract the direction feature, truncate/pad it to given length,
@@ -507,6 +729,101 @@ def test_JsonFormatter_2():
     if not delete_file:
         os.unlink(filename)
 
+def test_RaggedFormatter_1():
+    """
+    This test covers dumping raw features into a ragged container, and truncating/padding them with RaggedFormatter.
+    The results should be the same as test_JsonFormatter_1.
+    """
+    pcap_formatter = PcapFormatter(display_filter='tls')
+
+    extractor = DirectionExtractor(src="192.168.5.5")
+    
+    pcap_formatter.load("exp/test_dataset/simple_dataset/simple_pcap_01.pcapng")
+    pcap_formatter.transform("www.baidu.com", 0, extractor)
+
+    pcap_formatter.load("exp/test_dataset/simple_dataset/simple_pcap_02.pcapng")
+    pcap_formatter.transform("www.baidu.com", 0, extractor)
+
+    pcap_formatter.load("exp/test_dataset/simple_dataset/simple_pcap_03.pcapng")
+    pcap_formatter.transform("www.zhihu.com", 1, extractor)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        container = os.path.join(temp_dir, "raw.ragged")
+        pcap_formatter.dump(container)
+
+        ragged_formatter = RaggedFormatter()
+        ragged_formatter.load(container)
+        ragged_formatter.transform(direction=10)
+
+        buffer = io.BytesIO()
+        ragged_formatter.dump(buffer)
+        buffer.seek(0)  # Move to the start of the buffer
+        loaded_data = np.load(buffer)
+
+        target = {"hosts" : np.array(["www.baidu.com", "www.zhihu.com"]), 
+                "labels": np.array([0, 0, 1]), 
+                "direction": np.array([
+                    [1, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+                    [1, 1, 0, 0, 0, 0, 0, 0, 0, 0],
+                    [-1, -1, -1, 1, -1, -1, 0, 0, 0, 0]
+                    ])}
+        
+        for k, v in loaded_data.items():
+            assert np.all(target[k] == v)
+
+        loaded_data.close()
+
+def test_RaggedFormatter_2():
+    """
+    This test covers converting a legacy .json file into a ragged container, and reading it back with
+    truncation, padding and empty feature vectors.
+    """
+    buf = {"hosts": ["www.baidu.com", "www.zhihu.com"],
+           "labels": [0, 0, 1],
+           "direction": [[1, -1, 1], [], [-1, -1, 1, 1, -1]],
+           "time": [[0.0, 0.5, 1.5], [], [0.0, 0.25, 0.5, 0.75, 1.0]]}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        json_file = os.path.join(temp_dir, "raw.json")
+        container = os.path.join(temp_dir, "raw")
+        with open(json_file, "w") as f:
+            json.dump(buf, f)
+
+        json_to_ragged(json_file, container)
+
+        formatter = RaggedFormatter()
+        formatter.load(container)
+
+        assert np.all(formatter.get_feature_buf('hosts') == np.array(buf['hosts']))
+        directions = formatter.get_feature_buf('direction')
+        for i in range(len(buf['direction'])):
+            assert np.all(directions[i] == np.array(buf['direction'][i]))
+
+        formatter.transform(direction=4, time=2)
+
+        assert np.all(formatter._buf['labels'] == np.array([0, 0, 1]))
+        assert np.all(formatter._buf['direction'] == np.array([[1, -1, 1, 0], [0, 0, 0, 0], [-1, -1, 1, 1]]))
+        assert np.all(formatter._buf['time'] == np.array([[0.0, 0.5], [0, 0], [0.0, 0.25]]))
+
+def test_RaggedFormatter_3():
+    """
+    This test covers dumping more traces than NPY_MAXARGS (32 on numpy<2), and the dtype of the values, which is
+    promoted over the non-empty feature vectors only.
+    """
+    buf = {"hosts": ["www.baidu.com"],
+           "labels": [0] * 100,
+           "direction": [[1, -1] if i % 10 else [] for i in range(100)],
+           "time": [[0, 1] if i % 2 else [0.5] for i in range(100)]}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        container = os.path.join(temp_dir, "raw.ragged")
+        dump_ragged(buf, container)
+
+        direction = np.load(os.path.join(container, "direction.values.npy"))
+        time = np.load(os.path.join(container, "time.values.npy"))
+        assert direction.dtype == np.int64 and len(direction) == 180
+        assert time.dtype == np.float64 and len(time) == 150
+
 def test_DistriPcapFormatter_1():
     formatter = DistriPcapFormatter(length=10, keep_packets=False)
 
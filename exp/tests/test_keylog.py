@@ -0,0 +1,58 @@
+from WFlib.tools.keylog import *
+import os
+import shutil
+from tempfile import TemporaryDirectory
+
+
+keylog_file = "exp/test_dataset/realworld_dataset/decryption/keylog.txt"
+apple_file = "exp/test_dataset/realworld_dataset/decryption/www.apple.com.pcapng"
+
+def test_KeylogIndex_1():
+    with TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "keylog.txt")
+        with open(file, 'w') as f:
+            f.write("# SSL/TLS secrets log file, generated by NSS\n")
+            f.write("CLIENT_RANDOM AA01 secret1\n")
+            f.write("CLIENT_HANDSHAKE_TRAFFIC_SECRET bb02 secret2\n")
+            f.write("SERVER_HANDSHAKE_TRAFFIC_SECRET bb02 secret3\n")
+            f.write("CLIENT_TRAFFIC_SECRET_0 cc")  # Incomplete line
+
+        index = KeylogIndex(file)
+        assert len(index) == 2 and "aa01" in index and "cc" not in index
+        assert index.lines(["BB02"]) == ["CLIENT_HANDSHAKE_TRAFFIC_SECRET bb02 secret2",
+                                         "SERVER_HANDSHAKE_TRAFFIC_SECRET bb02 secret3"]
+
+        # Only the appended lines are parsed.
+        with open(file, 'a') as f:
+            f.write("03 secret4\n")
+        index.update()
+        assert index.lines(["cc03"]) == ["CLIENT_TRAFFIC_SECRET_0 cc03 secret4"]
+
+def test_KeylogIndex_2():
+    with TemporaryDirectory() as tmp_dir:
+        file = shutil.copy(apple_file, tmp_dir)
+        index = KeylogIndex(keylog_file)
+        minimal_keylog = index.minimal_keylog(file)
+
+        with open(keylog_file) as f:
+            keylog_lines = set(line.strip() for line in f)
+        with open(minimal_keylog) as f:
+            minimal_lines = [line.strip() for line in f]
+
+        assert minimal_keylog.endswith("www.apple.com.keylog")
+        assert 0 < len(minimal_lines) < len(keylog_lines)
+        assert set(minimal_lines) <= keylog_lines
+
+def test_KeylogIndex_3():
+    """
+    A failed tshark run should raise, and leave no (empty) minimal keylog behind to be reused.
+    """
+    with TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "missing.pcapng")
+        index = KeylogIndex(keylog_file)
+        try:
+            index.minimal_keylog(file)
+            assert False
+        except RuntimeError as e:
+            assert "tshark exited" in str(e)
+        assert not os.path.exists(os.path.join(tmp_dir, "missing.keylog"))
@@ -0,0 +1,56 @@
+from WFlib.tools.live import *
+import numpy as np
+import socket
+import threading
+
+
+def test_RingBuffer_1():
+    ring = RingBuffer(capacity=3)
+    for i in range(5):
+        ring.append(float(i), 1 if i % 2 == 0 else -1, 100 + i)
+
+    features = ring.snapshot()
+
+    assert len(ring) == 3 and ring.count == 5
+    assert np.array_equal(features['time'], [2., 3., 4.])
+    assert np.array_equal(features['direction'], [1, -1, 1])
+    assert np.array_equal(features['length'], [102, 103, 104])
+
+def test_LiveCapture_1():
+    live = LiveCapture(iface="lo", src={"10.0.0.1"})
+    received = []
+    live.subscribe(lambda key, time, direction, length: received.append((key, direction)))
+
+    live._consume([
+        "0.0\t10.0.0.1\t\t10.0.0.2\t\t60\t0\t\n",
+        "0.1\t10.0.0.2\t\t10.0.0.1\t\t1500\t0\t\n",
+        "0.2\t\tfe80::1\t\tfe80::2\t80\t\t3\n",
+    ])
+
+    assert received == [(('tcp', 0), 1), (('tcp', 0), -1), (('udp', 3), -1)]
+    assert live.flows == [('tcp', 0), ('udp', 3)]
+    assert np.array_equal(live.snapshot()['length'], [60, 1500, 80])
+    assert np.array_equal(live.snapshot(('tcp', 0))['direction'], [1, -1])
+
+def test_LiveCapture_2():
+    # Capture on loopback, all packets are sent from 127.0.0.1 and thus outgoing.
+    received = []
+    done = threading.Event()
+
+    def on_packet(key, time, direction, length):
+        received.append(direction)
+        if len(received) == 10:
+            done.set()
+
+    with LiveCapture(iface="lo", src={"127.0.0.1"}, capture_filter="udp port 39999") as live:
+        live.subscribe(on_packet)
+        assert live.wait_ready(timeout=30)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for _ in range(10):
+                sock.sendto(b"x" * 100, ("127.0.0.1", 39999))
+        assert done.wait(timeout=30)
+
+    features = live.snapshot()
+    assert len(features['direction']) == 10
+    assert np.all(features['direction'] == 1)
+    assert len(live.flows) == 1
@@ -0,0 +1,58 @@
+from WFlib.tools.manifest import *
+import multiprocessing
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+
+def _allocate(manifest_file, host, n, results):
+    with CaptureManifest(manifest_file) as manifest:
+        for _ in range(n):
+            results.append(manifest.allocate(host))
+
+def test_CaptureManifest_1():
+    with TemporaryDirectory() as base_dir:
+        # An existing capture without manifest, the allocation should follow decide_output_file_idx.
+        Path(f"{base_dir}/a.com").mkdir()
+        Path(f"{base_dir}/a.com/a.com_2.pcapng").touch()
+
+        with CaptureManifest(os.path.join(base_dir, "manifest.db"), base_dir=base_dir) as manifest:
+            assert manifest.allocate("a.com") == 3
+            assert manifest.allocate("a.com") == 4
+            assert manifest.allocate("b.com") == 0
+
+def test_CaptureManifest_2():
+    with TemporaryDirectory() as base_dir, multiprocessing.Manager() as manager:
+        manifest_file = os.path.join(base_dir, "manifest.db")
+        CaptureManifest(manifest_file).close()
+
+        results = manager.list()
+        workers = [multiprocessing.Process(target=_allocate, args=(manifest_file, "a.com", 10, results)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        assert sorted(results) == list(range(40))
+
+def test_CaptureManifest_3():
+    with TemporaryDirectory() as base_dir:
+        with CaptureManifest(os.path.join(base_dir, "manifest.db"), base_dir=base_dir) as manifest:
+            output_file = os.path.join(base_dir, "a.com_0.pcapng")
+            with open(output_file, 'wb') as f:
+                f.write(b"\x00" * 10)
+
+            visit_id = manifest.begin_visit("a.com", 0, output_file)
+            manifest.end_visit(visit_id, packets=3)
+            visit_id = manifest.begin_visit("a.com", 1, "a.com_1.pcapng")
+            manifest.end_visit(visit_id, error="timeout")
+            manifest.begin_visit("b.com", 0, "b.com_0.pcapng")  # Crashed
+
+            # a.com needs one more visit, b.com needs both.
+            assert manifest.recover() == 1
+            assert manifest.remaining(["a.com", "b.com"], repeat=2) == [("b.com", 0), ("a.com", 1), ("b.com", 1)]
+
+            ok = manifest.visits('ok')
+            assert len(ok) == 1 and ok[0]['bytes'] == 10 and ok[0]['packets'] == 3
+            assert manifest.visits('failed')[0]['error'] == "timeout"
+            assert manifest.visits('interrupted')[0]['host'] == "b.com"
@@ -0,0 +1,127 @@
+from WFlib.tools.model_utils import *
+from WFlib.tools import data_processor
+import os
+import json
+import torch
+import torch.nn.functional as F
+import numpy as np
+from tempfile import TemporaryDirectory
+
+
+class TinyModel(torch.nn.Module):
+    def __init__(self, num_classes):
+        super().__init__()
+        self.conv = torch.nn.Conv1d(1, 4, 5, padding=2)
+        self.fc = torch.nn.Linear(4 * 50, num_classes)
+
+    def forward(self, x):
+        return self.fc(torch.relu(self.conv(x)).flatten(1))
+
+def test_InferenceEngine_1():
+    """
+    This test covers the inference cache, and the evaluation methods reading the model outputs from it,
+    which should agree with running the model batch by batch.
+    """
+    torch.manual_seed(0)
+    num_classes = 5
+    X = torch.randn(num_classes * 12, 1, 50)
+    y = torch.arange(num_classes).repeat_interleave(12)
+    model = TinyModel(num_classes)
+    with torch.no_grad():
+        model.eval()
+        target = torch.cat([model(X[i:i + 7]) for i in range(0, len(X), 7)]).numpy()
+
+    with TemporaryDirectory() as tmp_dir:
+        cache_dir = os.path.join(tmp_dir, "cache")
+        engine = InferenceEngine(model, "cpu", batch_size=16, cache_dir=cache_dir)
+        outputs = engine.outputs(X)
+        assert np.allclose(outputs, target, atol=1e-5) and len(os.listdir(cache_dir)) == 1
+        assert engine.outputs(X) is outputs
+
+        # Another engine of the same checkpoint loads the outputs from the cache, another dataset or checkpoint misses it.
+        assert (InferenceEngine(model, "cpu", cache_dir=cache_dir).outputs(X) == outputs).all()
+        InferenceEngine(model, "cpu", cache_dir=cache_dir).outputs(X[:10])
+        InferenceEngine(TinyModel(num_classes), "cpu", cache_dir=cache_dir).outputs(X)
+        assert len(os.listdir(cache_dir)) == 3
+
+        data_iter = data_processor.load_iter(X, y, 8, False, 0)
+        out_file = os.path.join(tmp_dir, "result.json")
+        model_eval(model, data_iter, data_iter, "common", ["Accuracy"], out_file, num_classes,
+                   tmp_dir, "Closed-world", 1, "cpu", engine)
+        with open(out_file) as f:
+            assert json.load(f)["Accuracy"] == measurement(y.numpy(), target.argmax(axis=1), ["Accuracy"], 1)["Accuracy"]
+
+        # The kNN evaluation should agree with the monitor running the model.
+        y_true, y_pred = knn_monitor(model, "cpu", data_iter, data_iter, num_classes, 10)
+        assert (y_true == y.numpy()).all()
+        assert (knn_classify(outputs, y.numpy(), outputs, num_classes, 10, 0.1) == y_pred).all()
+
+def test_knn_predict_1():
+    """
+    The chunked search should agree with the dense similarity matrix and one-hot voting.
+    """
+    torch.manual_seed(0)
+    num_classes, k, t = 7, 10, 0.1
+    feature = F.normalize(torch.randn(50, 16), dim=1)
+    feature_bank = F.normalize(torch.randn(300, 16), dim=1).t().contiguous()
+    feature_labels = torch.randint(0, num_classes, (300,))
+
+    sim_weight, sim_indices = torch.mm(feature, feature_bank).topk(k=k, dim=-1)
+    one_hot_label = F.one_hot(feature_labels[sim_indices], num_classes).float()
+    target = torch.sum(one_hot_label * (sim_weight / t).exp().unsqueeze(dim=-1), dim=1).argmax(dim=-1)
+
+    for chunk_size in [1, 7, 64, 1000]:
+        pred_labels = knn_predict(feature, feature_bank, feature_labels, num_classes, k, t, chunk_size=chunk_size)
+        assert (pred_labels[:, 0] == target).all()
+
+def test_FeatureBank_1():
+    bank = FeatureBank(5, "cpu")
+    bank.update(torch.tensor([[1.0, 0], [2, 0], [0, 3]]), torch.tensor([0, 0, 1]))
+    assert len(bank) == 3 and torch.allclose(bank.features, torch.tensor([[1.0, 0], [1, 0], [0, 1]]))
+
+    # The oldest embeddings are replaced once the bank is full.
+    bank.update(-torch.eye(2).repeat(2, 1), torch.tensor([2, 3, 4, 5]))
+    assert len(bank) == 5
+    assert bank.labels.tolist() == [4, 5, 1, 2, 3] and bank.features[0].tolist() == [-1, 0]
+    bank.update(torch.ones(7, 2), torch.arange(7))
+    assert bank.labels.tolist() == [5, 6, 2, 3, 4]
+
+def test_amp_settings_1():
+    assert amp_settings("cpu", "none") == (None, False)
+    assert amp_settings("cpu", "auto") == (torch.bfloat16, False)
+    assert amp_settings(torch.device("cuda"), "auto") == (torch.float16, True)
+    assert amp_settings("cpu", "bf16") == (torch.bfloat16, False)
+    assert amp_settings("cuda:0", "fp16") == (torch.float16, True)
+    try:
+        amp_settings("cpu", "fp8")
+        assert False
+    except ValueError:
+        pass
+
+def test_model_train_1():
+    """
+    A one-epoch smoke test of the mixed-precision and channels-last modes, whose 2-D outputs of RF and Holmes are
+    channels-last, i.e., not viewable as 1-D ones.
+    """
+    from WFlib import models
+    torch.manual_seed(0)
+    num_classes = 4
+    X = torch.randn(16, 1, 2, 200)
+    y = torch.arange(num_classes).repeat(4)
+    model = models.RF(num_classes)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    data_iter = data_processor.load_iter(X, y, 8, False, 0)
+
+    with TemporaryDirectory() as tmp_dir:
+        out_file = os.path.join(tmp_dir, "base.pth")
+        model_train(model, optimizer, data_iter, data_iter, "CrossEntropyLoss", "Accuracy", ["Accuracy"], 1, out_file,
+                    num_classes, 1, "cpu", "None", amp="bf16", channels_last=True)
+        assert os.path.exists(out_file)
+        with open(train_log_file(out_file)) as f:
+            record = json.loads(f.readline())
+        assert record["samples"] == 16 and record["amp"] == "bf16" and record["channels_last"]
+
+    model = models.Holmes(num_classes).to(memory_format=torch.channels_last)
+    with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16):
+        outs = model(to_memory_format(torch.randn(4, 3, 2, 200), channels_last=True))
+    assert outs.shape[0] == 4
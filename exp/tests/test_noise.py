@@ -0,0 +1,26 @@
+from WFlib.tools.noise import *
+from collections import Counter
+
+
+def test_parse_noise_rows_1():
+    SNIs = {"api.snapcraft.io", "doh.pub"}
+    lines = [
+        "api.snapcraft.io\t1.1.1.1\t",      # ClientHello of a noise SNI
+        "www.apple.com\t2.2.2.2\t",         # ClientHello of the website
+        "doh.pub\t\t2001:db8::1",           # ClientHello of a noise SNI over IPv6
+        "api.snapcraft.io\t1.1.1.1\t",
+        "malformed",
+    ]
+    assert parse_noise_rows(lines, SNIs) == Counter({"1.1.1.1": 2, "2001:db8::1": 1})
+
+def test_NoiseFilter_1():
+    noise_filter = NoiseFilter([], max_hosts=2)
+    noise_filter.refresh()  # Nothing to resolve, keeps the test offline
+    assert noise_filter.bpf("tcp") == "tcp"
+
+    noise_filter.learn(Counter({"1.1.1.1": 3, "2.2.2.2": 1, "3.3.3.3": 2}))
+    assert noise_filter.bpf("tcp") == "(tcp) and not (host 1.1.1.1 or host 3.3.3.3)"
+
+    # The addresses of the protected hostnames are never excluded.
+    noise_filter._protected = {"1.1.1.1"}
+    assert noise_filter.addresses == ["3.3.3.3", "2.2.2.2"]
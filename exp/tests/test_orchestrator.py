@@ -0,0 +1,85 @@
+from WFlib.tools.orchestrator import *
+import multiprocessing
+import os
+import http.server
+import shutil
+import threading
+import urllib.request
+import pytest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+
+def _allocate(allocator, host, n, results):
+    for _ in range(n):
+        results.append(allocator.allocate(host))
+
+def _fetch(slot, url, results):
+    slot.enter()
+    with urllib.request.urlopen(url, timeout=10) as response:
+        results.put(response.read())
+
+def test_build_jobs_1():
+    jobs = build_jobs(["a.com\n", "b.com\n"], repeat=2)
+
+    assert jobs == [("a.com", 0), ("b.com", 0), ("a.com", 1), ("b.com", 1)]
+
+def test_NetnsSlot_1():
+    slot = NetnsSlot(3, subnet="10.201")
+
+    assert slot.name == "wflib3"
+    assert (slot.host_iface, slot.ns_iface) == ("wflib3h", "wflib3n")
+    assert (slot.host_addr, slot.ns_addr) == ("10.201.3.1", "10.201.3.2")
+    assert slot.network == "10.201.3.0/30"
+    assert len(slot.host_iface) < 16  # IFNAMSIZ
+
+def test_NetnsSlot_2():
+    """
+    This test covers a worker reaching a local HTTP server on host_addr from inside its namespace, which requires root.
+    """
+    if os.geteuid() != 0 or shutil.which("ip") is None or shutil.which("iptables") is None:
+        pytest.skip("Network namespaces require root, ip and iptables")
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"wflib")
+
+        def log_message(self, *args):
+            pass
+
+    slot = NetnsSlot(250, subnet="10.201")
+    slot.setup()
+    try:
+        server = http.server.HTTPServer((slot.host_addr, 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        results = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=_fetch, args=(slot, f"http://{slot.host_addr}:{server.server_port}/", results))
+        worker.start()
+        worker.join(30)
+        server.shutdown()
+        server.server_close()
+
+        assert worker.exitcode == 0 and results.get(timeout=1) == b"wflib"
+    finally:
+        slot.teardown()
+    assert not Path(f"/var/run/netns/{slot.name}").exists()
+
+def test_IndexAllocator_1():
+    with TemporaryDirectory() as base_dir, multiprocessing.Manager() as manager:
+        # An existing capture, the allocation should follow decide_output_file_idx.
+        Path(f"{base_dir}/a.com").mkdir()
+        Path(f"{base_dir}/a.com/a.com_4.pcapng").touch()
+
+        allocator = IndexAllocator(base_dir, manager)
+        results = manager.list()
+        workers = [multiprocessing.Process(target=_allocate, args=(allocator, "a.com", 5, results)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        assert sorted(results) == list(range(5, 25))
+        assert allocator.allocate("b.com") == 0
+        assert allocator.allocate("b.com") == 1
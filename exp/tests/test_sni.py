@@ -0,0 +1,103 @@
+from WFlib.tools.sni import *
+import os
+import glob
+import struct
+from tempfile import TemporaryDirectory
+
+
+google_file = "exp/test_dataset/realworld_dataset/www.google.com.pcapng"
+apple_file = "exp/test_dataset/realworld_dataset/decryption/www.apple.com.pcapng"
+tiktok_file = "exp/test_dataset/realworld_dataset/decryption/www.tiktok.com.pcapng"
+
+def test_quic_initial_keys_1():
+    # RFC 9001, Appendix A.1
+    key, iv, hp = quic_initial_keys(bytes.fromhex("8394c8f03e515708"))
+    assert key.hex() == "1f369613dd76d5467730efcbe3b1a22d"
+    assert iv.hex() == "fa044b2f42a3fd3b46fb255c"
+    assert hp.hex() == "9f50449e04a0e810283a1e9933adedd2"
+
+def test_extract_SNIs_1():
+    # The same as test_SNI_extract_2, including the SNIs in QUIC Initial packets.
+    target = {
+        "mobile.events.data.microsoft.com",
+        "firefox-settings-attachments.cdn.mozilla.net",
+        "www.google.com",
+        "csp.withgoogle.com",
+        "www.gstatic.com",
+        "ogads-pa.googleapis.com"
+    }
+    assert extract_SNIs(google_file) == target
+
+def test_SNI_stream_numbers_1():
+    # The same streams as test_h2data_SNI_intersect_1 and test_h3data_SNI_intersect_1.
+    assert SNI_stream_numbers(apple_file, ["is1-ssl.mzstatic.com"]) == ({'0', '1'}, set())
+    assert SNI_stream_numbers(tiktok_file, ["lf16-cdn-tos.tiktokcdn-us.com"]) == (set(), {'0'})
+
+def client_hello_record(server_name):
+    extension = struct.pack('!HBH', len(server_name) + 3, 0, len(server_name)) + server_name
+    body = b'\x03\x03' + bytes(range(32)) + b'\x00' + b'\x00\x02\x13\x01' + b'\x01\x00' + \
+        struct.pack('!HHH', len(extension) + 4, 0, len(extension)) + extension + b'\x00' * 300  # Padding
+    handshake = b'\x01' + len(body).to_bytes(3, 'big') + body
+    return b'\x16\x03\x01' + struct.pack('!H', len(handshake)) + handshake
+
+def tcp_packet(seq, payload, flags=0x18, flags_offset=0x4000):
+    tcp = struct.pack('!HHIIBBHHH', 40000, 443, seq, 0, 5 << 4, flags, 65535, 0, 0) + payload
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp), 0, flags_offset, 64, 6, 0,
+                     bytes([10, 0, 0, 1]), bytes([10, 0, 0, 2]))
+    return ip + tcp
+
+def write_pcap(file, packets):
+    with open(file, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 101))  # Raw IP
+        for data in packets:
+            f.write(struct.pack('<IIII', 0, 0, len(data), len(data)) + data)
+
+def test_client_hellos_1():
+    """
+    This test covers a ClientHello split into two TCP segments, which arrive out of order.
+    """
+    record = client_hello_record(b"www.example.com")
+
+    with TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "split.pcap")
+        write_pcap(file, [tcp_packet(1000 + 100, record[100:]), tcp_packet(1000, record[:100])])
+
+        hellos = client_hellos(file)
+        assert len(hellos) == 1
+        assert hellos[0].server_name == "www.example.com" and hellos[0].frame == 2
+        assert hellos[0].random == bytes(range(32)).hex()
+        assert (hellos[0].proto, hellos[0].stream, hellos[0].dst, hellos[0].dport) == ('tcp', 0, "10.0.0.2", 443)
+
+def test_client_hellos_2():
+    """
+    The native stream numbering is ambiguous upon reused TCP ports or IP fragments, but not upon a retransmitted SYN.
+    """
+    record = client_hello_record(b"www.example.com")
+    syn, reused_syn = tcp_packet(999, b'', flags=0x02), tcp_packet(5000, b'', flags=0x02)
+    fin = tcp_packet(1000 + len(record), b'', flags=0x11)
+
+    with TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "a.pcap")
+        write_pcap(file, [syn, syn, tcp_packet(1000, record)])
+        assert [hello.stream for hello in client_hellos(file, strict=True)] == [0]
+
+        for packets in [[syn, tcp_packet(1000, record), fin, reused_syn],
+                        [tcp_packet(1000, record, flags_offset=0x2000)]]:
+            write_pcap(file, packets)
+            client_hellos(file)
+            try:
+                client_hellos(file, strict=True)
+                assert False
+            except AmbiguousStreamError:
+                pass
+
+def test_SNI_stream_numbers_2():
+    """
+    The native stream numbers are fed into tshark display filters, so they should agree with tshark on every
+    realworld capture.
+    """
+    files = glob.glob("exp/test_dataset/realworld_dataset/**/*.pcap*", recursive=True)
+    assert len(files) > 0
+    for file in files:
+        for SNI in extract_SNIs(file):
+            assert SNI_stream_numbers(file, [SNI]) == tshark_SNI_stream_numbers(file, [SNI]), (file, SNI)
@@ -45,6 +45,11 @@ parser.add_argument("--save_metric", type=str, default="F1-score",
                     help="Save the model when the metric reaches its maximum value on the validation set")
 parser.add_argument("--checkpoints", type=str, default="./checkpoints/", help="Location of model checkpoints")
 parser.add_argument("--load_file", type=str, default=None, help="The pre-trained model file")
+parser.add_argument("--amp", type=str, nargs="?", const="auto", default="none",
+                    help="Mixed precision, options=[none, auto, bf16, fp16], auto (the default of --amp) uses bf16 on CPU and fp16 on CUDA")
+parser.add_argument("--channels_last", action="store_true", help="Use the channels-last memory format for the 2-D convolutions (RF, Holmes)")
+parser.add_argument("--knn_bank_size", type=int, default=None,
+                    help="Number of training embeddings kept for the kNN validation of TripletMarginLoss/SupConLoss, default=the training set size")
 parser.add_argument("--save_name", type=str, default="base", help="Name used to save the model")
 
 # Parse arguments
@@ -125,5 +130,8 @@ model_utils.model_train(
     num_classes,
     args.num_tabs,
     device,
-    args.lradj
+    args.lradj,
+    amp=args.amp,
+    channels_last=args.channels_last,
+    knn_bank_size=args.knn_bank_size
 )
\ No newline at end of file
@@ -26,6 +26,7 @@ setup(
         "captum",
         "scapy",
         "selenium",
-        "pyshark"
+        "pyshark",
+        "cryptography"
     ],
 )
\ No newline at end of file